@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""
+Measure the cold start of ev-remapper-control
+
+Runs bin/ev-remapper-control as a new process again and again against a
+stand-in for the daemon that answers every request on the control socket
+right away, so the numbers are only about starting the client. Needs no
+devices and no running service.
+
+    python3 -m benchmarks.control
+    python3 -m benchmarks.control --command inject --runs 50
+"""
+
+from argparse import ArgumentParser
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from evremapper.control_socket import _read_line
+
+CONTROL = os.path.join(os.path.dirname(__file__), "..", "bin", "ev-remapper-control")
+
+COMMANDS = {
+    "inject": ["inject", "/dev/input/event0", "preset"],
+    "stop-injecting": ["stop-injecting", "/dev/input/event0"],
+}
+
+
+def serve(server: socket.socket, requests: list):
+    while True:
+        try:
+            connection, _ = server.accept()
+        except OSError:
+            # closed
+            return
+
+        with connection:
+            requests.append(json.loads(_read_line(connection)))
+            connection.sendall(b'{"status": true}\n')
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--command", choices=sorted(COMMANDS), default="stop-injecting")
+    parser.add_argument("--runs", type=int, default=30)
+    options = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "control.sock")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(4)
+    requests = []
+    threading.Thread(target=serve, args=(server, requests), daemon=True).start()
+
+    environment = dict(os.environ, EV_REMAPPER_SOCKET=path)
+    environment["PYTHONPATH"] = os.pathsep.join(
+        [os.path.join(os.path.dirname(__file__), "..")] + sys.path
+    )
+    command = [sys.executable, CONTROL] + COMMANDS[options.command]
+
+    times = []
+    for _ in range(options.runs):
+        start = time.perf_counter()
+        subprocess.run(command, env=environment, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+
+    server.close()
+    os.unlink(path)
+    os.rmdir(directory)
+
+    if len(requests) != options.runs:
+        raise RuntimeError(f"expected {options.runs} requests, got {len(requests)}")
+
+    times.sort()
+    print(
+        f"{options.command:<15} runs {len(times):>4}  "
+        f"min {times[0] * 1000:>6.1f} ms  p50 {statistics.median(times) * 1000:>6.1f} ms  "
+        f"max {times[-1] * 1000:>6.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
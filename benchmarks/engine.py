@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+"""
+Compare one Injector process per group with the shared InjectionEngine
+
+Creates N virtual keyboards through uinput, injects all of them in both
+modes and reports the memory of the processes doing the injection and the
+latency of a key press going through ev-remapper. Needs root for
+/dev/uinput and for grabbing.
+
+    sudo python3 -m benchmarks.engine --groups 8
+"""
+
+from argparse import ArgumentParser
+import os
+import select
+import statistics
+import time
+
+import evdev
+from evdev.ecodes import EV_KEY, EV_SYN, KEY_A, KEY_B, SYN_REPORT
+
+from evremapper.devices import _DeviceGroup
+from evremapper.configs.context import RuntimeContext
+from evremapper.engine import InjectionEngine
+from evremapper.injector import Injector, RUNNING, udev_name
+
+try:
+    # the daemon has these loaded when it forks, fork with the same baggage
+    import pydbus  # noqa: F401
+    from gi.repository import GLib  # noqa: F401
+except ImportError:
+    pass
+
+
+def memory(pid):
+    """Get (rss, pss, uss) of a process in KiB"""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+
+    uss = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    return fields.get("Rss", 0), fields.get("Pss", 0), uss
+
+
+def find_output(name):
+    for path in evdev.list_devices():
+        device = evdev.InputDevice(path)
+        if device.name == name:
+            return device
+
+        device.close()
+
+    raise RuntimeError(f"output device {name!r} not found")
+
+
+def wait_running(injectors, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if all(injector.get_state() == RUNNING for injector in injectors):
+            return
+
+        time.sleep(0.01)
+
+    raise RuntimeError("injections didn't start")
+
+
+def measure_latency(sources, outputs, presses):
+    latencies = []
+    for _ in range(presses):
+        for source, output in zip(sources, outputs):
+            for value in (1, 0):
+                start = time.perf_counter()
+                source.write(EV_KEY, KEY_A, value)
+                source.write(EV_SYN, SYN_REPORT, 0)
+                while True:
+                    select.select([output.fd], [], [])
+                    if any(event.code == KEY_B for event in output.read()):
+                        break
+
+                latencies.append(time.perf_counter() - start)
+
+    return latencies
+
+
+def run(mode, sources, context, presses):
+    groups = [
+        _DeviceGroup([source.device.path], [source.name], ["keyboard"], source.name)
+        for source in sources
+    ]
+
+    engine = None
+    if mode == "shared":
+        engine = InjectionEngine()
+        injectors = [engine.inject(group, context) for group in groups]
+        pids = [engine.pid]
+    else:
+        injectors = [Injector(group, context) for group in groups]
+        for injector in injectors:
+            injector.start()
+
+        pids = [injector.pid for injector in injectors]
+
+    wait_running(injectors)
+    # let udev finish with the new devices
+    time.sleep(0.5)
+
+    outputs = [find_output(udev_name(source.name)) for source in sources]
+    latencies = measure_latency(sources, outputs, presses)
+
+    totals = [sum(values) for values in zip(*[memory(pid) for pid in pids])]
+
+    for output in outputs:
+        output.close()
+
+    for injector in injectors:
+        injector.stop_injecting()
+
+    if engine is not None:
+        engine._msg_pipe[1].close()
+        engine.join()
+    else:
+        for injector in injectors:
+            injector.join()
+
+    for injector in injectors:
+        injector.release()
+
+    latencies.sort()
+    print(
+        f"{mode:<8} processes {len(pids):>3}  "
+        f"rss {totals[0] / 1024:>7.1f} MiB  pss {totals[1] / 1024:>7.1f} MiB  "
+        f"uss {totals[2] / 1024:>7.1f} MiB  "
+        f"latency p50 {statistics.median(latencies) * 1e6:>6.0f} us  "
+        f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:>6.0f} us"
+    )
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--groups", type=int, default=8)
+    parser.add_argument("--presses", type=int, default=200)
+    options = parser.parse_args()
+
+    if not os.access("/dev/uinput", os.W_OK):
+        raise SystemExit("needs write access to /dev/uinput")
+
+    sources = [
+        evdev.UInput({EV_KEY: [KEY_A, KEY_B]}, name=f"ev-remapper benchmark {i}")
+        for i in range(options.groups)
+    ]
+    context = RuntimeContext({"KEY_A": "KEY_B"})
+
+    try:
+        for mode in ("process", "shared"):
+            run(mode, sources, context, options.presses)
+    finally:
+        for source in sources:
+            source.close()
+
+
+if __name__ == "__main__":
+    main()
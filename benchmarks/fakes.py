@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+"""In-memory stand-ins for evdev.InputDevice and evdev.UInput"""
+
+import asyncio
+import fcntl
+import os
+
+from typing import Iterable, Tuple
+
+from evdev.eventio_async import EventIO
+
+from evremapper.frame_writer import EVENT_STRUCT, EVENT_SIZE
+
+F_SETPIPE_SZ = 1031
+
+Event = Tuple[int, int, int, int, int]  # sec, usec, type, code, value
+
+
+class FakeInputDevice(EventIO):
+    """
+    Replays a scripted list of events like a device in /dev/input would
+
+    The events are fed into a pipe from the event loop whenever it has room,
+    so the InputControl under test reads them with exactly the same calls it
+    uses for real devices, async_read_loop or read on the fd.
+    """
+
+    def __init__(self, events: Iterable[Event], repeat: int = 1, name: str = "fake device"):
+        self.name = name
+        self.path = f"/dev/input/fake-{id(self)}"
+
+        self._script = memoryview(b"".join(EVENT_STRUCT.pack(*event) for event in events))
+        self._remaining = repeat
+        self._offset = 0
+
+        self.fd, self._write_fd = os.pipe()
+        os.set_blocking(self.fd, False)
+        os.set_blocking(self._write_fd, False)
+        try:
+            fcntl.fcntl(self._write_fd, F_SETPIPE_SZ, 1 << 20)
+        except OSError:
+            # not allowed to go above /proc/sys/fs/pipe-max-size
+            pass
+
+    def active_keys(self):
+        return []
+
+    def capabilities(self, absinfo=True):
+        # looked at after the kernel dropped events
+        return {}
+
+    def start_feeding(self, loop: asyncio.AbstractEventLoop):
+        loop.add_writer(self._write_fd, self._feed, loop)
+
+    def write_events(self, events: bytes):
+        """Make events readable right away, besides the scripted ones"""
+        os.write(self._write_fd, events)
+
+    def _feed(self, loop):
+        while self._remaining > 0:
+            try:
+                self._offset += os.write(self._write_fd, self._script[self._offset:])
+            except BlockingIOError:
+                return
+
+            if self._offset == len(self._script):
+                self._offset = 0
+                self._remaining -= 1
+
+        loop.remove_writer(self._write_fd)
+
+    def close(self):
+        for fd in (self.fd, self._write_fd):
+            os.close(fd)
+
+
+class FakeUInput:
+    """A counting sink that takes the place of a uinput"""
+
+    def __init__(self, name: str = "fake uinput"):
+        self.name = name
+        self.fd = os.memfd_create("ev-remapper-fake-uinput")
+        self._counted = 0
+
+    def write(self, etype: int, code: int, value: int):
+        os.write(self.fd, EVENT_STRUCT.pack(0, 0, etype, code, value))
+
+    def syn(self):
+        self.write(0, 0, 0)
+
+    def events_written(self) -> int:
+        size = os.fstat(self.fd).st_size
+        if size > 1 << 24:
+            # don't let the memfd grow forever
+            self._counted += size // EVENT_SIZE
+            os.ftruncate(self.fd, 0)
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            size = 0
+
+        return self._counted + size // EVENT_SIZE
+
+    def read_all(self) -> bytes:
+        """Everything written since the sink was created or last truncated"""
+        return os.pread(self.fd, os.fstat(self.fd).st_size, 0)
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""
+Compare the per-event UInput.write path with the frame-batched FrameWriter
+
+Both paths write to /dev/null by default, so the numbers show the cost of the
+python and syscall overhead that is paid on top of what the input subsystem
+does anyway. Pass --uinput to write to a real virtual device instead (needs
+access to /dev/uinput).
+
+    python3 -m benchmarks.frame_writer
+"""
+
+from argparse import ArgumentParser
+import os
+import time
+
+import evdev
+from evdev.ecodes import EV_REL, EV_KEY, EV_SYN, REL_X, REL_Y, BTN_LEFT, SYN_REPORT
+
+from evremapper.frame_writer import FrameWriter
+
+
+class _Sink:
+    """Just enough of a UInput to call UInput.write with"""
+
+    def __init__(self, fd):
+        self.fd = fd
+
+
+# a mouse moving diagonally, the most common frame of a high poll rate mouse
+MOTION_FRAME = ((EV_REL, REL_X, 1), (EV_REL, REL_Y, -1), (EV_SYN, SYN_REPORT, 0))
+# a click while moving
+CLICK_FRAME = ((EV_KEY, BTN_LEFT, 1), (EV_REL, REL_X, 1), (EV_SYN, SYN_REPORT, 0))
+
+
+def per_event(sink, frame, frames):
+    write = evdev.UInput.write
+    start = time.perf_counter()
+    for _ in range(frames):
+        for event in frame:
+            write(sink, *event)
+
+    return time.perf_counter() - start
+
+
+def batched(sink, frame, frames):
+    write = FrameWriter(sink.fd).write
+    start = time.perf_counter()
+    for _ in range(frames):
+        for event in frame:
+            write(*event)
+
+    return time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--frames", type=int, default=200000)
+    parser.add_argument("--uinput", action="store_true", help="write to a real uinput device")
+    options = parser.parse_args()
+
+    if options.uinput:
+        device = evdev.UInput({EV_KEY: [BTN_LEFT], EV_REL: [REL_X, REL_Y]}, name="ev-remapper benchmark")
+        sink = _Sink(device.fd)
+    else:
+        device = None
+        sink = _Sink(os.open(os.devnull, os.O_RDWR))
+
+    for name, frame in (("motion", MOTION_FRAME), ("click", CLICK_FRAME)):
+        events = options.frames * len(frame)
+        for path, bench in (("per-event", per_event), ("batched", batched)):
+            elapsed = bench(sink, frame, options.frames)
+            print(
+                f"{name:<7} {path:<10} {events / elapsed:>12,.0f} events/s "
+                f"{elapsed / events * 1e9:>8.1f} ns/event"
+            )
+
+    if device is not None:
+        device.close()
+    else:
+        os.close(sink.fd)
+
+
+if __name__ == "__main__":
+    main()
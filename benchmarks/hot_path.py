@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the InputControl hot path without any real devices
+
+Drives InputControl and RawInputControl with scripted keyboard typing, 8 kHz
+mouse motion and gamepad workloads from FakeInputDevice into a FakeUInput
+and reports throughput, CPU time per event, how many memory blocks each
+event left allocated and the peak of the memory allocated while doing so.
+Both readers have to forward exactly the same events.
+
+    python3 -m benchmarks.hot_path
+    python3 -m benchmarks.hot_path --workload mouse-8khz --frames 200000
+    python3 -m benchmarks.hot_path --workload keyboard --chords 500
+    python3 -m benchmarks.hot_path --counters
+"""
+
+from argparse import ArgumentParser
+import asyncio
+import sys
+import time
+import tracemalloc
+
+from evdev.ecodes import EV_KEY
+
+from evremapper.configs.context import RuntimeContext
+from evremapper.input_control import InputControl, RawInputControl
+from evremapper.latency import LatencyTracer
+from evremapper.metrics import InjectionCounters
+from evremapper.frame_writer import EVENT_STRUCT
+
+from benchmarks.fakes import FakeInputDevice, FakeUInput
+from benchmarks.workloads import WORKLOADS, MAPPINGS, chords
+
+READERS = {"evdev": InputControl, "raw": RawInputControl}
+
+
+def _without_time(output):
+    # uinput ignores the timestamps, they don't have to match
+    return [event[2:] for event in EVENT_STRUCT.iter_unpack(output)]
+
+
+def forwarded_count(events):
+    # button-hold events are not forwarded
+    return sum(1 for event in events if not (event[2] == EV_KEY and event[4] == 2))
+
+
+async def _drive(input_control, source, sink, expected):
+    loop = asyncio.get_running_loop()
+    source.start_feeding(loop)
+    task = loop.create_task(input_control.run())
+
+    while sink.events_written() < expected:
+        if task.done():
+            task.result()
+            raise RuntimeError("the InputControl stopped before forwarding everything")
+
+        await asyncio.sleep(0.001)
+
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def run(reader, events, context, trace=False, measure_memory=False, count=False):
+    """
+    Forward all events once
+
+    Returns (seconds, cpu seconds, peak bytes, blocks, output). blocks is by
+    how many the number of allocated memory blocks grew while forwarding.
+    """
+    source = FakeInputDevice(events)
+    sink = FakeUInput()
+    tracer = LatencyTracer(wakeup=True) if trace else None
+    counters = InjectionCounters() if count else None
+    input_control = READERS[reader](
+        source, sink, context, tracer, counters=counters
+    )
+    expected = forwarded_count(events)
+
+    loop = asyncio.new_event_loop()
+    if measure_memory:
+        tracemalloc.start()
+
+    blocks = sys.getallocatedblocks()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    loop.run_until_complete(_drive(input_control, source, sink, expected))
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    blocks = sys.getallocatedblocks() - blocks
+
+    peak = 0
+    if measure_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    loop.close()
+    output = sink.read_all()
+    source.close()
+    sink.close()
+    if tracer is not None:
+        tracer.release()
+
+    if counters is not None:
+        forwarded = counters.values[InjectionCounters.EVENTS_FORWARDED]
+        counters.release()
+        if forwarded != len(output) // EVENT_STRUCT.size:
+            raise SystemExit(f"{reader}: counted {forwarded} forwarded events")
+
+    return elapsed, cpu, peak, blocks, output
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--frames", type=int, default=50000, help="frames per workload")
+    parser.add_argument("--workload", choices=list(WORKLOADS), action="append")
+    parser.add_argument("--reader", choices=list(READERS), action="append")
+    parser.add_argument("--trace", action="store_true", help="enable latency tracing")
+    parser.add_argument("--chords", type=int, default=0, help="add this many chord mappings")
+    parser.add_argument("--counters", action="store_true", help="count events like injectors do")
+    options = parser.parse_args()
+
+    context = RuntimeContext({**MAPPINGS, **chords(options.chords)})
+
+    print(
+        f"{'workload':<11} {'reader':<6} {'events':>8} {'events/s':>12} "
+        f"{'cpu ns/event':>13} {'blocks/event':>13} {'alloc peak':>11}"
+    )
+    for workload in options.workload or list(WORKLOADS):
+        events = WORKLOADS[workload](options.frames)
+        outputs = {}
+
+        for reader in options.reader or list(READERS):
+            elapsed, cpu, _, blocks, output = run(
+                reader, events, context, options.trace, count=options.counters
+            )
+            # tracemalloc slows everything down, measure memory separately
+            _, _, peak, _, _ = run(
+                reader, events, context, options.trace, True, options.counters
+            )
+            outputs[reader] = _without_time(output)
+
+            count = forwarded_count(events)
+            print(
+                f"{workload:<11} {reader:<6} {count:>8} {count / elapsed:>12,.0f} "
+                f"{cpu / count * 1e9:>13.0f} {blocks / count:>13.4f} {peak / 1024:>8.1f} KiB"
+            )
+
+        if any(output != outputs[reader] for output in outputs.values()):
+            raise SystemExit(f"{workload}: the readers forwarded different events")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+"""
+Measure how fast a running InputControl switches to other mappings
+
+Forwards a workload from a FakeInputDevice while swapping between two
+mappings again and again, and reports the time from asking for the swap
+until the new mappings are in use, which includes waiting for the end of
+the current frame. No events may be lost on the way.
+
+    python3 -m benchmarks.reload
+    python3 -m benchmarks.reload --workload keyboard --swaps 2000
+"""
+
+from argparse import ArgumentParser
+import asyncio
+import statistics
+import time
+
+from evremapper.configs.context import RuntimeContext
+
+from benchmarks.fakes import FakeInputDevice, FakeUInput
+from benchmarks.hot_path import READERS, forwarded_count
+from benchmarks.workloads import WORKLOADS, MAPPINGS
+
+# the second set of mappings, swaps alternate between both
+OTHER_MAPPINGS = {
+    "KEY_CAPSLOCK": "KEY_ESC",
+    "KEY_A": "KEY_B",
+    "BTN_LEFT": "BTN_RIGHT",
+    "BTN_SOUTH": "BTN_NORTH",
+}
+
+
+def _timed(input_control_class):
+    class Timed(input_control_class):
+        """Notes when a requested swap actually happened"""
+
+        def __init__(self, *args):
+            self.requested_at = 0
+            self.swap_times = []
+            super().__init__(*args)
+
+        def reload(self, context):
+            if not self.requested_at:
+                self.requested_at = time.perf_counter_ns()
+
+            super().reload(context)
+
+        def _context_changed(self):
+            super()._context_changed()
+            if self.requested_at:
+                self.swap_times.append(time.perf_counter_ns() - self.requested_at)
+                self.requested_at = 0
+
+    return Timed
+
+
+async def _drive(input_control, source, sink, expected, contexts, swaps):
+    loop = asyncio.get_running_loop()
+    source.start_feeding(loop)
+    task = loop.create_task(input_control.run())
+
+    swapped = 0
+    while sink.events_written() < expected:
+        if task.done():
+            task.result()
+            raise RuntimeError("the InputControl stopped before forwarding everything")
+
+        if swapped < swaps and not input_control.requested_at:
+            swapped += 1
+            input_control.reload(contexts[swapped % 2])
+
+        await asyncio.sleep(0)
+
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def run(reader, events, swaps):
+    contexts = [RuntimeContext(MAPPINGS), RuntimeContext(OTHER_MAPPINGS)]
+    source = FakeInputDevice(events)
+    sink = FakeUInput()
+    input_control = _timed(READERS[reader])(source, sink, contexts[0])
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(
+        _drive(input_control, source, sink, forwarded_count(events), contexts, swaps)
+    )
+    loop.close()
+    source.close()
+    sink.close()
+
+    return sorted(input_control.swap_times)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), default="mouse-8khz")
+    parser.add_argument("--frames", type=int, default=50000)
+    parser.add_argument("--swaps", type=int, default=1000)
+    options = parser.parse_args()
+
+    events = WORKLOADS[options.workload](options.frames)
+
+    for reader in READERS:
+        times = run(reader, events, options.swaps)
+        if not times:
+            print(f"{reader:<6} the workload ended before any swap")
+            continue
+
+        print(
+            f"{reader:<6} swaps {len(times):>6}  "
+            f"p50 {statistics.median(times) / 1000:>7.1f} us  "
+            f"p99 {times[int(len(times) * 0.99)] / 1000:>7.1f} us  "
+            f"max {times[-1] / 1000:>7.1f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+"""
+Replay a trace that ev-remapper-control start-recording made
+
+Feeds the events that the injection read from its devices through
+InputControl or RawInputControl with the mappings of a preset, either with
+the pauses between frames that were recorded or as fast as possible, and
+reports how long forwarding them took. If the trace still has everything
+that was recorded, what was forwarded is compared with what the injection
+wrote back then.
+
+    python3 -m benchmarks.replay /tmp/keyboard.trace --preset presets/gaming.json
+    python3 -m benchmarks.replay /tmp/keyboard.trace --reader raw --speed max
+"""
+
+from argparse import ArgumentParser
+import asyncio
+import time
+
+from evdev.ecodes import EV_SYN, SYN_REPORT
+
+from evremapper.configs.context import RuntimeContext
+from evremapper.configs.mapping_cache import compile_mappings
+from evremapper.metrics import InjectionCounters
+from evremapper.recording import read_trace
+from evremapper.frame_writer import EVENT_STRUCT
+
+from benchmarks.fakes import FakeInputDevice, FakeUInput
+from benchmarks.hot_path import READERS, _without_time
+
+SPEEDS = ["original", "max"]
+
+# gives up waiting for the InputControl to read everything after this long
+# without progress
+STALL_SECONDS = 1.0
+
+
+def frames(events):
+    """
+    Split events into frames, (microseconds since the first one, packed events)
+
+    An incomplete frame at the end is left out, the kernel wouldn't have
+    made it readable.
+    """
+    result = []
+    start = None
+    frame = []
+    for event in events:
+        frame.append(event)
+        if event[2] != EV_SYN or event[3] != SYN_REPORT:
+            continue
+
+        sec, usec = frame[0][:2]
+        if start is None:
+            start = sec * 1000000 + usec
+
+        result.append(
+            (sec * 1000000 + usec - start, b"".join(EVENT_STRUCT.pack(*event) for event in frame))
+        )
+        frame = []
+
+    return result
+
+
+async def _feed(source, timed_frames, start):
+    loop = asyncio.get_running_loop()
+    for offset, events in timed_frames:
+        # a timer per frame would mix up frames that happened at the same time
+        delay = start + offset / 1000000 - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        source.write_events(events)
+
+
+async def _drive(input_control, source, timed_frames, counters, original_speed):
+    loop = asyncio.get_running_loop()
+    task = loop.create_task(input_control.run())
+    expected = sum(len(events) for _, events in timed_frames) // EVENT_STRUCT.size
+
+    start = loop.time()
+    if original_speed:
+        feeding = loop.create_task(_feed(source, timed_frames, start))
+        fed_at = start + timed_frames[-1][0] / 1000000
+    else:
+        for _, events in timed_frames:
+            source.write_events(events)
+
+        fed_at = start
+
+    read = 0
+    progress_at = start
+    while read < expected:
+        if task.done():
+            task.result()
+            raise RuntimeError("the InputControl stopped before reading everything")
+
+        await asyncio.sleep(0.001)
+        if counters.values[InjectionCounters.EVENTS_READ] != read:
+            read = counters.values[InjectionCounters.EVENTS_READ]
+            progress_at = loop.time()
+        elif loop.time() > max(fed_at, progress_at) + STALL_SECONDS:
+            # the evdev reader counts the events that were discarded after
+            # an overflow late
+            break
+
+    if original_speed:
+        await feeding
+
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def replay(reader, trace, context, original_speed):
+    """Forward the received events of the trace, returns (seconds, output)"""
+    source = FakeInputDevice([], name="replayed device")
+    sink = FakeUInput()
+    counters = InjectionCounters()
+    input_control = READERS[reader](source, sink, context, counters=counters)
+    timed_frames = frames(trace.received)
+    if not timed_frames:
+        raise SystemExit("the trace has no complete frames")
+
+    loop = asyncio.new_event_loop()
+    start = time.perf_counter()
+    loop.run_until_complete(
+        _drive(input_control, source, timed_frames, counters, original_speed)
+    )
+    elapsed = time.perf_counter() - start
+
+    loop.close()
+    output = sink.read_all()
+    source.close()
+    sink.close()
+    counters.release()
+    return elapsed, output
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("trace", help="the file that was recorded into")
+    parser.add_argument("--preset", help="the mappings to use, none by default")
+    parser.add_argument("--reader", choices=list(READERS), default="evdev")
+    parser.add_argument("--speed", choices=SPEEDS, default="original")
+    options = parser.parse_args()
+
+    trace = read_trace(options.trace)
+    context = compile_mappings(options.preset) if options.preset else RuntimeContext({})
+
+    elapsed, output = replay(options.reader, trace, context, options.speed == "original")
+    forwarded = len(output) // EVENT_STRUCT.size
+    received = len(trace.received)
+    print(
+        f"replayed {received} events with the {options.reader} reader in {elapsed:.3f} s, "
+        f"{received / elapsed:,.0f} events/s, forwarded {forwarded}"
+    )
+
+    if received != trace.received_total or len(trace.emitted) != trace.emitted_total:
+        print("the oldest events were overwritten, not comparing with the recording")
+        return
+
+    recorded = [event[2:] for event in trace.emitted]
+    replayed = _without_time(output)
+    if recorded == replayed:
+        print(f"forwarded the same {forwarded} events as the injection")
+        return
+
+    differs_at = next(
+        (i for i, (a, b) in enumerate(zip(recorded, replayed)) if a != b),
+        min(len(recorded), len(replayed)),
+    )
+    print(
+        f"the injection wrote {len(recorded)} events, the replay differs from "
+        f"them at event {differs_at}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+"""Scripted event sequences that resemble what real devices report"""
+
+import random
+
+from evdev.ecodes import (
+    ecodes,
+    EV_SYN,
+    EV_KEY,
+    EV_REL,
+    EV_ABS,
+    EV_MSC,
+    SYN_REPORT,
+    MSC_SCAN,
+    REL_X,
+    REL_Y,
+    REL_WHEEL,
+    BTN_LEFT,
+    BTN_SOUTH,
+    BTN_EAST,
+    BTN_TL,
+    BTN_TR,
+    ABS_X,
+    ABS_Y,
+    ABS_RX,
+    ABS_RY,
+    ABS_Z,
+    ABS_RZ,
+    ABS_HAT0X,
+    KEY_A,
+    KEY_Z,
+    KEY_SPACE,
+    KEY_LEFTSHIFT,
+    KEY_CAPSLOCK,
+)
+
+# what the workloads are remapped with
+MAPPINGS = {
+    "KEY_CAPSLOCK": "KEY_LEFTCTRL",
+    "KEY_Q": "KEY_W",
+    "BTN_SIDE": "BTN_MIDDLE",
+    "BTN_SOUTH": "BTN_EAST",
+    "BTN_EAST": "BTN_SOUTH",
+}
+
+
+# modifiers of the chords that are added with hot_path --chords, none of them
+# is held by the workloads, so every key press looks for a chord in vain
+_CHORD_MODIFIERS = ["KEY_LEFTCTRL", "KEY_LEFTALT", "KEY_RIGHTCTRL", "KEY_RIGHTALT", "KEY_LEFTMETA"]
+
+
+def chords(count: int) -> dict:
+    """count chords like "KEY_LEFTALT+KEY_A" that all map to KEY_ENTER"""
+    keys = sorted(
+        name for name, code in ecodes.items()
+        if name.startswith("KEY_") and code < 200 and name not in _CHORD_MODIFIERS
+    )
+    result = {}
+    for modifier in _CHORD_MODIFIERS:
+        for key in keys:
+            if len(result) == count:
+                return result
+
+            result[f"{modifier}+{key}"] = "KEY_ENTER"
+
+    return result
+
+
+class _Clock:
+    def __init__(self):
+        self.usec = 0
+
+    def tick(self, usec):
+        self.usec += usec
+
+    def stamp(self, ev_type, code, value):
+        return self.usec // 1000000, self.usec % 1000000, ev_type, code, value
+
+
+def keyboard(frames: int, seed: int = 0):
+    """Typing at ~10 keys per second with scan codes, shift and key repeats"""
+    rng = random.Random(seed)
+    clock = _Clock()
+    events = []
+    letters = list(range(KEY_A, KEY_Z + 1)) + [KEY_SPACE, KEY_CAPSLOCK]
+
+    while len(events) < frames * 3:
+        key = rng.choice(letters)
+        shift = rng.random() < 0.1
+        if shift:
+            events += [clock.stamp(EV_MSC, MSC_SCAN, KEY_LEFTSHIFT), clock.stamp(EV_KEY, KEY_LEFTSHIFT, 1)]
+            events.append(clock.stamp(EV_SYN, SYN_REPORT, 0))
+            clock.tick(30000)
+
+        events += [clock.stamp(EV_MSC, MSC_SCAN, key), clock.stamp(EV_KEY, key, 1)]
+        events.append(clock.stamp(EV_SYN, SYN_REPORT, 0))
+        clock.tick(rng.randint(40000, 120000))
+
+        if rng.random() < 0.05:
+            # held long enough for the kernel to repeat it
+            for _ in range(rng.randint(1, 5)):
+                clock.tick(33000)
+                events += [clock.stamp(EV_KEY, key, 2), clock.stamp(EV_SYN, SYN_REPORT, 0)]
+
+        events += [clock.stamp(EV_MSC, MSC_SCAN, key), clock.stamp(EV_KEY, key, 0)]
+        events.append(clock.stamp(EV_SYN, SYN_REPORT, 0))
+        clock.tick(rng.randint(20000, 80000))
+
+        if shift:
+            events += [clock.stamp(EV_MSC, MSC_SCAN, KEY_LEFTSHIFT), clock.stamp(EV_KEY, KEY_LEFTSHIFT, 0)]
+            events.append(clock.stamp(EV_SYN, SYN_REPORT, 0))
+
+    return events
+
+
+def mouse_8khz(frames: int, seed: int = 0):
+    """A gaming mouse polled at 8 kHz, mostly motion with a few clicks and scrolls"""
+    rng = random.Random(seed)
+    clock = _Clock()
+    events = []
+
+    for frame in range(frames):
+        clock.tick(125)
+        dx = rng.randint(-3, 3)
+        dy = rng.randint(-3, 3)
+        if dx:
+            events.append(clock.stamp(EV_REL, REL_X, dx))
+        if dy:
+            events.append(clock.stamp(EV_REL, REL_Y, dy))
+
+        if frame % 4000 == 0:
+            events.append(clock.stamp(EV_KEY, BTN_LEFT, 1))
+        elif frame % 4000 == 800:
+            events.append(clock.stamp(EV_KEY, BTN_LEFT, 0))
+        elif frame % 2000 == 1000:
+            events.append(clock.stamp(EV_REL, REL_WHEEL, rng.choice([-1, 1])))
+
+        events.append(clock.stamp(EV_SYN, SYN_REPORT, 0))
+
+    return events
+
+
+def gamepad(frames: int, seed: int = 0):
+    """Both sticks and triggers moving at 1 kHz, with buttons and the d-pad"""
+    rng = random.Random(seed)
+    clock = _Clock()
+    events = []
+    axes = {ABS_X: 0, ABS_Y: 0, ABS_RX: 0, ABS_RY: 0}
+    triggers = {ABS_Z: 0, ABS_RZ: 0}
+    buttons = [BTN_SOUTH, BTN_EAST, BTN_TL, BTN_TR]
+    pressed = set()
+
+    for frame in range(frames):
+        clock.tick(1000)
+        for axis in axes:
+            if rng.random() < 0.7:
+                axes[axis] = max(-32768, min(32767, axes[axis] + rng.randint(-900, 900)))
+                events.append(clock.stamp(EV_ABS, axis, axes[axis]))
+
+        for trigger in triggers:
+            if rng.random() < 0.2:
+                triggers[trigger] = rng.randint(0, 255)
+                events.append(clock.stamp(EV_ABS, trigger, triggers[trigger]))
+
+        if frame % 50 == 0:
+            button = rng.choice(buttons)
+            value = 0 if button in pressed else 1
+            pressed.symmetric_difference_update([button])
+            events.append(clock.stamp(EV_KEY, button, value))
+
+        if frame % 300 == 0:
+            events.append(clock.stamp(EV_ABS, ABS_HAT0X, rng.choice([-1, 0, 1])))
+
+        events.append(clock.stamp(EV_SYN, SYN_REPORT, 0))
+
+    return events
+
+
+WORKLOADS = {
+    "keyboard": keyboard,
+    "mouse-8khz": mouse_8khz,
+    "gamepad": gamepad,
+}
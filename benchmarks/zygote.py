@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+"""
+Compare forking Injectors from the daemon with forking them from the zygote
+
+Reports how long it takes from starting an Injector until it reports its
+state, and the memory of each injector process. With write access to
+/dev/uinput the injectors grab virtual keyboards, are measured until they
+are RUNNING and stay alive for the memory to be measured. Without it they
+get a path that doesn't exist and only the time until NO_DEVICES is
+measured.
+
+    sudo python3 -m benchmarks.zygote --injectors 8
+"""
+
+import logging
+import os
+import time
+
+import evdev
+from evdev.ecodes import EV_KEY, KEY_A, KEY_B
+
+from evremapper.devices import _DeviceGroup
+from evremapper.configs.context import RuntimeContext
+from evremapper.injector import Injector, STARTING, UNKNOWN, start_zygote
+from evremapper.logger import logger
+
+START_METHODS = ["fork", "forkserver"]
+
+MISSING = "/dev/input/missing"
+
+
+def wait_state(injector, timeout=10):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        state = injector.get_state()
+        if state not in [UNKNOWN, STARTING]:
+            return state
+
+        time.sleep(0.0002)
+
+    raise RuntimeError("the injector didn't start")
+
+
+def run(start_method, groups, context):
+    # Not at the top, injectors from the zygote import the main module again.
+    # That is cheap for ev-remapper-service, keep it cheap here as well, see
+    # main too
+    import statistics
+    from benchmarks.engine import memory
+
+    injectors = []
+    times = []
+    for group in groups:
+        injector = Injector(group, context, {"start_method": start_method})
+        start = time.perf_counter()
+        injector.start()
+        wait_state(injector)
+        times.append(time.perf_counter() - start)
+        injectors.append(injector)
+
+    usage = [memory(injector.pid) for injector in injectors if injector.group.paths[0] != MISSING]
+
+    for injector in injectors:
+        if injector.is_alive():
+            injector.stop_injecting()
+
+        injector.join()
+        injector.release()
+
+    times.sort()
+    line = (
+        f"{start_method:<10} injectors {len(times):>3}  "
+        f"start p50 {statistics.median(times) * 1000:>6.1f} ms  "
+        f"max {times[-1] * 1000:>6.1f} ms"
+    )
+    if usage:
+        line += (
+            f"  rss {statistics.mean(rss for rss, _, _ in usage) / 1024:>6.1f} MiB"
+            f"  uss {statistics.mean(uss for _, _, uss in usage) / 1024:>6.1f} MiB"
+            " per injector"
+        )
+
+    print(line)
+
+
+def main():
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument("--injectors", type=int, default=8)
+    options = parser.parse_args()
+
+    context = RuntimeContext({"KEY_A": "KEY_B"})
+
+    sources = []
+    if os.access("/dev/uinput", os.W_OK):
+        sources = [
+            evdev.UInput({EV_KEY: [KEY_A, KEY_B]}, name=f"ev-remapper benchmark {i}")
+            for i in range(options.injectors)
+        ]
+        groups = [
+            _DeviceGroup([source.device.path], [source.name], ["keyboard"], source.name)
+            for source in sources
+        ]
+    else:
+        print("no access to /dev/uinput, measuring until NO_DEVICES")
+        # the injectors would complain about the missing device
+        logger.setLevel(logging.CRITICAL)
+        groups = [
+            _DeviceGroup([MISSING], ["missing"], ["keyboard"], f"missing {i}")
+            for i in range(options.injectors)
+        ]
+
+    # the daemon starts it right away as well
+    start_zygote()
+
+    try:
+        for start_method in START_METHODS:
+            run(start_method, groups, context)
+    finally:
+        for source in sources:
+            source.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,70 +1,140 @@
 #!/usr/bin/env python3
 
 import json
+import threading
+from copy import deepcopy
 from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from evremapper.logger import logger
 
 
+KeyPath = Tuple[str, ...]
+
+
+@lru_cache(maxsize=1024)
+def _split(path: str) -> KeyPath:
+    return tuple(path.split("."))
+
+
+def _keys(path) -> KeyPath:
+    """'key1.key2' or ['key1', 'key2'] as ('key1', 'key2')"""
+    if isinstance(path, str):
+        return _split(path)
+
+    return tuple(path)
+
+
+def _related(keys: KeyPath, other: KeyPath) -> bool:
+    """If a change at one of the paths can change the value at the other one"""
+    shorter = min(len(keys), len(other))
+    return keys[:shorter] == other[:shorter]
+
+
 class ConfigBase:
+    """
+    A tree of settings that are addressed by paths like 'key1.key2.key3'
+
+    Paths are split once, and values that were looked up before are
+    remembered until something changes, so reading the same setting again
+    and again doesn't walk the tree. Callbacks subscribed to a path are
+    called with the new value whenever it changes. Workers of the service
+    may read settings while the main loop changes them.
+    """
+
     def __init__(self):
         self._config = {}
+        # key path -> value at that path, None if it doesn't exist
+        self._values: Dict[KeyPath, Any] = {}
+        # a value that was looked up before a change is not remembered after it
+        self._values_lock = threading.Lock()
+        # key path -> callbacks and the value they were last told about
+        self._subscriptions: Dict[KeyPath, List[Callable[[Any], None]]] = {}
+        self._notified: Dict[KeyPath, Any] = {}
+
+    def _walk(self, keys: KeyPath, create: bool = False) -> Optional[dict]:
+        """Get the dict that holds the last key, None if it doesn't exist"""
+        parent = self._config
+        for key in keys[:-1]:
+            child = parent.get(key)
+            if not isinstance(child, dict):
+                if not create:
+                    return None
+
+                child = parent[key] = {}
 
-    def _resolve(self, path, callback, config=None):
-        """
-        Resolves a keypath and calls callback on the value
-
-        Parameters
-        ----------
-        path: string or string[]
-            Can be in the form 'key1.key2.key3' or
-            ['key1', 'key2', 'key3']
-        callback: func(parent, child, key)
-            Function to be called on the resolved value
-        config:
-            Config to resolve defaults to self._config
+            parent = child
 
-        """
-        keys = path.copy() if isinstance(path, list) else path.split(".")
+        return parent
 
-        if config is None:
-            child = self._config
-        else:
-            child = config
+    def remove(self, path):
+        keys = _keys(path)
+        parent = self._walk(keys)
+        if parent is not None and keys[-1] in parent:
+            del parent[keys[-1]]
+            self._changed([keys])
 
-        while True:
-            key = keys.pop()
-            parent = child
-            child = child.get(key)
-            if len(keys) == 0:  # No more keys to follow
-                return callback(parent, child, key)
+    def set(self, path, value):
+        keys = _keys(path)
+        self._walk(keys, create=True)[keys[-1]] = value
+        self._changed([keys])
 
-            if child is None:
-                parent[key] = {}
-                child = parent[key]
+    def get(self, path):
+        keys = _keys(path)
+        try:
+            return self._values[keys]
+        except KeyError:
+            pass
 
-    def remove(self, path):
-        def callback(parent, child, key):
-            if child is not None:
-                del parent[key]
+        with self._values_lock:
+            parent = self._walk(keys)
+            value = None if parent is None else parent.get(keys[-1])
+            self._values[keys] = value
 
-        self._resolve(path, callback)
+        return value
 
-    def set(self, path, value):
-        def callback(parent, child, key):
-            parent[key] = value
+    def update(self, values: dict, replace: bool = False):
+        """
+        Set many top level keys at once, or the whole config with replace
+
+        Subscribers are told about each change once, after all of them.
+        """
+        changed = [(key,) for key in values]
+        if replace:
+            changed += [(key,) for key in self._config if key not in values]
+            self._config = {}
 
-        self._resolve(path, callback)
+        self._config.update(values)
+        self._changed(changed)
 
-    def get(self, path):
-        def callback(parent, child, key):
-            return child
+    def subscribe(self, path, callback: Callable[[Any], None]):
+        """Call callback with the value at the path whenever it changes"""
+        keys = _keys(path)
+        self._subscriptions.setdefault(keys, []).append(callback)
+        self._notified[keys] = deepcopy(self.get(keys))
+
+    def _changed(self, changed: List[KeyPath]):
+        with self._values_lock:
+            self._values.clear()
+
+        for keys, callbacks in self._subscriptions.items():
+            if not any(_related(keys, other) for other in changed):
+                continue
+
+            value = self.get(keys)
+            if value == self._notified[keys]:
+                continue
 
-        return self._resolve(path, callback)
+            self._notified[keys] = deepcopy(value)
+            for callback in callbacks:
+                callback(value)
 
     def flush(self):
         """Flushes all configs in memory"""
+        changed = [(key,) for key in self._config]
         self._config = {}
+        self._changed(changed)
 
     @classmethod
     def from_string(cls, string: str):
@@ -1,18 +1,208 @@
 #!/usr/bin/env python3
 
+from array import array
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
 import evdev
+from evdev.ecodes import (
+    EV_CNT,
+    EV_KEY,
+    EV_REL,
+    EV_ABS,
+    EV_MSC,
+    EV_SW,
+    EV_LED,
+    EV_SND,
+    KEY_CNT,
+    REL_CNT,
+    ABS_CNT,
+    MSC_CNT,
+    SW_CNT,
+    LED_CNT,
+    SND_CNT,
+)
+
+# prefix of an event code name -> event type
+_PREFIX_TYPES = {
+    "KEY": EV_KEY,
+    "BTN": EV_KEY,
+    "REL": EV_REL,
+    "ABS": EV_ABS,
+    "MSC": EV_MSC,
+    "SW": EV_SW,
+    "LED": EV_LED,
+    "SND": EV_SND,
+}
+
+# event type -> number of codes of that type
+_CODE_COUNTS = {
+    EV_KEY: KEY_CNT,
+    EV_REL: REL_CNT,
+    EV_ABS: ABS_CNT,
+    EV_MSC: MSC_CNT,
+    EV_SW: SW_CNT,
+    EV_LED: LED_CNT,
+    EV_SND: SND_CNT,
+}
+
+
+def resolve_code(name: str) -> Tuple[int, int]:
+    """Get the (type, code) tuple of an event code name like 'KEY_A'"""
+    prefix = name.split("_", 1)[0]
+    if prefix not in _PREFIX_TYPES or name not in evdev.ecodes.ecodes:
+        raise ValueError(f"unknown event code {name!r}")
+
+    return _PREFIX_TYPES[prefix], evdev.ecodes.ecodes[name]
+
+
+# separates the keys of a chord like "KEY_LEFTCTRL+KEY_J"
+CHORD_SEPARATOR = "+"
+
 
-from evremapper.configs.config import InputEvent
+class Chord(NamedTuple):
+    """Keys that have to be held while the trigger is pressed, with what to press instead"""
+
+    # bit n is set for each key code n that has to be held
+    mask: int
+    modifiers: Tuple[int, ...]
+    target: int
 
 
 class RuntimeContext:
-    """Specifically used by the service daemon to get mappings for keycodes"""
+    """
+    Specifically used by the service daemon to get mappings for keycodes
+
+    The mappings are compiled into one dense table per event type that is
+    indexed by the incoming code and holds the code to forward, which is the
+    code itself when it isn't mapped. Event types without any mapping have no
+    table at all so they can be passed on without a lookup.
+
+    Chords like "KEY_LEFTCTRL+KEY_J" are compiled into a table indexed by
+    the code of the last key, which holds the chords that end with it, the
+    ones with the most modifiers first.
+    """
 
     def __init__(self, mappings):
-        self.key_to_code = {}
+        # (type, code) -> code it is mapped to
+        self.code_map: Dict[Tuple[int, int], int] = {}
+        # keys of a chord, the last one triggers it -> key it is mapped to
+        self.chords: Dict[Tuple[int, ...], int] = {}
+        # indexed by event type, None if nothing of that type is mapped
+        self.code_tables: List[Optional[array]] = [None] * EV_CNT
+        # indexed by key code, None if there are no chords at all
+        self.chord_table: Optional[List[Optional[Tuple[Chord, ...]]]] = None
         self._populate_keycode_map(mappings)
 
+    @classmethod
+    def from_code_map(cls,
+                      code_map: Dict[Tuple[int, int], int],
+                      chords: Dict[Tuple[int, ...], int] = None) -> "RuntimeContext":
+        """
+        Create it from codes that were resolved before, see MappingCache
+
+        Raises ValueError if a code doesn't exist.
+        """
+        for (ev_type, code), target in code_map.items():
+            if ev_type not in _CODE_COUNTS or max(code, target) >= _CODE_COUNTS[ev_type]:
+                raise ValueError(f"unknown event code {code} or {target} of type {ev_type}")
+
+        for keys, target in (chords or {}).items():
+            if len(keys) < 2 or max(*keys, target) >= KEY_CNT:
+                raise ValueError(f"invalid chord {keys} with target {target}")
+
+        context = cls({})
+        context.code_map = dict(code_map)
+        context.chords = dict(chords or {})
+        context._build_tables()
+        return context
+
+    def mapped_events(self) -> Iterator[Tuple[int, int]]:
+        """(type, code) of each event that the mappings change"""
+        yield from self.code_map
+        for keys in self.chords:
+            yield EV_KEY, keys[-1]
+
     def _populate_keycode_map(self, mappings):
-        self.key_to_code = {}
-        for key_code_str in mappings:
-            self.key_to_code[evdev.ecodes.ecodes[key_code_str]] = evdev.ecodes.ecodes[mappings[key_code_str]]
+        self.code_map = {}
+        self.chords = {}
+
+        for key_code_str, target_str in mappings.items():
+            if not isinstance(target_str, str):
+                raise ValueError(
+                    f"can't map {key_code_str!r} to {target_str!r}, "
+                    "expected the name of an event code"
+                )
+
+            if CHORD_SEPARATOR in key_code_str:
+                self._add_chord(key_code_str, target_str)
+                continue
+
+            ev_type, code = resolve_code(key_code_str)
+            target_type, target = resolve_code(target_str)
+            if target_type != ev_type:
+                raise ValueError(
+                    f"can't map {key_code_str!r} to {target_str!r}, "
+                    "they are not of the same event type"
+                )
+
+            self.code_map[(ev_type, code)] = target
+
+        self._build_tables()
+
+    def _add_chord(self, chord_str: str, target_str: str):
+        keys = []
+        for name in chord_str.split(CHORD_SEPARATOR):
+            ev_type, code = resolve_code(name.strip())
+            if ev_type != EV_KEY:
+                raise ValueError(f"can't use {name!r} in the chord {chord_str!r}, only keys")
+
+            if code in keys:
+                raise ValueError(f"{name!r} is more than once in the chord {chord_str!r}")
+
+            keys.append(code)
+
+        target_type, target = resolve_code(target_str)
+        if target_type != EV_KEY:
+            raise ValueError(f"can't map the chord {chord_str!r} to {target_str!r}, only to keys")
+
+        if len(keys) < 2:
+            raise ValueError(f"the chord {chord_str!r} needs at least two keys")
+
+        self.chords[tuple(keys)] = target
+
+    def _build_tables(self):
+        self.code_tables = [None] * EV_CNT
+        for (ev_type, code), target in self.code_map.items():
+            table = self.code_tables[ev_type]
+            if table is None:
+                table = array("H", range(_CODE_COUNTS[ev_type]))
+                self.code_tables[ev_type] = table
+
+            table[code] = target
+
+        self.chord_table = None
+        if not self.chords:
+            return
+
+        by_trigger: Dict[int, List[Chord]] = {}
+        for keys, target in self.chords.items():
+            modifiers = keys[:-1]
+            mask = 0
+            for code in modifiers:
+                mask |= 1 << code
+
+            by_trigger.setdefault(keys[-1], []).append(Chord(mask, modifiers, target))
+
+        self.chord_table = [None] * KEY_CNT
+        for trigger, chords in by_trigger.items():
+            # "KEY_LEFTCTRL+KEY_LEFTSHIFT+KEY_J" wins over "KEY_LEFTCTRL+KEY_J"
+            chords.sort(key=lambda chord: len(chord.modifiers), reverse=True)
+            self.chord_table[trigger] = tuple(chords)
+
+    def remap(self, ev_type: int, code: int) -> int:
+        """Get the code to forward for an incoming event"""
+        table = self.code_tables[ev_type]
+        if table is None:
+            return code
+
+        return table[code]
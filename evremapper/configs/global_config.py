@@ -29,22 +29,35 @@ class GlobalConfig(ConfigBase):
         if not os.path.exists(path):
             raise FileNotFoundError(f'Tried to load non-existing config "{path}"')
 
-        self.empty()
-        self._has_unsaved_changes = False
-
         with open(path, "r") as file:
             json_dict = json.load(file)
 
-            if not isinstance(json_dict["autoload"], dict):
-                logger.error("expected `autoload` to be dict but found %s",
-                             'invalid config at "%s"',
-                             type(json_dict.get("autoload")),
-                             path
-                             )
-                return
+        self._has_unsaved_changes = False
 
-            for key in json_dict:
-                self.set(key, json_dict[key])
+        if not isinstance(json_dict["autoload"], dict):
+            logger.error("expected `autoload` to be dict but found %s",
+                         'invalid config at "%s"',
+                         type(json_dict.get("autoload")),
+                         path
+                         )
+            self.flush()
+            return
+
+        # in one go, subscribers only hear about what actually changed
+        self.update(json_dict, replace=True)
+
+    def get_injector_options(self, device_key):
+        """
+        Get the settings for injecting a single device
+
+        They come from the "injector" section, settings in its "devices"
+        section for that specific device win. For example
+        {"reader": "raw", "devices": {"Some Mouse": {"reader": "evdev"}}}
+        """
+        injector = self.get("injector") or {}
+        options = {key: value for key, value in injector.items() if key != "devices"}
+        options.update(injector.get("devices", {}).get(device_key, {}))
+        return options
 
 
 global_config = GlobalConfig()
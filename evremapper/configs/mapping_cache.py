@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+"""
+Compiled mappings, so injecting the same preset again doesn't parse it again
+
+A preset is compiled into a RuntimeContext once and kept as long as its file
+stays the same. Optionally the resolved codes are also written to a small
+binary file next to the preset, which the next start of the service can use
+without parsing the json.
+"""
+
+import json
+import os
+import secrets
+import struct
+import threading
+
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from evremapper.configs.context import RuntimeContext
+from evremapper.logger import logger
+
+# st_ino, st_mtime_ns and st_size, a preset that is saved again changes
+# at least one of them
+FileIdentity = Tuple[int, int, int]
+
+MAX_ENTRIES = 32
+
+# magic, format version, the identity of the json that it was made from,
+# and the number of mappings and chords that follow
+_HEADER = struct.Struct("<4sHQqqII")
+_MAGIC = b"EVRM"
+_VERSION = 2
+# type, code, target
+_ENTRY = struct.Struct("<HHH")
+# number of keys, target, followed by the codes of the keys
+_CHORD = struct.Struct("<HH")
+_CODE = struct.Struct("<H")
+
+
+class MappingError(ValueError):
+    """A preset that can't be injected, the message says where the problem is"""
+
+    def __init__(self, path: str, problem: str):
+        super().__init__(f'invalid preset "{path}": {problem}')
+        self.path = path
+        self.problem = problem
+
+
+def _identity(stat: os.stat_result) -> FileIdentity:
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def compiled_path(path: str) -> str:
+    """Where the binary file of a preset goes, hidden so it isn't listed as a preset"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.compiled")
+
+
+def compile_mappings(path: str) -> RuntimeContext:
+    """Parse a preset and resolve its codes, raises MappingError if it is invalid"""
+    try:
+        with open(path, "r") as file:
+            json_dict = json.load(file)
+    except json.JSONDecodeError as error:
+        raise MappingError(path, f"line {error.lineno} column {error.colno}: {error.msg}")
+
+    if not isinstance(json_dict, dict) or "mappings" not in json_dict:
+        raise MappingError(path, 'expected an object with "mappings"')
+
+    mappings = json_dict["mappings"]
+    if not isinstance(mappings, dict):
+        raise MappingError(path, f'expected "mappings" to be an object, found {type(mappings).__name__}')
+
+    try:
+        return RuntimeContext(mappings)
+    except ValueError as error:
+        raise MappingError(path, str(error))
+
+
+def _read_compiled(path: str, identity: FileIdentity) -> Optional[RuntimeContext]:
+    try:
+        with open(compiled_path(path), "rb") as file:
+            data = file.read()
+    except OSError:
+        return None
+
+    try:
+        magic, version, *made_from, mapping_count, chord_count = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != _VERSION or tuple(made_from) != identity:
+            return None
+
+        offset = _HEADER.size
+        code_map = {}
+        for _ in range(mapping_count):
+            ev_type, code, target = _ENTRY.unpack_from(data, offset)
+            code_map[(ev_type, code)] = target
+            offset += _ENTRY.size
+
+        chords = {}
+        for _ in range(chord_count):
+            key_count, target = _CHORD.unpack_from(data, offset)
+            offset += _CHORD.size
+            keys = struct.unpack_from(f"<{key_count}H", data, offset)
+            chords[keys] = target
+            offset += key_count * _CODE.size
+        return RuntimeContext.from_code_map(code_map, chords)
+    except (struct.error, ValueError):
+        # cut off or garbled, compiled again
+        return None
+
+
+def _write_compiled(path: str, identity: FileIdentity, context: RuntimeContext):
+    data = bytearray(
+        _HEADER.pack(_MAGIC, _VERSION, *identity, len(context.code_map), len(context.chords))
+    )
+    for (ev_type, code), target in context.code_map.items():
+        data += _ENTRY.pack(ev_type, code, target)
+
+    for keys, target in context.chords.items():
+        data += _CHORD.pack(len(keys), target)
+        data += struct.pack(f"<{len(keys)}H", *keys)
+
+    # The service runs as root and the directory belongs to a user, who may
+    # put links or files there at any time. Everything happens relative to
+    # the directory, the temporary file is a new one and only the name of
+    # the compiled file is replaced, never where it might link to.
+    target_path = compiled_path(path)
+    directory, name = os.path.split(target_path)
+    temporary = f"{name}.{secrets.token_hex(8)}.tmp"
+    try:
+        directory_fd = os.open(directory or ".", os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+    except OSError as error:
+        logger.debug('Failed to write "%s": %s', target_path, error)
+        return
+
+    try:
+        fd = os.open(
+            temporary,
+            os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW | os.O_CLOEXEC,
+            0o644,
+            dir_fd=directory_fd,
+        )
+        try:
+            with open(fd, "wb") as file:
+                # it belongs to whoever owns the presets
+                stat = os.fstat(directory_fd)
+                os.fchown(file.fileno(), stat.st_uid, stat.st_gid)
+                file.write(data)
+
+            os.replace(temporary, name, src_dir_fd=directory_fd, dst_dir_fd=directory_fd)
+        except OSError:
+            os.unlink(temporary, dir_fd=directory_fd)
+            raise
+    except OSError as error:
+        logger.debug('Failed to write "%s": %s', target_path, error)
+    finally:
+        os.close(directory_fd)
+
+
+class MappingCache:
+    """
+    Compiled presets by path, the least recently used ones are dropped first
+
+    A cached preset is used as long as the inode, mtime and size of its file
+    are the same. With persist, compiled presets are also written next to
+    their json and read from there. Safe to use from multiple threads.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, persist: bool = False):
+        self.max_entries = max_entries
+        self.persist = persist
+
+        # path -> identity of the file and what it compiled to
+        self._entries: "OrderedDict[str, Tuple[FileIdentity, RuntimeContext]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str) -> RuntimeContext:
+        """
+        Get the compiled preset at the path
+
+        Raises FileNotFoundError if it doesn't exist, MappingError if it is
+        invalid.
+        """
+        try:
+            identity = _identity(os.stat(path))
+        except FileNotFoundError:
+            raise FileNotFoundError(f'Tried to load non-existing preset "{path}"')
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == identity:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+
+        context = _read_compiled(path, identity) if self.persist else None
+        if context is None:
+            logger.info('Compiling mappings from "%s"', path)
+            context = compile_mappings(path)
+            if self.persist:
+                _write_compiled(path, identity, context)
+
+        with self._lock:
+            self.misses += 1
+            self._entries[path] = (identity, context)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return context
+
+    def stats(self) -> Dict[str, float]:
+        """size, hits, misses and hit_rate"""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "size": float(len(self._entries)),
+                "hits": float(self.hits),
+                "misses": float(self.misses),
+                "hit_rate": self.hits / requests if requests else 0.0,
+            }
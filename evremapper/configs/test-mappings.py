@@ -10,4 +10,4 @@ mappings = Mappings()
 mappings.load("/home/kevin/.config/ev-remapper/mappings/Default.json")
 context = RuntimeContext(mappings._mappings)
 
-print(context.key_to_code)
+print(context.code_map)
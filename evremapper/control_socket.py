@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+"""
+A small local protocol between ev-remapper-control and the daemon
+
+The client sends one json object in a single line and gets one back, for
+example {"method": "stop_inject_device", "device": "/dev/input/event3"}
+and {"status": true}, or {"error": "..."} if it didn't work out. Files
+that the daemon should write to are opened by the client and sent along
+with the request, the daemon runs as root and doesn't open them itself.
+
+ev-remapper-control imports this module on every call, so it must not
+import GLib or anything else that is slow to import at the top level.
+"""
+
+import json
+import os
+import socket
+import stat
+import struct
+
+from typing import List, NamedTuple, Sequence, Set
+
+from evremapper.logger import logger
+
+SOCKET_PATH = os.environ.get("EV_REMAPPER_SOCKET", "/run/ev-remapper/control.sock")
+
+# daemon methods that can be called, all of them except for the ones in
+# WITHOUT_DEVICE take a device key as their first argument
+METHODS = {
+    "inject_device",
+    "autoload_single",
+    "stop_inject_device",
+    "autoload",
+    "stop_all",
+    "start_recording",
+    "stop_recording",
+}
+WITHOUT_DEVICE = {"autoload", "stop_all"}
+# methods that take the fd of a file that was sent with the request
+WITH_FD = {"start_recording"}
+
+_MAX_LINE = 1 << 16
+# seconds that the daemon waits for the request of a client
+READ_TIMEOUT = 2
+
+# requests and responses are dicts, typing is not imported for this
+Message = dict
+
+
+def _read_line(connection: socket.socket) -> bytes:
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = connection.recv(4096)
+        if not chunk:
+            break
+
+        data += chunk
+        if len(data) > _MAX_LINE:
+            raise ValueError("message too long")
+
+    return data
+
+
+def send_command(request: Message,
+                 path: str = SOCKET_PATH,
+                 timeout: float = 10,
+                 fds: Sequence[int] = ()) -> Message:
+    """
+    Send a request to the daemon and wait for the response
+
+    fds are sent along with it, see WITH_FD. Raises FileNotFoundError or
+    ConnectionRefusedError if the daemon isn't listening, other OSErrors if
+    talking to it failed.
+    """
+    data = json.dumps(request).encode() + b"\n"
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(path)
+        sent = socket.send_fds(connection, [data], fds) if fds else 0
+        connection.sendall(data[sent:])
+        response = _read_line(connection)
+
+    if not response:
+        raise ConnectionError("the daemon closed the connection without answering")
+
+    return json.loads(response)
+
+
+class Peer(NamedTuple):
+    """The process on the other end of a connection, as the kernel tells"""
+
+    pid: int
+    uid: int
+    gid: int
+
+    @classmethod
+    def of(cls, connection: socket.socket) -> "Peer":
+        credentials = struct.Struct("3i")
+        return cls(*credentials.unpack(
+            connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, credentials.size)
+        ))
+
+    def groups(self) -> Set[int]:
+        """Its primary and supplementary groups"""
+        groups = {self.gid}
+        try:
+            with open(f"/proc/{self.pid}/status") as file:
+                for line in file:
+                    if line.startswith("Groups:"):
+                        groups.update(int(gid) for gid in line.split()[1:])
+        except OSError as error:
+            logger.debug("Failed to read the groups of %d: %s", self.pid, error)
+
+        return groups
+
+    def may_read(self, path: str) -> bool:
+        """If the mode of the file allows it to read it, ACLs are not looked at"""
+        if self.uid == 0:
+            return True
+
+        status = os.stat(path)
+        if status.st_uid == self.uid:
+            return bool(status.st_mode & stat.S_IRUSR)
+
+        if status.st_gid in self.groups():
+            return bool(status.st_mode & stat.S_IRGRP)
+
+        return bool(status.st_mode & stat.S_IROTH)
+
+
+class _Client:
+    """A connection whose request is still being read or answered"""
+
+    def __init__(self, connection: socket.socket):
+        self.connection = connection
+        self.peer = Peer.of(connection)
+        self.data = b""
+        # received with the request, closed once it is answered
+        self.fds: List[int] = []
+        self.watch = None
+        self.timeout = None
+
+    def close(self):
+        self.connection.close()
+        for fd in self.fds:
+            os.close(fd)
+
+        self.fds = []
+
+
+class ControlServer:
+    """
+    Serves the requests of ev-remapper-control in the GLib main loop of the daemon
+
+    handler gets each request, the Peer that sent it and the fds that came
+    with it, and returns the response, or a concurrent.futures.Future of it
+    if the answer takes a while. The connection stays open until that
+    future is done, other requests are handled in the meantime. The fds
+    are closed after that, the handler doesn't need to. Everyone may
+    connect, which is the same that the D-Bus policy of the service allows,
+    handlers check the Peer where that isn't enough.
+    """
+
+    def __init__(self, handler, path: str = SOCKET_PATH):
+        self._handler = handler
+        self._path = path
+        self._socket: socket.socket = None
+        self._watch = None
+
+    def start(self) -> bool:
+        from gi.repository import GLib
+
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            if os.path.exists(self._path):
+                # left over from a previous run
+                os.unlink(self._path)
+
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM | socket.SOCK_CLOEXEC)
+            self._socket.bind(self._path)
+            os.chmod(self._path, 0o666)
+            self._socket.listen(16)
+            self._socket.setblocking(False)
+        except OSError as error:
+            logger.error('Failed to serve control requests at "%s": %s', self._path, error)
+            self._socket = None
+            return False
+
+        self._watch = GLib.io_add_watch(
+            self._socket.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, self._accept
+        )
+        return True
+
+    def stop(self):
+        from gi.repository import GLib
+
+        if self._watch is not None:
+            GLib.source_remove(self._watch)
+            self._watch = None
+
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            os.unlink(self._path)
+
+    def _accept(self, *_):
+        from gi.repository import GLib
+
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except BlockingIOError:
+                return True
+
+            # the client sends its request right away, it is read whenever
+            # it arrives so a slow one doesn't hold up the main loop
+            connection.setblocking(False)
+            client = _Client(connection)
+            client.watch = GLib.io_add_watch(
+                connection.fileno(),
+                GLib.PRIORITY_DEFAULT,
+                GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR,
+                self._read,
+                client,
+            )
+            client.timeout = GLib.timeout_add_seconds(READ_TIMEOUT, self._timed_out, client)
+
+    def _read(self, _fd, _condition, client: "_Client"):
+        try:
+            chunk, fds, _, _ = socket.recv_fds(client.connection, 4096, 1)
+        except BlockingIOError:
+            return True
+        except OSError as error:
+            logger.error("Failed to read a control request: %s", error)
+            self._drop(client)
+            return False
+
+        client.data += chunk
+        client.fds += fds
+        if chunk and not client.data.endswith(b"\n"):
+            if len(client.data) <= _MAX_LINE:
+                return True
+
+            logger.error("Invalid control request: message too long")
+            self._drop(client)
+            return False
+
+        client.watch = None
+        self._drop_timeout(client)
+        self._handle(client)
+        return False
+
+    def _timed_out(self, client: "_Client"):
+        from gi.repository import GLib
+
+        logger.error("Control client didn't send a request in time")
+        client.timeout = None
+        GLib.source_remove(client.watch)
+        client.watch = None
+        client.close()
+        return False
+
+    def _drop(self, client: "_Client"):
+        """Close a client while its watch is being removed"""
+        client.watch = None
+        self._drop_timeout(client)
+        client.close()
+
+    @staticmethod
+    def _drop_timeout(client: "_Client"):
+        from gi.repository import GLib
+
+        if client.timeout is not None:
+            GLib.source_remove(client.timeout)
+            client.timeout = None
+
+    def _handle(self, client: "_Client"):
+        try:
+            request = json.loads(client.data)
+            if not isinstance(request, dict):
+                raise ValueError("expected a json object")
+        except ValueError as error:
+            logger.error("Invalid control request: %s", error)
+            client.close()
+            return
+
+        response = self._handler(request, client.peer, list(client.fds))
+        if isinstance(response, dict):
+            self._respond(client, response)
+        else:
+            response.add_done_callback(
+                lambda future: self._respond(client, future.result())
+            )
+
+    @staticmethod
+    def _respond(client: "_Client", response: Message):
+        try:
+            # a line of json fits into the buffer of the socket, this
+            # doesn't block
+            client.connection.sendall(json.dumps(response).encode() + b"\n")
+        except OSError as error:
+            logger.error("Failed to answer a control request: %s", error)
+        finally:
+            client.close()
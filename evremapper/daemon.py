@@ -1,11 +1,20 @@
 #!/usr/bin/env python3
 
 from pydbus import SystemBus
+from pydbus.generic import signal
 from evremapper.logger import logger
 from evremapper.devices import DevGroups
-from evremapper.injector import Injector, UNKNOWN
-from evremapper.configs.mappings import Mappings
+from evremapper.injector import Injector, UNKNOWN, STARTING, RUNNING, start_zygote
+from evremapper.engine import InjectionEngine, EngineInjector
+from evremapper.uinput_pool import UInputPool
+from evremapper.hotplug import HotplugWatcher
+from evremapper.control_socket import ControlServer, METHODS, WITHOUT_DEVICE, WITH_FD
+from evremapper.latency import LatencyHistogram
+from evremapper.metrics import cpu_seconds
+from evremapper.prometheus import MetricsServer
+from evremapper.recording import init_trace, RECORDING_EVENTS
 from evremapper.configs.context import RuntimeContext
+from evremapper.configs.mapping_cache import MappingCache, MAX_ENTRIES
 from evremapper.user import USER
 from evremapper.configs.paths import get_config_path
 from evremapper.configs.global_config import global_config
@@ -13,6 +22,10 @@ from evremapper.configs.global_config import global_config
 import time
 import sys
 import os
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
 
 import gi
 gi.require_version("GLib", "2.0")
@@ -21,6 +34,12 @@ from gi.repository import GLib
 
 BUS_NAME = "evremapper.Manager"
 
+# threads that look for devices and load mappings, so the main loop keeps
+# answering while they do
+WORKERS = 4
+# how often the main loop checks how late it is
+HEARTBEAT_MS = 50
+
 
 class Daemon:
 
@@ -50,32 +69,130 @@ class Daemon:
                         <arg type='s' name='device_key' direction='in'/>
                         <arg type='i' name='state' direction='out'/>
                     </method>
+                    <method name='get_all_states'>
+                        <arg type='a{{si}}' name='states' direction='out'/>
+                    </method>
+                    <method name='get_latency'>
+                        <arg type='s' name='device_key' direction='in'/>
+                        <arg type='a{{sd}}' name='latency' direction='out'/>
+                    </method>
+                    <method name='get_metrics'>
+                        <arg type='s' name='device_key' direction='in'/>
+                        <arg type='a{{sd}}' name='metrics' direction='out'/>
+                    </method>
+                    <method name='get_motion_stats'>
+                        <arg type='s' name='device_key' direction='in'/>
+                        <arg type='a{{sd}}' name='stats' direction='out'/>
+                    </method>
+                    <method name='get_overflows'>
+                        <arg type='s' name='device_key' direction='in'/>
+                        <arg type='a{{sd}}' name='overflows' direction='out'/>
+                    </method>
+                    <method name='get_realtime'>
+                        <arg type='s' name='device_key' direction='in'/>
+                        <arg type='a{{sb}}' name='applied' direction='out'/>
+                    </method>
+                    <method name='stop_recording'>
+                        <arg type='s' name='device_key' direction='in'/>
+                        <arg type='b' name='status' direction='out'/>
+                    </method>
+                    <method name='get_grabs'>
+                        <arg type='s' name='device_key' direction='in'/>
+                        <arg type='a{{s(bd)}}' name='grabs' direction='out'/>
+                    </method>
+                    <method name='get_hotplug_latency'>
+                        <arg type='a{{sd}}' name='latency' direction='out'/>
+                    </method>
+                    <method name='get_uinput_pool_stats'>
+                        <arg type='a{{sd}}' name='stats' direction='out'/>
+                    </method>
+                    <method name='get_mapping_cache_stats'>
+                        <arg type='a{{sd}}' name='stats' direction='out'/>
+                    </method>
+                    <method name='get_main_loop_stalls'>
+                        <arg type='a{{sd}}' name='stalls' direction='out'/>
+                    </method>
                     <method name='hello'>
                         <arg type='s' name='out' direction='in'/>
                         <arg type='s' name='response' direction='out'/>
                     </method>
+                    <signal name='injection_started'>
+                        <arg type='s' name='device_key'/>
+                        <arg type='b' name='status'/>
+                    </signal>
+                    <signal name='state_changed'>
+                        <arg type='s' name='device_key'/>
+                        <arg type='i' name='state'/>
+                    </signal>
+                    <signal name='autoload_done'>
+                        <arg type='a{{sb}}' name='results'/>
+                        <arg type='d' name='milliseconds'/>
+                    </signal>
                 </interface>
             </node>
         """
 
+    # emitted once a request to inject a device is done, with False if the
+    # device or its mappings were not found
+    injection_started = signal()
+    # emitted once autoload is done, with the result of each device
+    autoload_done = signal()
+    # emitted whenever get_state of a device would return something else
+    state_changed = signal()
+
     def __init__(self):
         logger.debug("Creating daemon")
 
         self.config_dir = None
+        # compiled presets, set up with the global config
+        self.mapping_cache = MappingCache()
 
         self.global_config = global_config
-
-        # try to set the config_dir right away
-        if USER != "root":
-            self.set_config_dir(get_config_path())
+        # serves get_metrics of all devices, if "metrics_socket" is set
+        self.metrics_server = None
 
         # check privileges
         if os.getuid() != 0:
             logger.warning("The service usually needs elevated privileges")
 
         self.injectors = {}
+        self.engine = None
         self.refreshed_devices_at = 0
 
+        self.hotplug = HotplugWatcher(self._devices_added)
+        self.control_server = ControlServer(self._control_request)
+        # microseconds from plugging in a device until its injection runs
+        self.hotplug_latency = LatencyHistogram()
+        # uinputs that outlive the injectors which write to them
+        self.uinput_pool = UInputPool()
+
+        self._workers = ThreadPoolExecutor(WORKERS, thread_name_prefix="ev-remapper-worker")
+        # one device scan at a time, workers may ask for one at once
+        self._devices_lock = threading.RLock()
+        # device -> number of the latest injection request, a request that
+        # is not the latest anymore once it is prepared is dropped
+        self._requests = {}
+        # device -> requests that are still prepared by a worker
+        self._pending = {}
+        # microseconds that the main loop was late
+        self.main_loop_stalls = LatencyHistogram()
+        self._heartbeat_at = 0.0
+        # the GLib timeout of the heartbeat, if "main_loop_stalls" is set
+        self._heartbeat_timeout = None
+        # device -> the state that state_changed was last emitted with
+        self._states = {}
+        # injector or engine -> its GLib watches
+        self._watches = {}
+
+        # last, loading the config may call them right away
+        self.global_config.subscribe("mapping_cache", self._configure_mapping_cache)
+        self.global_config.subscribe("metrics_socket", self._configure_metrics_server)
+        self.global_config.subscribe("main_loop_stalls", self._configure_heartbeat)
+
+        # try to set the config_dir right away
+        if USER != "root":
+            self.set_config_dir(get_config_path())
+
     @classmethod
     def connect(cls, fallback=True):
         """Try to connect to a running daemon, if not running then start one"""
@@ -157,22 +274,611 @@ class Daemon:
 
         self.global_config.load(config_path)
 
+    def _configure_mapping_cache(self, options):
+        options = options or {}
+        self.mapping_cache.max_entries = options.get("size", MAX_ENTRIES)
+        self.mapping_cache.persist = options.get("persist", False)
+
+    def _configure_metrics_server(self, path):
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+
+        if path:
+            self.metrics_server = MetricsServer(self._collect_metrics, path)
+            self.metrics_server.start()
+
+    def _configure_heartbeat(self, enabled):
+        # it wakes the service up all the time, so it only runs on request
+        if enabled and self._heartbeat_timeout is None:
+            self._heartbeat_at = time.monotonic()
+            self._heartbeat_timeout = GLib.timeout_add(HEARTBEAT_MS, self._heartbeat)
+        elif not enabled and self._heartbeat_timeout is not None:
+            GLib.source_remove(self._heartbeat_timeout)
+            self._heartbeat_timeout = None
+
     def run(self):
         logger.debug("Starting daemon")
+        # ready before the first injection is requested
+        start_zygote()
+        self.hotplug.start()
+        self.control_server.start()
+        # starting up doesn't count as a stall
+        self._heartbeat_at = time.monotonic()
         loop = GLib.MainLoop()
-        loop.run()
+        try:
+            loop.run()
+        finally:
+            for injector in self.injectors.values():
+                injector.release()
+
+            self.uinput_pool.close()
+
+    def _heartbeat(self):
+        now = time.monotonic()
+        late = now - self._heartbeat_at - HEARTBEAT_MS / 1000
+        self._heartbeat_at = now
+        self.main_loop_stalls.record(max(0, int(late * 1000000)))
+        if late > 0.1:
+            logger.debug("The main loop was stuck for %d ms", late * 1000)
+
+        return True
+
+    def get_main_loop_stalls(self):
+        """
+        Get how long the main loop was busy with something, in microseconds
+
+        count, max, p50, p99 and p999 of how late it was for checks that
+        should happen every 50 ms. Nothing else is answered in that time.
+        Only measured while "main_loop_stalls" is set in the global config.
+        """
+        return self.main_loop_stalls.summary()
+
+    def _in_worker(self, work, then) -> Future:
+        """
+        Call work in a worker thread, and then with its result in the main loop
+
+        The returned future gets the result of then, or the error of either
+        one of them. It is done in the main loop, so its callbacks may touch
+        the daemon.
+        """
+        finished = Future()
+
+        def in_main_loop(worker_future):
+            try:
+                finished.set_result(then(worker_future.result()))
+            except Exception as error:
+                logger.error("%s", error)
+                finished.set_exception(error)
+
+            return False
+
+        self._workers.submit(work).add_done_callback(
+            lambda worker_future: GLib.idle_add(in_main_loop, worker_future)
+        )
+        return finished
+
+    def _request_injection(self, device, mapping_name=None) -> Future:
+        """
+        Inject a device in the background, with its autoload mappings if None
+
+        The device can be a key or a path. Finding it and loading the
+        mappings is done by a worker, the returned future tells if it
+        worked out. A path is resolved to the key of its group first, so
+        requests for a group are counted the same no matter how they name
+        it.
+        """
+        if device and device.startswith("/dev"):
+            return self._request_path_injection(device, mapping_name)
+
+        number = self._begin_request(device)
+        future = self._in_worker(
+            partial(self._prepare_injection, device, mapping_name),
+            partial(self._injection_prepared, device, number),
+        )
+        future.add_done_callback(
+            lambda _: self._end_request(device, future.exception() is None and future.result())
+        )
+        return future
+
+    def _request_path_injection(self, path, mapping_name) -> Future:
+        requested = Future()
+
+        def request(group):
+            if group is None:
+                self.injection_started(path, False)
+                raise LookupError(f'device not found "{path}"')
+
+            self._request_injection(group.key, mapping_name).add_done_callback(
+                partial(self._copy_future, requested)
+            )
+
+        found = self._in_worker(partial(self._find_group, path), request)
+        found.add_done_callback(
+            lambda _: found.exception() is None or requested.set_exception(found.exception())
+        )
+        return requested
+
+    @staticmethod
+    def _copy_future(target: Future, source: Future):
+        if source.exception() is not None:
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result())
+
+    def _begin_request(self, device) -> int:
+        """Note that the device is about to be injected, returns the number of the request"""
+        number = self._requests.get(device, 0) + 1
+        self._requests[device] = number
+        self._pending[device] = self._pending.get(device, 0) + 1
+        self._publish_state(device)
+        return number
+
+    def _end_request(self, device, status):
+        self._pending[device] -= 1
+        if self._pending[device] == 0:
+            del self._pending[device]
+
+        self.injection_started(device, status)
+        self._publish_state(device)
+
+    def _prepare_injection(self, device, mapping_name):
+        """Find the group and load its mappings, in a worker"""
+        group = self._find_group(device)
+        if group is None:
+            raise LookupError(f'device not found "{device}"')
+
+        if mapping_name is None:
+            autoload = self.global_config.get("autoload") or {}
+            mapping_name = autoload.get(group.key)
+            if mapping_name is None:
+                raise LookupError(f'device is not set to autoload: "{group.key}"')
+
+        return group, self._load_context(group, mapping_name)
+
+    def _load_context(self, group, mapping_name) -> RuntimeContext:
+        mapping_path = os.path.join(
+            self.config_dir,
+            "mappings",
+            group.name,
+            f"{mapping_name}.json"
+        )
+
+        context = self.mapping_cache.get(mapping_path)
+        logger.debug("mappings to inject: %s", context.code_map)
+        return context
+
+    def _injection_prepared(self, device, number, prepared):
+        if self._requests.get(device) != number:
+            logger.debug('Not injecting "%s", it was requested again or stopped since', device)
+            return False
+
+        group, context = prepared
+        self._inject(group, context)
+        return True
+
+    def _control_request(self, request, peer, fds):
+        """
+        Handle a request that ev-remapper-control sent over the control socket
+
+        The device can be a key or a path, it is resolved in a worker so the
+        client doesn't need to look for devices itself. Methods in WITH_FD
+        get the fd that was sent along, and only someone who may read all
+        devices of the group on their own may record them.
+        """
+        method = request.get("method")
+        if method not in METHODS:
+            return {"error": f'unknown method "{method}"'}
+
+        config_dir = request.get("config_dir")
+        if config_dir:
+            self.set_config_dir(config_dir)
+
+        args = list(request.get("args", []))
+        if method in ["inject_device", "autoload_single"]:
+            if self.config_dir is None:
+                logger.error("control request to inject before the config dir is known")
+                return {"status": False}
+
+            # the device is looked for in a worker, answered once it is known
+            # how that went
+            mapping_name = args[0] if args else None
+            return self._control_response(
+                self._request_injection(request.get("device"), mapping_name)
+            )
+
+        if method == "autoload":
+            if self.config_dir is None:
+                logger.error("control request to autoload before the config dir is known")
+                return {"status": False}
+
+            return self._autoload_response(self._autoload())
+
+        if method in WITHOUT_DEVICE:
+            return {"status": self._call(method, args)}
+
+        device = request.get("device")
+
+        def call(group):
+            if group is None:
+                raise LookupError(f'device not found "{device}"')
+
+            if method not in WITH_FD:
+                return self._call(method, [group.key, *args])
+
+            if len(fds) != 1:
+                raise ValueError(f'expected the file for "{method}" to be sent along')
+
+            if not all(peer.may_read(path) for path in group.paths):
+                logger.error('user %d tried to record "%s"', peer.uid, group.key)
+                raise PermissionError(f'not allowed to read the devices of "{group.key}"')
+
+            return self._call(method, [group.key, fds[0]])
+
+        return self._control_response(
+            self._in_worker(partial(self._find_group, device), call)
+        )
+
+    def _call(self, method, args) -> bool:
+        logger.debug('control request "%s" %s', method, args)
+        result = getattr(self, method)(*args)
+        # stop_inject_device and stop_all don't return anything
+        return result is not False
+
+    @staticmethod
+    def _autoload_response(future: Future) -> Future:
+        response = Future()
+
+        def respond(_):
+            error = future.exception()
+            if error is not None:
+                response.set_result({"error": str(error)})
+                return
+
+            results, milliseconds = future.result()
+            response.set_result(
+                {"status": True, "results": results, "milliseconds": milliseconds}
+            )
+
+        future.add_done_callback(respond)
+        return response
+
+    @staticmethod
+    def _control_response(future: Future) -> Future:
+        response = Future()
+
+        def respond(_):
+            error = future.exception()
+            if error is not None:
+                response.set_result({"error": str(error)})
+            else:
+                response.set_result({"status": future.result()})
+
+        future.add_done_callback(respond)
+        return response
+
+    def _find_group(self, device):
+        """Find a group by its key or by the path of one of its devices"""
+        if not device:
+            return None
+
+        if device.startswith("/dev"):
+            with self._devices_lock:
+                group = DevGroups.find(path=device)
+                if group is None:
+                    # new device, with the discovery cache only that one is probed
+                    self._refresh_devices()
+                    group = DevGroups.find(path=device)
+
+            return group
+
+        self.refresh(device)
+        return DevGroups.find(key=device)
+
+    def _devices_added(self, paths, plugged_in_at):
+        """Autoload the groups of devices that the HotplugWatcher saw coming"""
+        if self.config_dir is None:
+            logger.debug("No config dir set yet, not autoloading %s", paths)
+            return
+
+        if self.global_config.get("hotplug") is False:
+            return
+
+        def find_keys():
+            with self._devices_lock:
+                self._refresh_devices()
+
+            autoload = self.global_config.get("autoload") or {}
+            keys = []
+            for path in paths:
+                group = DevGroups.find(path=path)
+                if group is None or group.key not in autoload or group.key in keys:
+                    continue
+
+                keys.append(group.key)
+
+            return keys
+
+        def autoload_keys(keys):
+            for key in keys:
+                future = self._request_injection(key)
+                future.add_done_callback(
+                    partial(self._hotplug_injection_requested, key, plugged_in_at)
+                )
+
+        self._in_worker(find_keys, autoload_keys)
+
+    def _hotplug_injection_requested(self, device_key, plugged_in_at, future):
+        if future.exception() is None and future.result():
+            GLib.timeout_add(5, self._hotplug_injection_started, device_key, plugged_in_at)
+
+    def _hotplug_injection_started(self, device_key, plugged_in_at):
+        """Poll the injector until it runs, and record how long that took"""
+        injector = self.injectors.get(device_key)
+        state = UNKNOWN if injector is None else injector.get_state()
+        waited = time.monotonic() - plugged_in_at
+
+        if state in [UNKNOWN, STARTING]:
+            # keep polling, but not forever
+            return waited < 10
+
+        if state == RUNNING:
+            self.hotplug_latency.record(int(waited * 1000000))
+            logger.info('Injecting "%s" %d ms after it was plugged in', device_key, waited * 1000)
+
+        return False
+
+    def get_hotplug_latency(self):
+        """
+        Get the time from plugging in a device until its injection runs
+
+        In microseconds, count, max, p50, p99 and p999 over all devices that
+        were autoloaded because they were plugged in.
+        """
+        return self.hotplug_latency.summary()
+
+    def get_uinput_pool_stats(self):
+        """
+        Get how often injections got a uinput that was already there
+
+        Contains size, hits, misses, hit_rate and saved_ms, the time that
+        creating the uinputs of the hits would have taken.
+        """
+        return self.uinput_pool.stats()
+
+    def get_mapping_cache_stats(self):
+        """Get size, hits, misses and hit_rate of the compiled presets"""
+        return self.mapping_cache.stats()
 
     def get_state(self, device_key):
         logger.info('request device "%s" state', device_key)
+        state = self._get_state(device_key)
+        logger.debug('device state "%s"', state)
+        return state
+
+    def get_all_states(self):
+        """Get the state of each device that is injected or about to be"""
+        return {
+            device_key: self._get_state(device_key)
+            for device_key in {*self.injectors, *self._pending}
+        }
+
+    def _get_state(self, device_key):
+        if self._pending.get(device_key):
+            # a worker is still preparing its injection
+            return STARTING
+
         injector = self.injectors.get(device_key, None)
 
         if injector is None:
             logger.debug('injector not found "%s"', device_key)
             return UNKNOWN
 
-        state = injector.get_state()
-        logger.debug('device state "%s"', state)
-        return state
+        return injector.get_state()
+
+    def _publish_state(self, device_key):
+        """Emit state_changed if the state of the device changed since the last time"""
+        state = self._get_state(device_key)
+        if self._states.get(device_key) != state:
+            self._states[device_key] = state
+            self.state_changed(device_key, state)
+
+    def _watch(self, owner, callback):
+        """Call callback in the main loop when the state of owner may have changed"""
+        self._watches[owner] = [
+            GLib.io_add_watch(fd, GLib.PRIORITY_DEFAULT, GLib.IO_IN | GLib.IO_HUP, callback)
+            for fd in owner.state_fds()
+        ]
+
+    def _unwatch(self, owner):
+        for watch in self._watches.pop(owner, []):
+            GLib.source_remove(watch)
+
+    def _injector_changed(self, device_key, injector, *_):
+        if self.injectors.get(device_key) is not injector:
+            # replaced, the watches are removed already
+            return False
+
+        self._publish_state(device_key)
+        if not injector.is_alive():
+            # nothing is going to change anymore
+            self._unwatch(injector)
+            return False
+
+        return True
+
+    def _engine_changed(self, engine, *_):
+        # even if none of its groups is injected anymore, otherwise the
+        # pipe stays readable
+        engine.receive()
+        for device_key, injector in list(self.injectors.items()):
+            if isinstance(injector, EngineInjector) and injector._engine is engine:
+                self._publish_state(device_key)
+
+        if not engine.is_alive():
+            self._unwatch(engine)
+            return False
+
+        return True
+
+    def get_latency(self, device_key):
+        """
+        Get the latency that the injection of a device adds, in microseconds
+
+        Contains count, max, p50, p99 and p999, and the same with a "wakeup_"
+        prefix if wakeup tracing is enabled. Empty if latency tracing is not
+        enabled in the injector settings of the device.
+        """
+        injector = self.injectors.get(device_key, None)
+
+        if injector is None or injector.stats.tracer is None:
+            logger.debug('no latency tracing for "%s"', device_key)
+            return {}
+
+        return injector.stats.tracer.summary()
+
+    def get_metrics(self, device_key):
+        """
+        Get counters of what the injection of a device did
+
+        events_read, events_forwarded, write_errors, grabs and regrabs, the
+        counters of get_overflows, remapped_<code> for each mapped code, and
+        cpu_seconds of the process that injects it, which is the process of
+        all devices with the "shared" engine. All of them count from the
+        start of the injection.
+        """
+        injector = self.injectors.get(device_key, None)
+
+        if injector is None or injector.stats.counters is None:
+            logger.debug('"%s" is not injected', device_key)
+            return {}
+
+        metrics = injector.stats.counters.summary(injector.context)
+        metrics.update(injector.stats.overflows.summary())
+        if injector.pid is not None:
+            metrics["cpu_seconds"] = cpu_seconds(injector.pid)
+
+        return metrics
+
+    def _collect_metrics(self):
+        """The metrics of each device and the CPU time of each process, for MetricsServer"""
+        samples = {}
+        cpu = {}
+        for device_key, injector in self.injectors.items():
+            if injector.stats.counters is None:
+                continue
+
+            samples[device_key] = self.get_metrics(device_key)
+            seconds = samples[device_key].pop("cpu_seconds", None)
+            if seconds is not None:
+                # the shared engine is one process for all devices
+                shared = isinstance(injector, EngineInjector)
+                cpu["engine" if shared else device_key] = seconds
+
+        return samples, cpu
+
+    def get_motion_stats(self, device_key):
+        """
+        Get how mouse motion of a device was coalesced
+
+        Counts the received and forwarded events and the merged frames, and
+        has count, max and percentiles of the queue delay in microseconds
+        with a "queue_delay_" prefix. Empty unless coalesce_motion is
+        enabled in the injector settings of the device.
+        """
+        injector = self.injectors.get(device_key, None)
+
+        if injector is None or injector.stats.motion is None:
+            logger.debug('no motion coalescing for "%s"', device_key)
+            return {}
+
+        return injector.stats.motion.summary()
+
+    def get_overflows(self, device_key):
+        """
+        Get how often the kernel dropped events of a device
+
+        Happens when the injection can't keep up with the device. Has the
+        number of overflows, of events discarded afterwards and of keys that
+        were pressed or released to catch up with the device.
+        """
+        injector = self.injectors.get(device_key, None)
+
+        if injector is None or injector.stats.overflows is None:
+            logger.debug('"%s" is not injected', device_key)
+            return {}
+
+        return injector.stats.overflows.summary()
+
+    def start_recording(self, device_key, fd):
+        """
+        Record the events of an injection into a new trace file
+
+        fd is an empty file that the client opened for reading and writing,
+        the service doesn't open files for others. The trace has room for
+        the last "recording_events" events that were read from the devices
+        and as many that were written to the uinputs. Recording stops with
+        stop_recording, or when the injection is stopped or started again.
+        Only offered on the control socket, which tells who asks for it.
+        """
+        injector = self.injectors.get(device_key, None)
+
+        if injector is None or injector.get_state() not in [STARTING, RUNNING]:
+            logger.error('can\'t record "%s", it is not injected', device_key)
+            return False
+
+        try:
+            init_trace(fd, int(injector.options.get("recording_events", RECORDING_EVENTS)))
+        except (OSError, ValueError) as error:
+            logger.error('Failed to set up the trace for "%s": %s', device_key, error)
+            return False
+
+        injector.start_recording(fd)
+        return True
+
+    def stop_recording(self, device_key):
+        """Stop recording the events of an injection, see start_recording"""
+        injector = self.injectors.get(device_key, None)
+
+        if injector is None:
+            logger.debug('injector not found "%s"', device_key)
+            return False
+
+        injector.stop_recording()
+        return True
+
+    def get_grabs(self, device_key):
+        """
+        Get how grabbing the devices of an injection went
+
+        Maps the paths of the devices that the mappings need to whether
+        they were grabbed and how many milliseconds that took. Devices that
+        are still being retried are missing.
+        """
+        injector = self.injectors.get(device_key, None)
+
+        if injector is None:
+            logger.debug('injector not found "%s"', device_key)
+            return {}
+
+        # applies what the injection reported so far
+        injector.get_state()
+        return dict(injector.grabs)
+
+    def get_realtime(self, device_key):
+        """
+        Get which settings of the realtime injector option were applied
+
+        Empty until the injection is running, or if there are none.
+        """
+        injector = self.injectors.get(device_key, None)
+
+        if injector is None:
+            logger.debug('injector not found "%s"', device_key)
+            return {}
+
+        injector.get_state()
+        return dict(injector.realtime)
 
     def publish(self):
         bus = SystemBus()
@@ -187,132 +893,278 @@ class Daemon:
         return out
 
     def refresh(self, group_key=""):
+        with self._devices_lock:
+            self._refresh(group_key)
+
+    def _refresh(self, group_key):
         now = time.time()
         if now - 10 > self.refreshed_devices_at:
             logger.debug("Refreshing device list due to time since last refresh")
-            time.sleep(0.1)
-            DevGroups.refresh()
+            self._refresh_devices()
 
             logger.debug("Finished refreshing")
             logger.debug("Available device groups: %s", [group.key for group in DevGroups])
-            self.refreshed_devices_at = now
             return
 
         if not DevGroups.find(key=group_key):
             logger.debug("Refreshing device list due to missing device")
-            time.sleep(0.1)
-            DevGroups.refresh()
+            self._refresh_devices()
 
             logger.debug("finished refreshing")
             logger.debug("%s", [group.key for group in DevGroups])
-            self.refreshed_devices_at = now
+
+    def _refresh_devices(self):
+        """Look for devices and drop the uinputs of those that are gone"""
+        DevGroups.refresh()
+        self.refreshed_devices_at = time.time()
+
+        # workers refresh as well, the pool belongs to the main loop
+        GLib.idle_add(self._evict_uinputs)
+
+    def _evict_uinputs(self):
+        self.uinput_pool.evict({
+            descriptor.identifier
+            for group in DevGroups
+            for descriptor in group.descriptors.values()
+        })
+        return False
 
     def stop_inject_device(self, device_key):
+        if device_key in self._requests:
+            # requests that are still prepared are dropped
+            self._requests[device_key] += 1
+
         if self.injectors.get(device_key) is None:
             logger.warning('request to stop injecting for "%s" but none is running', device_key)
             return
 
         self.injectors[device_key].stop_injecting()
+        # nothing reads its stats anymore
+        self.injectors[device_key].release()
+        # its uinputs stay in the pool for the next injection of the device
+        self._publish_state(device_key)
 
     def inject_device(self, device_key, mapping):
+        """
+        Start injecting a device with the mappings of the given name
+
+        Returns right away, the device is looked for and the mappings are
+        loaded in the background. The injection_started signal tells how
+        that went, get_state is STARTING until then.
+        """
         logger.info('request to inject device "%s"', device_key)
 
         if self.config_dir is None:
             logger.error('user tried to inject "%s" before informing service of config_dir, call set_config_dir', device_key)
             return False
 
-        self.refresh(device_key)
+        self._request_injection(device_key, mapping)
+        return True
+
+    def _inject(self, group, context):
+        """
+        Inject a group with the given mappings
+
+        If the group is already being injected with the same devices and
+        settings, the running injector only switches to the new mappings.
+        That keeps the devices grabbed and the uinputs in place, so there is
+        no moment in which events escape unmapped and no new device shows up
+        for the desktop to configure. Otherwise the running injector is
+        stopped and a new one started.
+        """
+        injector = self.injectors.get(group.key)
+        if injector is not None and self._can_reload(injector, group):
+            injector.reload(context)
+            return
+
+        # Make sure we stop injector for this device, if already running. Its
+        # uinputs stay in the pool for the new one.
+        if injector is not None:
+            injector.stop_injecting()
 
-        inject_group = DevGroups.find(key=device_key)
-        if inject_group is None:
+        self._set_injector(group.key, self._start_injector(group, context))
+
+    def _can_reload(self, injector, group):
+        if injector.get_state() != RUNNING:
             return False
 
-        mapping_path = os.path.join(
-            self.config_dir,
-            "mappings",
-            inject_group.name,
-            f"{mapping}.json"
-        )
+        if injector.group.paths != group.paths:
+            # devices were plugged in or removed since the injection started
+            return False
 
-        mappings = Mappings()
-        mappings.load(mapping_path)
-        context = RuntimeContext(mappings._mappings)
+        shared = isinstance(injector, EngineInjector)
+        if shared != (self.global_config.get("engine") == "shared"):
+            return False
 
-        logger.debug("mappings to inject: %s", mappings._mappings)
+        return injector.options == self.global_config.get_injector_options(group.key)
 
-        # Make sure we stop injector for this device, if already running
-        if self.injectors.get(device_key) is not None:
-            self.stop_inject_device(device_key)
+    def _set_injector(self, device_key, injector):
+        previous = self.injectors.get(device_key)
+        if previous is not None:
+            self._unwatch(previous)
+            previous.release()
 
-        injector = Injector(inject_group, context)
-        injector.start()
-        self.injectors[inject_group.key] = injector
+        self.injectors[device_key] = injector
+        if isinstance(injector, Injector):
+            self._watch(injector, partial(self._injector_changed, device_key, injector))
 
-        return True
+        self._publish_state(device_key)
 
-    def autoload_single(self, device_key):
-        logger.info('request to autoload device "%s"', device_key)
+    def _start_injector(self, group, context):
+        """
+        Start injecting a group according to the configured engine mode
 
-        if self.config_dir is None:
-            logger.error('user tried to inject "%s" before informing service of config_dir, call set_config_dir', device_key)
-            return False
+        "process" (the default) runs every group in its own Injector process,
+        "shared" runs all groups in a single InjectionEngine process.
+        """
+        options = self.global_config.get_injector_options(group.key)
 
-        self.refresh(device_key)
+        uinputs = None
+        if options.get("uinput_pool", True):
+            uinputs = self.uinput_pool.acquire(group, context)
+        else:
+            self.uinput_pool.release(group.key)
 
-        inject_group = DevGroups.find(key=device_key)
-        autoload = self.global_config.get("autoload")
-        try:
-            mapping_name = autoload[inject_group.key]
-        except KeyError:
-            logger.info('request to autoload_single but device is not set to autoload: "%s"', device_key)
-            return False
+        if self.global_config.get("engine") != "shared":
+            injector = Injector(group, context, options, uinputs)
+            injector.start()
+            return injector
 
-        mapping_path = os.path.join(
-            self.config_dir,
-            "mappings",
-            inject_group.name,
-            f"{mapping_name}.json"
-        )
+        if self.engine is None or self.engine.exitcode is not None:
+            # not started yet, or it died and took its groups with it
+            self.engine = InjectionEngine(self.global_config.get("injector.realtime"))
 
-        mappings = Mappings()
-        mappings.load(mapping_path)
-        context = RuntimeContext(mappings._mappings)
+        if options.get("realtime") != self.engine.profile:
+            logger.warning(
+                'The realtime setting of "%s" is ignored, the shared engine uses %s for all devices',
+                group.key,
+                self.engine.profile,
+            )
 
-        logger.debug("mappings to inject: %s", mappings._mappings)
+        injector = self.engine.inject(group, context, options, uinputs)
+        if self.engine not in self._watches:
+            # started by inject
+            self._watch(self.engine, partial(self._engine_changed, self.engine))
 
-        # Make sure we stop injector for this device, if already running
-        if self.injectors.get(device_key) is not None:
-            self.stop_inject_device(device_key)
+        return injector
 
-        injector = Injector(inject_group, context)
-        injector.start()
-        self.injectors[inject_group.key] = injector
+    def autoload_single(self, device_key):
+        """Like inject_device, with the mappings that are set to autoload"""
+        logger.info('request to autoload device "%s"', device_key)
+
+        if self.config_dir is None:
+            logger.error('user tried to inject "%s" before informing service of config_dir, call set_config_dir', device_key)
+            return False
 
+        self._request_injection(device_key)
         return True
 
     def autoload(self):
+        """
+        Inject all devices that are set to autoload
+
+        Returns right away, the autoload_done signal has the result of each
+        device and how many milliseconds it took.
+        """
         logger.info('request to autoload devices')
 
         if self.config_dir is None:
             logger.error('user tried to autoload before informing service of config_dir, call set_config_dir')
             return False
 
-        self.refresh()
+        self._autoload()
+        return True
+
+    def _autoload(self) -> Future:
+        """
+        Autoload all devices with one device scan, loading their mappings at once
 
-        autoload = self.global_config.get("autoload")
+        The injectors are started one after the other without waiting for
+        any of them. The returned future gets a map of device keys to
+        whether they were injected, and the milliseconds it took.
+        """
+        start = time.monotonic()
+        autoload = dict(self.global_config.get("autoload") or {})
         logger.debug('autoloading: %s', list(autoload.keys()))
+        numbers = {device_key: self._begin_request(device_key) for device_key in autoload}
 
-        for dev_key in autoload:
-            inject_group = DevGroups.find(key=dev_key)
-            if inject_group is None:
-                logger.info('could not find device to autoload: "%s", skipping', dev_key)
+        return self._in_worker(
+            partial(self._prepare_autoload, autoload),
+            partial(self._autoload_prepared, numbers, start),
+        )
 
-            self.inject_device(dev_key, autoload[dev_key])
+    def _prepare_autoload(self, autoload):
+        """
+        Find the groups and load their mappings, in a worker
 
-        return True
+        Doesn't raise, each device gets the error that kept it from being
+        prepared instead, so that each of their requests is ended.
+        """
+        try:
+            with self._devices_lock:
+                self._refresh_devices()
+        except Exception as error:
+            logger.error("Failed to look for devices to autoload: %s", error)
+            return {device_key: error for device_key in autoload}
+
+        groups = {}
+        prepared = {}
+        for device_key in autoload:
+            group = DevGroups.find(key=device_key)
+            if group is None:
+                logger.info('could not find device to autoload: "%s", skipping', device_key)
+                prepared[device_key] = LookupError(f'device not found "{device_key}"')
+            else:
+                groups[device_key] = group
+
+        if not groups:
+            return prepared
+
+        # not the pool of the daemon, this worker would wait for itself
+        with ThreadPoolExecutor(min(WORKERS, len(groups))) as loaders:
+            contexts = {
+                device_key: loaders.submit(self._load_context, group, autoload[device_key])
+                for device_key, group in groups.items()
+            }
+
+        for device_key, context in contexts.items():
+            if context.exception() is not None:
+                prepared[device_key] = context.exception()
+            else:
+                prepared[device_key] = (groups[device_key], context.result())
+
+        return prepared
+
+    def _autoload_prepared(self, numbers, start, prepared):
+        results = {}
+        for device_key, number in numbers.items():
+            results[device_key] = False
+            try:
+                outcome = prepared[device_key]
+                if isinstance(outcome, Exception):
+                    raise outcome
+
+                results[device_key] = self._injection_prepared(device_key, number, outcome)
+            except Exception as error:
+                logger.error('Failed to autoload "%s": %s', device_key, error)
+            finally:
+                self._end_request(device_key, results[device_key])
+
+        milliseconds = (time.monotonic() - start) * 1000
+        logger.info(
+            "Autoloaded %d of %d devices in %d ms",
+            sum(results.values()), len(results), milliseconds,
+        )
+        self.autoload_done(results, milliseconds)
+        return results, milliseconds
 
     def stop_all(self):
         logger.info('request to stop all injectors')
 
+        for device in self._requests:
+            self._requests[device] += 1
+
         for injector_key in self.injectors:
             self.injectors[injector_key].stop_injecting()
+            self.injectors[injector_key].release()
+            self._publish_state(injector_key)
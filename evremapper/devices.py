@@ -4,8 +4,9 @@ import threading
 import asyncio
 import multiprocessing
 import json
+import os
 
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 from evremapper.logger import logger
 
@@ -53,8 +54,10 @@ def _is_mouse_dev(capabilities) -> bool:
 
 def classify(device: evdev.InputDevice):
     """Classify the type of this device"""
-    capabilities = device.capabilities(absinfo=False)
+    return _classify_capabilities(device.capabilities(absinfo=False))
 
+
+def _classify_capabilities(capabilities) -> str:
     if _is_mouse_dev(capabilities):
         return MOUSE
     if _is_keyboard_dev(capabilities):
@@ -72,8 +75,67 @@ def device_identifier(device: evdev.InputDevice):
     )
 
 
+NodeIdentity = Tuple[int, int, int]
+
+
+def node_identity(path: str) -> Optional[NodeIdentity]:
+    """
+    Something that changes when the device behind a /dev/input node changes
+
+    Replugging a device may give it the same path, but the node is created
+    anew with another inode and ctime, and possibly another dev_t.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return stat.st_rdev, stat.st_ino, stat.st_ctime_ns
+
+
+class DeviceDescriptor:
+    """
+    Everything discovery found out about a single /dev/input node
+
+    Cached between refreshes as long as the node stays the same, and handed
+    to the injection so it doesn't need to ask the kernel again.
+    """
+
+    def __init__(self, path: str, node: NodeIdentity, device: evdev.InputDevice):
+        self.path = path
+        self.node = node
+
+        self.name: str = device.name
+        self.info: evdev.DeviceInfo = device.info
+        self.phys: str = device.phys
+        self.identifier = device_identifier(device)
+        self.input_props: List[int] = device.input_props()
+
+        # with absinfo, for creating uinputs
+        self.capabilities = device.capabilities(absinfo=True)
+        # only the codes
+        self.codes = {
+            ev_type: [code[0] if isinstance(code, tuple) else code for code in codes]
+            for ev_type, codes in self.capabilities.items()
+        }
+
+        self.type = _classify_capabilities(self.codes)
+
+    def is_current(self) -> bool:
+        """If the node at the path is still the one that was described"""
+        return node_identity(self.path) == self.node
+
+    def __repr__(self):
+        return f"DeviceDescriptor({self.path}, {self.name})"
+
+
 class _DeviceGroup:
-    def __init__(self, paths: List[str], names: List[str], types: List[str], key: str):
+    def __init__(self,
+                 paths: List[str],
+                 names: List[str],
+                 types: List[str],
+                 key: str,
+                 descriptors: Dict[str, DeviceDescriptor] = None):
 
         self.key = key
 
@@ -81,8 +143,19 @@ class _DeviceGroup:
         self.names = names
         self.types = types
 
+        # path -> what discovery found out about it, if known
+        self.descriptors = descriptors or {}
+
         self.name: str = sorted(names, key=len)[0]
 
+    def get_descriptor(self, path: str) -> Optional[DeviceDescriptor]:
+        """The descriptor of a path if the node didn't change since discovery"""
+        descriptor = self.descriptors.get(path)
+        if descriptor is None or not descriptor.is_current():
+            return None
+
+        return descriptor
+
     def dumps(self):
         """Return a string representing this object."""
         return json.dumps(
@@ -99,52 +172,97 @@ class DeviceGroupEncoder(json.JSONEncoder):
 
 
 class _DeviceDetection(threading.Thread):
-    def __init__(self, pipe):
+    """
+    Finds and groups the devices in /dev/input
+
+    cache maps paths to the descriptors of the previous run, only nodes that
+    are new or changed since then are opened. It is updated in place.
+    """
+
+    def __init__(self, pipe, cache: Dict[str, DeviceDescriptor] = None):
         self.pipe = pipe
+        self.cache = {} if cache is None else cache
         super().__init__()
 
+    def _describe(self, path: str) -> Optional[DeviceDescriptor]:
+        node = node_identity(path)
+        cached = self.cache.get(path)
+        if cached is not None and node is not None and cached.node == node:
+            return cached
+
+        try:
+            dev = evdev.InputDevice(path)
+        except Exception as e:
+            logger.error("Failed to access %s: %s", path, str(e))
+            return None
+
+        try:
+            descriptor = DeviceDescriptor(path, node, dev)
+        except OSError as e:
+            logger.error("Failed to access %s: %s", path, str(e))
+            return None
+        finally:
+            dev.close()
+
+        self.cache[path] = descriptor
+        return descriptor
+
     def run(self):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
 
         logger.debug("Searching for valid device paths")
 
+        paths = evdev.list_devices()
+        for path in set(self.cache).difference(paths):
+            # gone
+            del self.cache[path]
+
+        probed = 0
+
         # Their are often multiple device paths associated with a single hardware
         # so we have to group them together
         dev_groups = {}
-        for path in evdev.list_devices():
-            try:
-                dev = evdev.InputDevice(path)
-            except Exception as e:
-                logger.error("Failed to access %s: %s", path, str(e))
+        for path in paths:
+            cached = self.cache.get(path)
+            descriptor = self._describe(path)
+            if descriptor is None:
                 continue
 
-            if dev.name in ["Power Button", "Sleep Button"]:  # Not gonna try to remap these devices
-                continue
+            if descriptor is not cached:
+                probed += 1
 
-            device_type = classify(dev)
-
-            capabilities = dev.capabilities(absinfo=False)
+            if descriptor.name in ["Power Button", "Sleep Button"]:  # Not gonna try to remap these devices
+                continue
 
-            key_codes = capabilities.get(EV_KEY)
+            key_codes = descriptor.codes.get(EV_KEY)
 
             if key_codes is None:
                 continue
 
-            dev_id = device_identifier(dev)
+            dev_id = descriptor.identifier
             if dev_groups.get(dev_id) is None:
                 dev_groups[dev_id] = []
 
-            logger.debug('Found %s device "%s"("%s") at %s', device_type, dev.name, dev_id, path)
+            if descriptor is not cached:
+                logger.debug(
+                    'Found %s device "%s"("%s") at %s',
+                    descriptor.type,
+                    descriptor.name,
+                    dev_id,
+                    path
+                )
+
+            dev_groups[dev_id].append(descriptor)
 
-            dev_groups[dev_id].append((dev.name, path, device_type))
+        logger.debug("Probed %d of %d device nodes", probed, len(paths))
 
         result = []
         used_keys = set()
         for group in dev_groups.values():
-            names = [device[0] for device in group]
-            paths = [device[1] for device in group]
-            types = [device[2] for device in group]
+            names = [device.name for device in group]
+            paths = [device.path for device in group]
+            types = [device.type for device in group]
 
             key_base = sorted(names, key=len)[0]
             key = key_base
@@ -158,7 +276,8 @@ class _DeviceDetection(threading.Thread):
                 key=key,
                 paths=paths,
                 types=types,
-                names=names
+                names=names,
+                descriptors={device.path: device for device in group}
             )
 
             result.append(group)
@@ -169,6 +288,8 @@ class _DeviceDetection(threading.Thread):
 class _DeviceGroups:
     def __init__(self):
         self._groups: List[_DeviceGroup] = None
+        # path -> descriptor of what the last refresh found
+        self._descriptors: Dict[str, DeviceDescriptor] = {}
 
     def __iter__(self):
         return iter(self._groups)
@@ -186,7 +307,7 @@ class _DeviceGroups:
     def refresh(self):
         # groups.refresh()
         (r, w) = multiprocessing.Pipe()
-        _DeviceDetection(w).start()
+        _DeviceDetection(w, self._descriptors).start()
 
         result = r.recv()
         self._groups = result
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+import asyncio
+import itertools
+import multiprocessing
+import os
+
+from typing import Dict, List, Optional, Tuple
+
+from evremapper.devices import _DeviceGroup
+from evremapper.logger import logger, get_log_setup, restore_log_setup
+from evremapper.configs.context import RuntimeContext
+from evremapper.metrics import InjectionStats
+from evremapper.realtime import Profile, apply_profile
+from evremapper.recording import TraceFile
+from evremapper.uinput_pool import PooledUInput
+from evremapper.injector import (
+    Injection,
+    InjectorOptions,
+    GRAB,
+    REALTIME,
+    STARTING,
+    FAILED,
+    RUNNING,
+    STOPPED,
+)
+
+# Messages to the engine process
+START = 0
+STOP = 1
+RELOAD = 2
+RECORD = 3
+
+_tokens = itertools.count()
+
+
+class EngineInjector:
+    """
+    The daemon side handle of one device group injected by an InjectionEngine
+
+    Offers the same get_state, stop_injecting, reload and recording methods
+    as an Injector, so the daemon doesn't need to care which one of them it is
+    talking to.
+    """
+
+    def __init__(self,
+                 engine: "InjectionEngine",
+                 group: _DeviceGroup,
+                 token: int,
+                 context: RuntimeContext,
+                 options: InjectorOptions = None,
+                 stats: InjectionStats = None):
+        self._engine = engine
+        self._token = token
+        self._state = STARTING
+
+        self.group = group
+        self.context = context
+        self.options = options or {}
+        self.stats = stats or InjectionStats()
+        # path -> (grabbed, milliseconds that grabbing took)
+        self.grabs: Dict[str, Tuple[bool, float]] = {}
+
+    @property
+    def realtime(self) -> Dict[str, bool]:
+        """The realtime settings of the engine, they apply to all of its groups"""
+        return self._engine.realtime
+
+    @property
+    def pid(self) -> Optional[int]:
+        """The process that injects, shared with all other groups of the engine"""
+        return self._engine.pid
+
+    def get_state(self):
+        self._engine.receive()
+
+        if self._state in [STARTING, RUNNING] and not self._engine.is_alive():
+            # the whole engine died, this group died with it
+            self._state = FAILED
+            logger.error("Injection engine was unexpectedly found stopped")
+
+        return self._state
+
+    def stop_injecting(self):
+        logger.info('Stopping injection for group "%s"', self.group.key)
+        self._engine.stop(self._token)
+        self._state = STOPPED
+
+    def reload(self, context: RuntimeContext):
+        """Make the running injection use other mappings, see Injection.reload"""
+        logger.info('Reloading the mappings of group "%s"', self.group.key)
+        self.context = context
+        self._engine.reload(self._token, context)
+
+    def start_recording(self, fd: int):
+        """Make the running injection record into a new trace, see Injection.record"""
+        self._engine.record(self._token, fd)
+
+    def stop_recording(self):
+        self._engine.record(self._token, None)
+
+    def release(self):
+        """Free the shared memory of this injection once it is not needed anymore"""
+        self.stats.release()
+
+
+class InjectionEngine(multiprocessing.Process):
+    """
+    Runs the injections of many device groups in one process on one loop
+
+    Instead of forking the daemon once per device group, all groups share a
+    single worker process and its epoll based asyncio loop. Each group runs
+    in its own task, a group that crashes is reported as FAILED without
+    affecting the other ones.
+
+    The realtime profile applies to the whole process, once the first group
+    is forwarded. The "realtime" injector option of the groups is ignored.
+    """
+
+    def __init__(self, profile: Optional[Profile] = None):
+        self._msg_pipe = multiprocessing.Pipe()
+
+        self.profile = profile
+        # realtime setting -> if it was applied, in the daemon process
+        self.realtime: Dict[str, bool] = {}
+        # only used in the engine process
+        self._profile_applied = False
+
+        # token -> handle, only used in the daemon process
+        self._injectors: Dict[int, EngineInjector] = {}
+        # token -> task and injection, only used in the engine process
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._injections: Dict[int, Injection] = {}
+        self._closed: asyncio.Event = None
+
+        super().__init__(name="ev-remapper engine")
+        self._log_setup = get_log_setup()
+
+    def inject(self,
+               group: _DeviceGroup,
+               context: RuntimeContext,
+               options: InjectorOptions = None,
+               uinputs: Optional[Dict[str, PooledUInput]] = None) -> EngineInjector:
+        """
+        Start injecting a group, starts the engine process if needed
+
+        The fds of the uinputs are duplicated for the engine process.
+        """
+        if not self.is_alive():
+            self.start()
+
+        token = next(_tokens)
+        stats = InjectionStats.from_options(options)
+        injector = EngineInjector(self, group, token, context, options, stats)
+        self._injectors[token] = injector
+        # the engine applies its own profile
+        options = {key: value for key, value in (options or {}).items() if key != "realtime"}
+        self._msg_pipe[1].send((START, token, group, context, options, stats, uinputs))
+        return injector
+
+    def stop(self, token: int):
+        self._injectors.pop(token, None)
+        if self.is_alive():
+            self._msg_pipe[1].send((STOP, token))
+
+    def reload(self, token: int, context: RuntimeContext):
+        if self.is_alive():
+            self._msg_pipe[1].send((RELOAD, token, context))
+
+    def record(self, token: int, fd: Optional[int]):
+        """Like Injector.start_recording, or stop_recording with None"""
+        if self.is_alive():
+            self._msg_pipe[1].send((RECORD, token, None if fd is None else TraceFile(fd)))
+
+    def state_fds(self) -> List[int]:
+        """Like Injector.state_fds, for the states of all groups"""
+        return [self._msg_pipe[1].fileno(), self.sentinel]
+
+    def receive(self):
+        """Apply all state changes that the engine process reported"""
+        while self._msg_pipe[1].poll():
+            token, msg = self._msg_pipe[1].recv()
+            if isinstance(msg, tuple) and msg[0] == REALTIME:
+                # of the whole process
+                self.realtime = msg[1]
+                continue
+
+            injector = self._injectors.get(token)
+            if injector is None:
+                # stopped in the meantime
+                continue
+
+            if isinstance(msg, tuple) and msg[0] == GRAB:
+                _, path, milliseconds, grabbed = msg
+                injector.grabs[path] = (grabbed, milliseconds)
+            else:
+                injector._state = msg
+
+    def _report(self, token: int, msg):
+        self._msg_pipe[0].send((token, msg))
+
+    async def _run_group(self,
+                         token: int,
+                         group: _DeviceGroup,
+                         context: RuntimeContext,
+                         options: InjectorOptions,
+                         stats: InjectionStats,
+                         uinputs: Optional[Dict[str, PooledUInput]]):
+        states = []
+
+        def report_state(state):
+            states.append(state)
+            self._report(token, state)
+            if state == RUNNING and not self._profile_applied:
+                self._apply_profile()
+
+        def report_grab(path, milliseconds, grabbed):
+            self._report(token, (GRAB, path, milliseconds, grabbed))
+
+        injection = Injection(group, context, options, stats, uinputs)
+        self._injections[token] = injection
+        try:
+            await injection.run(report_state, report_grab)
+        except asyncio.CancelledError:
+            logger.debug('stopped injecting group "%s"', group.key)
+        except Exception as error:
+            logger.error('Injection of group "%s" crashed: %s', group.key, error)
+            self._report(token, FAILED)
+        else:
+            if states and states[-1] == RUNNING:
+                # the devices stopped delivering events, same thing as an
+                # Injector process that exits on its own
+                logger.error('Injection of group "%s" stopped early', group.key)
+                self._report(token, FAILED)
+        finally:
+            self._tasks.pop(token, None)
+            self._injections.pop(token, None)
+            stats.close()
+
+    def _apply_profile(self):
+        self._profile_applied = True
+        applied = apply_profile(self.profile)
+        if applied:
+            self._report(None, (REALTIME, applied))
+
+    def _on_message(self):
+        loop = asyncio.get_running_loop()
+        while self._msg_pipe[0].poll():
+            try:
+                msg = self._msg_pipe[0].recv()
+            except EOFError:
+                logger.info("The daemon went away, stopping the injection engine")
+                loop.remove_reader(self._msg_pipe[0].fileno())
+                self._closed.set()
+                return
+
+            if msg[0] == START:
+                _, token, group, context, options, stats, uinputs = msg
+                logger.info('Starting injecting the for device "%s"', group.key)
+                self._tasks[token] = loop.create_task(
+                    self._run_group(token, group, context, options, stats, uinputs)
+                )
+            elif msg[0] == STOP:
+                task = self._tasks.get(msg[1])
+                if task is not None:
+                    task.cancel()
+            elif msg[0] == RELOAD:
+                _, token, context = msg
+                injection = self._injections.get(token)
+                if injection is not None:
+                    injection.reload(context)
+            elif msg[0] == RECORD:
+                _, token, trace = msg
+                injection = self._injections.get(token)
+                if injection is not None:
+                    injection.record(trace)
+                elif trace is not None:
+                    os.close(trace.fd)
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        self._closed = asyncio.Event()
+        loop.add_reader(self._msg_pipe[0].fileno(), self._on_message)
+
+        # runs until the daemon goes away
+        await self._closed.wait()
+
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+
+        if tasks:
+            # ungrab everything before exiting
+            await asyncio.wait(tasks)
+
+    def run(self):
+        restore_log_setup(self._log_setup)
+        logger.info("Starting injection engine")
+
+        # only the daemon writes to this end, closing our copy of it makes
+        # the pipe report EOF once the daemon is gone
+        self._msg_pipe[1].close()
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(self._serve())
+
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import os
+import struct
+
+from typing import TYPE_CHECKING, Optional
+
+import evdev
+
+from evremapper.metrics import InjectionCounters
+
+if TYPE_CHECKING:
+    # it imports this module
+    from evremapper.recording import Recorder
+
+# struct input_event: struct timeval time; __u16 type; __u16 code; __s32 value
+EVENT_FORMAT = "llHHi"
+EVENT_STRUCT = struct.Struct(EVENT_FORMAT)
+EVENT_SIZE = EVENT_STRUCT.size
+# where type, code and value are within an event, in units of their own size,
+# for accessing them through memoryview casts of a buffer of events
+TYPE_INDEX = struct.calcsize("ll") // 2
+CODE_INDEX = TYPE_INDEX + 1
+VALUE_INDEX = (struct.calcsize("ll") + 4) // 4
+
+# Mice and keyboards rarely report more than a handful of events per frame,
+# multitouch devices can go up to a few dozen
+MAX_FRAME_EVENTS = 64
+
+
+def write_all(fd: int, view: memoryview):
+    """Write a buffer of events to a uinput fd"""
+    written = 0
+    size = len(view)
+    while written < size:
+        # uinput always consumes whole events, but don't rely on the whole
+        # buffer being taken in one go
+        written += os.write(fd, view[written:size])
+
+
+class FrameWriter:
+    """
+    Collects the events of one frame and writes them to a uinput fd at once
+
+    Events are packed into a preallocated buffer and written with a single
+    write call as soon as the SYN_REPORT that ends the frame arrives. A frame
+    that doesn't fit into the buffer is flushed early, which is fine because
+    the kernel keeps queueing the events until it sees the SYN_REPORT.
+    Written events and failed writes are counted in counters, if any, and
+    written events are copied into recorder, if it is set.
+    """
+
+    def __init__(self,
+                 fd: int,
+                 max_events: int = MAX_FRAME_EVENTS,
+                 counters: Optional[InjectionCounters] = None):
+        self._fd = fd
+        self._counters = counters
+        self.recorder: Optional["Recorder"] = None
+        self._buffer = bytearray(max_events * EVENT_SIZE)
+        self._view = memoryview(self._buffer)
+        self._capacity = len(self._buffer)
+        self._pending = 0  # bytes in the buffer that are not written yet
+
+    @property
+    def pending(self) -> int:
+        """Number of events waiting for the end of their frame"""
+        return self._pending // EVENT_SIZE
+
+    def write(self, type: int, code: int, value: int):
+        if self._pending == self._capacity:
+            self.flush()
+
+        # The kernel stamps events injected through uinput itself, no need to
+        # provide a time
+        EVENT_STRUCT.pack_into(self._buffer, self._pending, 0, 0, type, code, value)
+        self._pending += EVENT_SIZE
+
+        if type == evdev.ecodes.EV_SYN and code == evdev.ecodes.SYN_REPORT:
+            self.flush()
+
+    def flush(self):
+        """Write all pending events, even if their frame is not complete yet"""
+        pending = self._pending
+        if pending == 0:
+            return
+
+        self._pending = 0
+        try:
+            write_all(self._fd, self._view[:pending])
+        except OSError:
+            if self._counters is not None:
+                self._counters.values[InjectionCounters.WRITE_ERRORS] += 1
+
+            raise
+
+        if self._counters is not None:
+            self._counters.values[InjectionCounters.EVENTS_FORWARDED] += pending // EVENT_SIZE
+
+        if self.recorder is not None:
+            self.recorder.emitted_events(self._view[:pending])
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+import socket
+import time
+
+from typing import Callable, Dict, List
+
+import gi
+gi.require_version("GLib", "2.0")
+from gi.repository import GLib
+
+from evremapper.logger import logger
+from evremapper.injector import EV_DEVICE_PREFIX
+
+# not exported by the socket module
+NETLINK_KOBJECT_UEVENT = 15
+# multicast group of the uevents that come straight from the kernel
+_KERNEL_EVENTS = 1
+
+# a burst of uevents is over once there was none for this long
+QUIET_MS = 50
+# but don't wait longer than this after the first one of a burst
+MAX_WAIT_MS = 500
+
+
+def parse_uevent(data: bytes) -> Dict[str, str]:
+    """Get the properties of a kernel uevent like "add@/devices/..\\0ACTION=add\\0.." """
+    properties = {}
+    for field in data.split(b"\0")[1:]:
+        key, separator, value = field.partition(b"=")
+        if separator:
+            properties[key.decode(errors="replace")] = value.decode(errors="replace")
+
+    return properties
+
+
+def is_own_device(properties: Dict[str, str]) -> bool:
+    """If the uevent is about a uinput that an injection created"""
+    devpath = properties.get("DEVPATH", "")
+    if not devpath.startswith("/devices/virtual/"):
+        return False
+
+    try:
+        # the name is in the input device that the event node belongs to
+        with open(f"/sys{devpath}/device/name", "r") as file:
+            return file.read().startswith(EV_DEVICE_PREFIX)
+    except OSError:
+        return False
+
+
+class HotplugWatcher:
+    """
+    Tells the daemon about event devices that were plugged in
+
+    Listens to kernel uevents on a netlink socket in the GLib main loop.
+    Plugging in a hub or a device with many interfaces causes bursts of
+    them, they are collected until things quiet down and then reported in
+    one go together with the monotonic time at which the first one arrived.
+    The uinputs of injections are not reported.
+    """
+
+    def __init__(self, on_added: Callable[[List[str], float], None]):
+        self._on_added = on_added
+
+        self._socket: socket.socket = None
+        self._watch = None
+        self._timeout = None
+
+        self._pending: List[str] = []
+        self._first_at = 0.0
+        self._last_at = 0.0
+
+    def start(self) -> bool:
+        try:
+            self._socket = socket.socket(
+                socket.AF_NETLINK,
+                socket.SOCK_DGRAM | socket.SOCK_NONBLOCK | socket.SOCK_CLOEXEC,
+                NETLINK_KOBJECT_UEVENT,
+            )
+            # port 0 lets the kernel pick one
+            self._socket.bind((0, _KERNEL_EVENTS))
+        except OSError as error:
+            logger.error("Failed to listen for hotplug events: %s", error)
+            self._socket = None
+            return False
+
+        self._watch = GLib.io_add_watch(
+            self._socket.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, self._on_readable
+        )
+        logger.debug("Listening for hotplug events")
+        return True
+
+    def stop(self):
+        if self._watch is not None:
+            GLib.source_remove(self._watch)
+            self._watch = None
+
+        if self._timeout is not None:
+            GLib.source_remove(self._timeout)
+            self._timeout = None
+
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _on_readable(self, *_):
+        while True:
+            try:
+                data = self._socket.recv(16384)
+            except BlockingIOError:
+                break
+            except OSError as error:
+                # ENOBUFS if too many events came in at once, the burst will
+                # still be handled with the ones that made it
+                logger.error("Failed to read hotplug events: %s", error)
+                break
+
+            properties = parse_uevent(data)
+            if (
+                properties.get("ACTION") != "add"
+                or properties.get("SUBSYSTEM") != "input"
+                or not properties.get("DEVNAME", "").startswith("input/event")
+                or is_own_device(properties)
+            ):
+                continue
+
+            self._added(f'/dev/{properties["DEVNAME"]}')
+
+        return True
+
+    def _added(self, path: str):
+        now = time.monotonic()
+        logger.debug('"%s" was plugged in', path)
+
+        if not self._pending:
+            self._first_at = now
+
+        self._last_at = now
+        self._pending.append(path)
+
+        if self._timeout is None:
+            self._timeout = GLib.timeout_add(QUIET_MS, self._burst_over)
+
+    def _burst_over(self):
+        now = time.monotonic()
+        quiet_for = (now - self._last_at) * 1000
+        waited = (now - self._first_at) * 1000
+        if quiet_for < QUIET_MS and waited < MAX_WAIT_MS:
+            remaining = min(QUIET_MS - quiet_for, MAX_WAIT_MS - waited)
+            self._timeout = GLib.timeout_add(max(1, int(remaining)), self._burst_over)
+            return False
+
+        self._timeout = None
+        paths = self._pending
+        self._pending = []
+        logger.debug("Handling %d plugged in devices after %d ms", len(paths), waited)
+        self._on_added(paths, self._first_at)
+        return False
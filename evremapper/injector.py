@@ -2,25 +2,47 @@
 
 import time
 import multiprocessing
+import multiprocessing.forkserver
+import multiprocessing.resource_tracker
 import evdev
 import asyncio
-import sys
 
-from typing import Dict, List
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
 
-from evremapper.devices import _DeviceGroup
-from evremapper.logger import logger
+from evremapper.devices import _DeviceGroup, DeviceDescriptor
+from evremapper.logger import logger, get_log_setup, restore_log_setup
 from evremapper.configs.config import InputEvent
-from evremapper.input_control import InputControl
+from evremapper.input_control import InputControl, RawInputControl
 from evremapper.configs.context import RuntimeContext
+from evremapper.metrics import InjectionCounters, InjectionStats
+from evremapper.realtime import apply_profile
+from evremapper.recording import Recorder, TraceFile
+
+if TYPE_CHECKING:
+    # it imports this module
+    from evremapper.uinput_pool import PooledUInput
 
 CapabilitiesDict = Dict[int, List[int]]
+InjectorOptions = Dict[str, object]
 DeviceSources = List[evdev.InputDevice]
 
 EV_DEVICE_PREFIX = "ev-remapper"
 
 # Messages
 CLOSE = 0
+RELOAD = 1
+# from the injection, reports how grabbing a device went
+GRAB = 2
+# from the injection, reports which realtime settings were applied
+REALTIME = 3
+# to the injection, starts recording into a TraceFile or stops with None
+RECORD = 4
+
+# grabbing busy devices is retried with a delay that doubles each time, up
+# to a maximum, until the "grab_timeout" option in seconds is over
+GRAB_TIMEOUT = 2.0
+FIRST_GRAB_DELAY = 0.01
+MAX_GRAB_DELAY = 0.25
 
 # States
 UNKNOWN = -1
@@ -31,6 +53,28 @@ STOPPED = 5
 NO_DEVICES = 6
 
 
+# What the zygote imports before it forks injectors, nothing of the daemon
+# like GLib or pydbus. Every injector runs the main module again, which is
+# ev-remapper-service and only imports the logger, but running it needs
+# pkgutil. Import that and the rest of what each one needs only once.
+_ZYGOTE_PRELOAD = ["pkgutil", "multiprocessing.popen_forkserver", "evremapper.injector"]
+
+
+def start_zygote():
+    """
+    Start the process that Injectors are forked from, unless it is running
+
+    It is a new interpreter that only imported what injecting needs, see
+    the "start_method" option of Injector. Starting it ahead of time saves
+    the first injection from waiting for it.
+    """
+    multiprocessing.forkserver.set_forkserver_preload(_ZYGOTE_PRELOAD)
+    multiprocessing.forkserver.ensure_running()
+    # every injector from the zygote is connected to it, which would
+    # otherwise be started with the first one
+    multiprocessing.resource_tracker.ensure_running()
+
+
 def is_in_capabilities(event: InputEvent, capabilites_dict):
     if event.code in capabilites_dict.get(event.type, []):
         return True
@@ -38,6 +82,37 @@ def is_in_capabilities(event: InputEvent, capabilites_dict):
     return False
 
 
+def grab_reason(context: RuntimeContext, device_capabilities: CapabilitiesDict) -> Optional[InputEvent]:
+    """An event of the device that the mappings change, None if there is none"""
+    for ev_type, code in context.mapped_events():
+        input_event = InputEvent(0, 0, ev_type, code, 1)
+        if is_in_capabilities(input_event, device_capabilities):
+            return input_event
+
+    return None
+
+
+def copy_capabilities(capabilities: CapabilitiesDict) -> CapabilitiesDict:
+    """Get the capabilities, with absinfo, that a uinput copying a device needs"""
+    ecodes = evdev.ecodes
+
+    capabilities = {ev_type: list(codes) for ev_type, codes in capabilities.items()}
+
+    # just like what python-evdev does in from_device
+    if ecodes.EV_SYN in capabilities:
+        del capabilities[ecodes.EV_SYN]
+    if ecodes.EV_FF in capabilities:
+        del capabilities[ecodes.EV_FF]
+
+    if ecodes.ABS_VOLUME in capabilities.get(ecodes.EV_ABS, []):
+        # For some reason an ABS_VOLUME capability likes to appear
+        # for some users. It prevents mice from moving around and
+        # keyboards from writing symbols
+        capabilities[ecodes.EV_ABS].remove(ecodes.ABS_VOLUME)
+
+    return capabilities
+
+
 def udev_name(device_name: str):
     max_len = 80  # any longer than 80 chars gives an error
     remaining = max_len - len(EV_DEVICE_PREFIX) - 2  # 1 for the space char
@@ -46,35 +121,452 @@ def udev_name(device_name: str):
     return name
 
 
+class Injection:
+    """
+    Grabs the devices of a group and forwards their events to new uinputs
+
+    Doesn't care about the process it runs in, the Injector runs one of them
+    in its own process, the InjectionEngine runs many of them on one loop.
+
+    options are the settings from GlobalConfig.get_injector_options, "reader"
+    selects between the "evdev" (default) and the "raw" InputControl. In
+    stats, the tracer, if any, records the latency of all devices of the
+    group, overflows counts the events that the kernel dropped for them and
+    counters what was read, forwarded and grabbed.
+    """
+
+    def __init__(self,
+                 group: _DeviceGroup,
+                 context: RuntimeContext,
+                 options: Optional[InjectorOptions] = None,
+                 stats: Optional[InjectionStats] = None,
+                 uinputs: Optional[Dict[str, "PooledUInput"]] = None) -> None:
+        self.group = group
+        self.context = context
+        self.options = options or {}
+        stats = stats or InjectionStats()
+        self.tracer = stats.tracer
+        self.motion = stats.motion
+        self.overflows = stats.overflows
+        self.counters = stats.counters
+
+        # device path -> uinput from the UInputPool of the daemon, devices
+        # that are missing get a uinput of their own
+        self._uinputs = dict(uinputs or {})
+
+        self._sources: DeviceSources = []
+        self._outputs: List[evdev.UInput] = []
+        self._input_controls: List[InputControl] = []
+        self._tasks: List[asyncio.Task] = []
+        # capabilities of the devices that the mappings didn't need
+        self._unused: Dict[str, CapabilitiesDict] = {}
+        self._grabbing: List[asyncio.Task] = []
+        self._grab_reporter: Callable[[str, float, bool], None] = None
+        self._stopped: asyncio.Future = None
+        self._recorder: Optional[Recorder] = None
+
+    def _input_control_class(self):
+        reader = self.options.get("reader", "evdev")
+        if reader == "raw":
+            return RawInputControl
+
+        if reader != "evdev":
+            logger.error('unknown reader "%s", using "evdev"', reader)
+
+        return InputControl
+
+    def _open_device(self, device_path) -> Optional[evdev.InputDevice]:
+        """Open a device of the group if the mappings need it"""
+        try:
+            dev = evdev.InputDevice(device_path)
+        except (IOError, OSError):
+            logger.error('could not find device at "%s"', device_path)
+            return None
+
+        # what discovery found out, unless the node was replaced since then
+        descriptor = self.group.get_descriptor(device_path)
+        if descriptor is not None:
+            device_capabilities = descriptor.codes
+        else:
+            device_capabilities = dev.capabilities(absinfo=False)
+
+        if not self._needs_grab(device_path, device_capabilities):
+            logger.debug("no need to grab device at '%s'", device_path)
+            self._unused[device_path] = device_capabilities
+            dev.close()
+            return None
+
+        self._unused.pop(device_path, None)
+        return dev
+
+    async def _grab_device(self, device_path) -> Optional[evdev.InputDevice]:
+        dev = self._open_device(device_path)
+        if dev is None:
+            return None
+
+        start = time.monotonic()
+        deadline = start + float(self.options.get("grab_timeout", GRAB_TIMEOUT))
+        delay = FIRST_GRAB_DELAY
+        attempts = 0
+        while True:
+            try:
+                dev.grab()
+                logger.debug("Grab %s", device_path)
+                break
+            except IOError as error:
+                attempts += 1
+                if self.counters is not None:
+                    self.counters.values[InjectionCounters.REGRABS] += 1
+
+                # it might take a little time until the device is free if
+                # it was previously grabbed.
+                logger.debug("Failed attempts to grab %s: %d", device_path, attempts)
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.error("Cannot grab %s, it is possibly in use", device_path)
+                    logger.error(str(error))
+                    dev.close()
+                    self._report_grab(device_path, time.monotonic() - start, False)
+                    return None
+
+            try:
+                await asyncio.sleep(min(delay, remaining))
+            except asyncio.CancelledError:
+                dev.close()
+                raise
+
+            delay = min(delay * 2, MAX_GRAB_DELAY)
+
+        if self.counters is not None:
+            self.counters.values[InjectionCounters.GRABS] += 1
+
+        self._report_grab(device_path, time.monotonic() - start, True)
+        return dev
+
+    def _report_grab(self, device_path, seconds: float, grabbed: bool):
+        logger.debug(
+            '%s "%s" after %d ms',
+            "Grabbed" if grabbed else "Gave up grabbing",
+            device_path,
+            seconds * 1000,
+        )
+        if self._grab_reporter is not None:
+            self._grab_reporter(device_path, seconds * 1000, grabbed)
+
+    def _needs_grab(self, device_path, device_capabilities: CapabilitiesDict) -> bool:
+        input_event = grab_reason(self.context, device_capabilities)
+        if input_event is None:
+            return False
+
+        logger.info('grabbing device at "%s" because of event "%s"', device_path, input_event)
+        return True
+
+    def _copy_capabilities(self,
+                           input_device: evdev.InputDevice,
+                           descriptor: Optional[DeviceDescriptor] = None) -> CapabilitiesDict:
+        """Copy capabilities for a new device."""
+        if descriptor is not None:
+            return copy_capabilities(descriptor.capabilities)
+
+        return copy_capabilities(input_device.capabilities(absinfo=True))
+
+    def _start_forwarding(self, source: evdev.InputDevice) -> bool:
+        """Create the uinput for a grabbed device and start forwarding to it"""
+        pooled = self._uinputs.pop(source.path, None)
+        if pooled is not None:
+            if pooled.reused:
+                # the previous injection may have stopped in the middle of a
+                # key press
+                pooled.release_keys()
+
+            logger.debug("forwarding to pooled uinput %s", pooled.name)
+            self._outputs.append(pooled)
+            return self._forward(source, pooled)
+
+        descriptor = self.group.get_descriptor(source.path)
+        try:
+            # Copy as much info as possible
+            forward_to = evdev.UInput(
+                name=udev_name(source.name),
+                events=self._copy_capabilities(source, descriptor),
+                vendor=source.info.vendor,
+                product=source.info.product,
+                version=source.info.version,
+                bustype=source.info.bustype,
+                input_props=(
+                    descriptor.input_props if descriptor is not None else source.input_props()
+                ),
+            )
+
+            logger.debug("forwarding to uinput %s", forward_to.name)
+        except TypeError as e:
+            if "input_props" in str(e):
+                # UInput constructor doesn't support input_props and
+                # source.input_props doesn't exist with old python-evdev versions.
+                logger.error("Please upgrade your python-evdev version. Exiting")
+                return False
+
+            raise e
+
+        self._outputs.append(forward_to)
+        return self._forward(source, forward_to)
+
+    def _forward(self, source: evdev.InputDevice, forward_to) -> bool:
+        input_control = self._input_control_class()(
+            source,
+            forward_to,
+            self.context,
+            self.tracer,
+            self.motion,
+            self.overflows,
+            self.counters,
+        )
+        input_control.record(self._recorder)
+        self._input_controls.append(input_control)
+
+        task = asyncio.get_running_loop().create_task(input_control.run())
+        task.add_done_callback(self._forwarding_stopped)
+        self._tasks.append(task)
+        return True
+
+    def _forwarding_stopped(self, task: asyncio.Task):
+        if task.cancelled() or self._stopped.done():
+            return
+
+        if task.exception() is not None:
+            self._stopped.set_exception(task.exception())
+        else:
+            self._stopped.set_result(None)
+
+    def _grabbing_done(self, task: asyncio.Task):
+        """Stop the injection if forwarding a late device crashed"""
+        if task.cancelled() or task.exception() is None or self._stopped.done():
+            return
+
+        self._stopped.set_exception(task.exception())
+
+    async def _grab_and_forward(self, device_path) -> bool:
+        """Grab a device and forward its events, False if that didn't work out"""
+        source = await self._grab_device(device_path)
+        if source is None:
+            return False
+
+        if self._stopped.done():
+            # stopped while grabbing
+            source.ungrab()
+            source.close()
+            return False
+
+        self._sources.append(source)
+        return self._start_forwarding(source)
+
+    def reload(self, context: RuntimeContext):
+        """
+        Switch to other mappings without ungrabbing or recreating uinputs
+
+        Every InputControl switches between two frames. Devices that only
+        the new mappings need are grabbed in addition, devices that they
+        don't need anymore stay grabbed and forward their events unchanged.
+        """
+        start = time.perf_counter_ns()
+        self.context = context
+
+        for input_control in self._input_controls:
+            input_control.reload(context)
+
+        newly_needed = [
+            path for path, capabilities in self._unused.items()
+            if self._needs_grab(path, capabilities)
+        ]
+        if self._stopped is not None:
+            loop = asyncio.get_running_loop()
+            for path in newly_needed:
+                task = loop.create_task(self._grab_and_forward(path))
+                task.add_done_callback(self._grabbing_done)
+                self._grabbing.append(task)
+
+        logger.info(
+            'Swapped the mappings of "%s" in %d us',
+            self.group.key,
+            (time.perf_counter_ns() - start) // 1000,
+        )
+
+    def record(self, trace: Optional[TraceFile]):
+        """
+        Record the events of all devices into a trace that init_trace made
+
+        Takes over the fd of the trace. Devices that are forwarded later are
+        recorded as well. None stops recording, so does the end of the
+        injection.
+        """
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+
+        if trace is not None:
+            try:
+                # the same clock as the timestamps of the devices
+                monotonic = self.tracer is not None or self.motion is not None
+                self._recorder = Recorder(trace.fd, monotonic)
+                logger.info('Recording the events of "%s"', self.group.key)
+            except (OSError, ValueError) as error:
+                logger.error('Failed to record the events of "%s": %s', self.group.key, error)
+
+        for input_control in self._input_controls:
+            input_control.record(self._recorder)
+
+    async def run(self,
+                  report_state: Callable[[int], None],
+                  report_grab: Callable[[str, float, bool], None] = None,
+                  report_realtime: Callable[[Dict[str, bool]], None] = None):
+        """
+        Inject until cancelled or until reading from a device fails
+
+        report_state is called with RUNNING once the first device is
+        forwarded, or with NO_DEVICES or FAILED if it never gets that far.
+        All devices are grabbed at the same time, busy ones are retried
+        while the others are already forwarded. report_grab, if given, is
+        called with the path, the milliseconds it took and whether it
+        worked out once grabbing a device is done.
+
+        The "realtime" option is applied to the process once forwarding
+        started, report_realtime gets which of its settings worked out, see
+        apply_profile. The InjectionEngine leaves it out and applies its own
+        profile instead, once for all groups.
+        """
+        loop = asyncio.get_running_loop()
+        self._grab_reporter = report_grab
+        self._stopped = loop.create_future()
+        self._grabbing = [
+            loop.create_task(self._grab_and_forward(path)) for path in self.group.paths
+        ]
+
+        try:
+            pending = set(self._grabbing)
+            forwarding = False
+            while pending and not forwarding:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                forwarding = any(task.result() for task in done)
+
+            if not forwarding:
+                if self._sources:
+                    # grabbed, but creating the uinput failed
+                    report_state(FAILED)
+                else:
+                    logger.error("Did not grab any devices")
+                    report_state(NO_DEVICES)
+
+                return
+
+            report_state(RUNNING)
+
+            applied = apply_profile(self.options.get("realtime"))
+            if applied and report_realtime is not None:
+                report_realtime(applied)
+
+            # devices that are still busy are forwarded once they are grabbed
+            for task in pending:
+                task.add_done_callback(self._grabbing_done)
+
+            await self._stopped
+        finally:
+            tasks = self._grabbing + self._tasks
+            for task in tasks:
+                task.cancel()
+
+            if tasks:
+                # let them flush what they have before the uinputs are closed,
+                # and close what they opened
+                await asyncio.wait(tasks)
+
+            self.record(None)
+
+            logger.info('Ungrabbing all input devices for device group "%s"', self.group.key)
+            for source in self._sources:
+                # ungrab at the end to make the next injection process not fail its grabs
+                try:
+                    source.ungrab()
+                except (OSError, IOError) as error:
+                    # ungrabbing an ungrabbed device can cause an IOError
+                    logger.debug("OSError for ungrab on %s: %s", source.path, str(error))
+
+                source.close()
+
+            # pooled ones only close their duplicate of the fd, the device
+            # stays for the next injection
+            for forward_to in self._outputs + list(self._uinputs.values()):
+                forward_to.close()
+
+
 class Injector(multiprocessing.Process):
+    """
+    Runs an Injection in its own process
+
+    The "start_method" option decides where that process comes from.
+    "forkserver" (the default) forks it from the zygote, see start_zygote,
+    so it doesn't inherit the memory of the daemon and is quick to start.
+    "fork" forks the daemon itself.
+
+    uinputs from the UInputPool of the daemon are used instead of creating
+    new ones, see Injection.
+    """
+
     def __init__(self,
                  group: _DeviceGroup,
-                 context: RuntimeContext) -> None:
+                 context: RuntimeContext,
+                 options: Optional[InjectorOptions] = None,
+                 uinputs: Optional[Dict[str, "PooledUInput"]] = None) -> None:
         # TODO: create a state field that will tell us the status of the process
         self._state = UNKNOWN
 
         self.group = group
         self.context = context
+        self.options = options or {}
+        # shared with the injector process
+        self.stats = InjectionStats.from_options(options)
+        # path -> (grabbed, milliseconds that grabbing took)
+        self.grabs: Dict[str, Tuple[bool, float]] = {}
+        # realtime setting -> if it was applied
+        self.realtime: Dict[str, bool] = {}
+        # their fds are duplicated for the injector process
+        self._uinputs = uinputs
 
         self._msg_pipe = multiprocessing.Pipe()
 
-        super().__init__(name=group)
+        # a string, it is sent to the zygote
+        super().__init__(name=group.key)
+
+        start_method = self.options.get("start_method", "forkserver")
+        if start_method not in ["forkserver", "fork"]:
+            logger.error('unknown start_method "%s", using "forkserver"', start_method)
+            start_method = "forkserver"
+
+        # also tells the new process which start method it was created with
+        self._start_method = start_method
+        self._log_setup = get_log_setup()
+
+    def _Popen(self, process_obj):
+        if self._start_method == "forkserver":
+            start_zygote()
+
+        context = multiprocessing.get_context(self._start_method)
+        return context.Process._Popen(process_obj)
 
     def get_state(self):
         alive = self.is_alive()  # reports whether the process is alive
 
-        if self._state == UNKNOWN and not alive:
+        if self._state == UNKNOWN and not alive and self.exitcode is None:
             # `self.start()` has not been called yet
             return self._state
 
-        if self._state == UNKNOWN and alive:
-            # We are alive but state is not known means starting up
+        if self._state == UNKNOWN:
+            # We are alive but state is not known means starting up. Or the
+            # process is already done, then its state is in the pipe.
             self._state = STARTING
 
-        if self._state == STARTING and self._msg_pipe[1].poll():
-            # if msg pipe will hold the true status
-            msg = self._msg_pipe[1].recv()
-            self._state = msg
+        # if msg pipe will hold the true status
+        self._receive()
 
         if self._state in [STARTING, RUNNING] and not alive:
             # we thought it is running, but the process is not alive. Crash condition
@@ -83,164 +575,99 @@ class Injector(multiprocessing.Process):
 
         return self._state
 
-    def stop_injecting(self):
-        logger.info('Stopping injector for group "%s"', self.group.key)
-        self._msg_pipe[1].send(CLOSE)
-        self._state = STOPPED
+    def _receive(self):
+        """Apply everything that the injector process reported"""
+        while self._msg_pipe[1].poll():
+            msg = self._msg_pipe[1].recv()
+            if isinstance(msg, tuple) and msg[0] == GRAB:
+                _, path, milliseconds, grabbed = msg
+                self.grabs[path] = (grabbed, milliseconds)
+            elif isinstance(msg, tuple) and msg[0] == REALTIME:
+                self.realtime = msg[1]
+            elif self._state == STARTING:
+                self._state = msg
 
-    def _grab_devices(self) -> DeviceSources:
-        sources = []
-        for path in self.group.paths:
-            input_source = self._grab_device(path)
-            if input_source is not None:
-                sources.append(input_source)
+    def _report_grab(self, path: str, milliseconds: float, grabbed: bool):
+        self._msg_pipe[0].send((GRAB, path, milliseconds, grabbed))
 
-        return sources
+    def _report_realtime(self, applied: Dict[str, bool]):
+        self._msg_pipe[0].send((REALTIME, applied))
 
-    def _grab_device(self, device_path) -> evdev.InputDevice:
-        try:
-            dev = evdev.InputDevice(device_path)
-        except (IOError, OSError):
-            logger.error('could not find device at "%s"', device_path)
-            return None
+    def state_fds(self) -> List[int]:
+        """
+        fds that become readable when the state may have changed
 
-        device_capabilities = dev.capabilities(absinfo=False)
+        The end of the pipe that the process reports to, and its sentinel,
+        which is readable once the process is gone. Only after start.
+        """
+        return [self._msg_pipe[1].fileno(), self.sentinel]
 
-        grab = False
-        for key in self.context.key_to_code:
-            input_event = InputEvent(0, 0, 1, key, 1)
-            if is_in_capabilities(input_event, device_capabilities):
-                grab = True
-                logger.info('grabbing device at "%s" because of event "%s"', device_path, key)
+    def stop_injecting(self):
+        logger.info('Stopping injector for group "%s"', self.group.key)
+        self._msg_pipe[1].send(CLOSE)
+        self._state = STOPPED
 
-        if not grab:
-            logger.debug("no need to grab device at '%s'", device_path)
-            return None
+    def reload(self, context: RuntimeContext):
+        """Make the running injector use other mappings, see Injection.reload"""
+        logger.info('Reloading the mappings of group "%s"', self.group.key)
+        self.context = context
+        self._msg_pipe[1].send((RELOAD, context))
 
-        attempts = 0
-        while True:
-            try:
-                dev.grab()
-                logger.debug("Grab %s", device_path)
-                break
-            except IOError as error:
-                attempts += 1
+    def start_recording(self, fd: int):
+        """
+        Make the running injector record into a new trace, see Injection.record
 
-                # it might take a little time until the device is free if
-                # it was previously grabbed.
-                logger.debug("Failed attempts to grab %s: %d", device_path, attempts)
+        The injector gets a duplicate of the fd, the caller still closes it.
+        """
+        self._msg_pipe[1].send((RECORD, TraceFile(fd)))
 
-                if attempts >= 10:
-                    logger.error("Cannot grab %s, it is possibly in use", device_path)
-                    logger.error(str(error))
-                    return None
+    def stop_recording(self):
+        self._msg_pipe[1].send((RECORD, None))
 
-            time.sleep(0.2)
+    def release(self):
+        """Free the shared memory of this injector once it is not needed anymore"""
+        self.stats.release()
 
-        return dev
-
-    async def _msg_listener(self):
+    async def _msg_listener(self, injection: Injection, task: asyncio.Task):
         """Wait for messages from main process and process them"""
         loop = asyncio.get_event_loop()
         while True:
             read_ready = asyncio.Event()
             loop.add_reader(self._msg_pipe[0].fileno(), read_ready.set)
             await read_ready.wait()
-            read_ready.clear()
+            loop.remove_reader(self._msg_pipe[0].fileno())
 
             msg = self._msg_pipe[0].recv()
             if msg == CLOSE:
                 logger.debug('received close signal at injector "%s"', self.group.key)
-                loop.stop()
+                task.cancel()
                 return
 
-    def _copy_capabilities(self, input_device: evdev.InputDevice) -> CapabilitiesDict:
-        """Copy capabilities for a new device."""
-        ecodes = evdev.ecodes
-
-        capabilities = input_device.capabilities(absinfo=True)
-
-        # just like what python-evdev does in from_device
-        if ecodes.EV_SYN in capabilities:
-            del capabilities[ecodes.EV_SYN]
-        if ecodes.EV_FF in capabilities:
-            del capabilities[ecodes.EV_FF]
-
-        if ecodes.ABS_VOLUME in capabilities.get(ecodes.EV_ABS, []):
-            # For some reason an ABS_VOLUME capability likes to appear
-            # for some users. It prevents mice from moving around and
-            # keyboards from writing symbols
-            capabilities[ecodes.EV_ABS].remove(ecodes.ABS_VOLUME)
-
-        return capabilities
+            if isinstance(msg, tuple) and msg[0] == RELOAD:
+                injection.reload(msg[1])
+            elif isinstance(msg, tuple) and msg[0] == RECORD:
+                injection.record(msg[1])
 
     def run(self):
+        restore_log_setup(self._log_setup)
         logger.info('Starting injecting the for device "%s"', self.group.key)
 
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
 
-        sources = self._grab_devices()
-
-        if len(sources) == 0:
-            logger.error("Did not grab any devices")
-            self._msg_pipe[0].send(NO_DEVICES)
-            return
-
-        logger.debug('sources "%s"', sources)
-
-        # Eventually will hold all couroutines to read and write input for each input device in group
-        couroutines = []
-
-        for source in sources:
-            try:
-                # Copy as much info as possible
-                forward_to = evdev.UInput(
-                    name=udev_name(source.name),
-                    events=self._copy_capabilities(source),
-                    vendor=source.info.vendor,
-                    product=source.info.product,
-                    version=source.info.version,
-                    bustype=source.info.bustype,
-                    input_props=source.input_props(),
-                )
-
-                logger.debug("forwarding to uinput %s", forward_to.name)
-            # TODO: Create a KeycodeMapper with async run methods to read events from source
-            # pass them on to forward_to and append it to coroutines to be run in event loop
-
-            except TypeError as e:
-                if "input_props" in str(e):
-                    # UInput constructor doesn't support input_props and
-                    # source.input_props doesn't exist with old python-evdev versions.
-                    logger.error("Please upgrade your python-evdev version. Exiting")
-                    # TODO: send sth on msg pipe?
-                    sys.exit(12)
-
-                raise e
-
-            input_control = InputControl(source, forward_to, self.context)
-            couroutines.append(input_control.run())
-
-        couroutines.append(self._msg_listener())
-
-        self._msg_pipe[0].send(RUNNING)
+        injection = Injection(self.group, self.context, self.options, self.stats, self._uinputs)
+        task = loop.create_task(
+            injection.run(self._msg_pipe[0].send, self._report_grab, self._report_realtime)
+        )
+        listener = loop.create_task(self._msg_listener(injection, task))
 
         # try-except block for cleanly catching asyncio cancellation
         try:
-            loop.run_until_complete(asyncio.gather(*couroutines))
-        except RuntimeError as error:
-            # loop stops via `CLOSE` msg which causes this error msg.
-            if str(error) != "Event loop stopped before Future completed.":
-                raise error
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            # injection stops via `CLOSE` msg
+            pass
         except OSError as e:
             logger.error("Failed to run injector coroutines: %s", str(e))
 
-        logger.info('Ungrabbing all input devices for device group "%s"', self.group.key)
-        for source in sources:
-            # ungrab at the end to make the next injection process not fail its grabs
-            try:
-                source.ungrab()
-            except (OSError, IOError) as error:
-                # ungrabbing an ungrabbed device can cause an IOError
-                logger.debug("OSError for ungrab on %s: %s", source.path, str(error))
+        listener.cancel()
@@ -1,19 +1,355 @@
 #!/usr/bin/env python3
 
 from evremapper.logger import logger
-from evremapper.configs.context import RuntimeContext
+from evremapper.configs.context import Chord, RuntimeContext
+from evremapper.latency import LatencyTracer
+from evremapper.metrics import InjectionCounters, MotionCoalescing, Overflows, REMAPPED_OFFSETS
+from evremapper.recording import Recorder
+from evremapper.frame_writer import (
+    FrameWriter,
+    write_all,
+    EVENT_STRUCT,
+    EVENT_SIZE,
+    TYPE_INDEX,
+    CODE_INDEX,
+    VALUE_INDEX,
+)
+
+import asyncio
+import os
+import struct
+import time
+
+from typing import Dict, List, Optional, Set, Tuple
 
 import evdev
 
+# how many events RawInputControl reads at most with one read call
+READ_EVENTS = 64
+
+# type and code of a SYN_DROPPED read as one unsigned int, see _find_dropped
+(_SYN_DROPPED,) = struct.unpack(
+    "I", struct.pack("HH", evdev.ecodes.EV_SYN, evdev.ecodes.SYN_DROPPED)
+)
+
+
+# events that are written instead of an event of the source
+Events = List[Tuple[int, int, int]]
+
 
 class InputControl:
-    def __init__(self, source: evdev.InputDevice, forward_to: evdev.UInput, context: RuntimeContext):
+    """
+    Forwards the events of a source to a uinput according to the mappings
+
+    Keeps track of the keys that are held on the source in an int that has
+    bit n set while key n is down, seeded from the kernel once forwarding
+    starts. A key press that ends a chord of the mappings while the other
+    keys of it are held presses the target of the chord instead, the other
+    keys are released on the uinput until the chord is over.
+
+    If the kernel drops events because they weren't read in time, the rest
+    of that frame is discarded and the keys and axes of the uinput catch up
+    with the state of the source, see _resync.
+
+    counters, if any, count the events that were read, forwarded and
+    remapped, and failed writes. See record for copying the events into a
+    trace.
+    """
+
+    def __init__(self,
+                 source: evdev.InputDevice,
+                 forward_to: evdev.UInput,
+                 context: RuntimeContext,
+                 tracer: LatencyTracer = None,
+                 motion: MotionCoalescing = None,
+                 overflows: Overflows = None,
+                 counters: InjectionCounters = None):
         self._source: evdev.InputDevice = source
         self._forward_to: evdev.UInput = forward_to
         self._context = context
+        self._code_tables = context.code_tables
+        self._chord_table = context.chord_table
+        self._counters = counters
+        self._writer = FrameWriter(forward_to.fd, counters=counters)
+
+        # bit n is set while key n is held on the source
+        self._held = 0
+        # code of the key that triggered a chord -> that chord
+        self._active_chords: Dict[int, Chord] = {}
+
+        self._tracer = tracer
+        self._in_frame = False
+        self._motion = motion
+
+        self._overflows = overflows
+        # true from a SYN_DROPPED until the end of its frame
+        self._dropping = False
+        # absolute axes of the source, once they are needed
+        self._abs_codes: Optional[List[int]] = None
+
+        # mappings that reload got in the middle of a frame, for the next one
+        self._next_context: Optional[RuntimeContext] = None
+        # held keys that reload already released on the uinput, their
+        # release on the source is not forwarded
+        self._released_early: Set[int] = set()
+
+        self._recorder: Optional[Recorder] = None
+
+        # if switching the clock queued a SYN_DROPPED, which is no overflow
+        self._clock_dropped = False
+        if tracer is not None or motion is not None:
+            # to compare the timestamps with time.monotonic_ns
+            self._clock_dropped = LatencyTracer.use_monotonic_clock(source.fd)
 
     def forward(self, key):
-        self._forward_to.write(*key)
+        self._writer.write(*key)
+
+    def record(self, recorder: Optional[Recorder]):
+        """Copy the events that are read and written into a trace, None to stop"""
+        self._recorder = recorder
+        self._writer.recorder = recorder
+
+    def reload(self, context: RuntimeContext):
+        """
+        Use other mappings, starting with the next frame
+
+        Keys that are held right now and that the new mappings map to
+        something else are released on the uinput, otherwise they would be
+        stuck because their release is mapped to another code. Their release
+        on the source is swallowed later. In the middle of a frame, the
+        switch happens once run sees its SYN_REPORT.
+        """
+        if self._frame_open():
+            # in the middle of a frame, run switches once it is over
+            self._next_context = context
+            return
+
+        self._switch(context)
+
+    def _frame_open(self) -> bool:
+        """If part of a frame was written to the uinput, but not its SYN_REPORT yet"""
+        return self._writer.pending > 0
+
+    def _switch(self, context: RuntimeContext):
+        self._next_context = None
+        start = time.perf_counter_ns()
+        self._end_chords()
+        self._release_remapped_keys(context)
+        self._context = context
+        self._code_tables = context.code_tables
+        self._chord_table = context.chord_table
+        self._context_changed()
+
+        logger.debug(
+            'Switched the mappings of "%s" in %d us',
+            self._source.path,
+            (time.perf_counter_ns() - start) // 1000,
+        )
+
+    def _context_changed(self):
+        """Called after the context has been replaced"""
+
+    def _release_remapped_keys(self, context: RuntimeContext):
+        old_table = self._code_tables[evdev.ecodes.EV_KEY]
+        new_table = context.code_tables[evdev.ecodes.EV_KEY]
+        if old_table is None and new_table is None:
+            return
+
+        try:
+            held = self._source.active_keys()
+        except OSError as error:
+            logger.error('Failed to read the held keys of "%s": %s', self._source.path, error)
+            return
+
+        released = False
+        for code in held:
+            old = code if old_table is None else old_table[code]
+            new = code if new_table is None else new_table[code]
+            if old != new and code not in self._released_early:
+                self._writer.write(evdev.ecodes.EV_KEY, old, 0)
+                self._released_early.add(code)
+                released = True
+
+        if released:
+            self._writer.write(evdev.ecodes.EV_SYN, evdev.ecodes.SYN_REPORT, 0)
+
+    def _release_early(self, code: int, value: int) -> bool:
+        """Track the release of a key that reload released already, True if it was one"""
+        if value or code not in self._released_early:
+            return False
+
+        self._released_early.discard(code)
+        self._held &= ~(1 << code)
+        return True
+
+    def _seed_held_keys(self):
+        """Start from the keys that the kernel knows to be held"""
+        self._held = 0
+        try:
+            for code in self._source.active_keys():
+                self._held |= 1 << code
+        except OSError as error:
+            logger.error('Failed to read the held keys of "%s": %s', self._source.path, error)
+
+    def _key(self, code: int, value: int) -> Optional[Events]:
+        """
+        Track a key event, return the events to write instead if it is part of a chord
+
+        Only ever looks at the chords that end with this key, no matter
+        how many chords there are.
+        """
+        if value:
+            self._held |= 1 << code
+        else:
+            self._held &= ~(1 << code)
+
+        if self._chord_table is None:
+            return None
+
+        return self._chord(code, value)
+
+    def _chord(self, code: int, value: int) -> Optional[Events]:
+        """The part of _key that needs chords, once the key is tracked"""
+        if value:
+            chords = self._chord_table[code]
+            if chords is None:
+                return None
+
+            held = self._held
+            for chord in chords:
+                if held & chord.mask == chord.mask:
+                    self._active_chords[code] = chord
+                    return self._chord_started(chord)
+
+            return None
+
+        if not self._active_chords:
+            return None
+
+        chord = self._active_chords.pop(code, None)
+        if chord is None:
+            return None
+
+        return self._chord_ended(chord)
+
+    def _forwarded_code(self, code: int) -> int:
+        table = self._code_tables[evdev.ecodes.EV_KEY]
+        return code if table is None else table[code]
+
+    def _chord_started(self, chord: Chord) -> Events:
+        # the other keys are already down on the uinput, otherwise the
+        # desktop would see them combined with the target
+        events = [
+            (evdev.ecodes.EV_KEY, self._forwarded_code(code), 0) for code in chord.modifiers
+        ]
+        events.append((evdev.ecodes.EV_KEY, chord.target, 1))
+        return events
+
+    def _chord_ended(self, chord: Chord) -> Events:
+        events = [(evdev.ecodes.EV_KEY, chord.target, 0)]
+        for code in chord.modifiers:
+            if self._held & (1 << code):
+                events.append((evdev.ecodes.EV_KEY, self._forwarded_code(code), 1))
+
+        return events
+
+    def _end_chords(self):
+        """Release the targets of chords in progress, before switching mappings"""
+        if not self._active_chords:
+            return
+
+        for chord in self._active_chords.values():
+            for event in self._chord_ended(chord):
+                self._writer.write(*event)
+
+        self._active_chords = {}
+        self._writer.write(evdev.ecodes.EV_SYN, evdev.ecodes.SYN_REPORT, 0)
+
+    def _dropped(self):
+        """The kernel dropped events, discard everything until the next SYN_REPORT"""
+        self._dropping = True
+        # the frame that _trace saw starting won't be written
+        self._in_frame = False
+        if self._clock_dropped:
+            # the events from before forwarding started, still resynchronized
+            self._clock_dropped = False
+            logger.debug('Switching the clock of "%s" dropped its events', self._source.path)
+            return
+
+        self._count(Overflows.OVERFLOWS, 1)
+        logger.warning('The kernel dropped events of "%s", resynchronizing', self._source.path)
+
+    def _count(self, index: int, amount: int):
+        if self._overflows is not None:
+            self._overflows.values[index] += amount
+
+    def _resync(self):
+        """
+        Catch up with the state of the source after events were dropped
+
+        Keys that changed in the meantime are released or pressed and each
+        absolute axis is set to its current value, all in a single frame.
+        The kernel ignores axes that didn't change. Multitouch slots are
+        left alone, they can't be queried one by one.
+        """
+        self._dropping = False
+        try:
+            held = 0
+            for code in self._source.active_keys():
+                held |= 1 << code
+
+            if self._abs_codes is None:
+                capabilities = self._source.capabilities(absinfo=False)
+                self._abs_codes = [
+                    code
+                    for code in capabilities.get(evdev.ecodes.EV_ABS, [])
+                    if code < evdev.ecodes.ABS_MT_SLOT
+                ]
+
+            axes = [(code, self._source.absinfo(code).value) for code in self._abs_codes]
+        except OSError as error:
+            logger.error('Failed to read the state of "%s": %s', self._source.path, error)
+            return
+
+        write = self._writer.write
+        changed = self._held ^ held
+        # releases first, so nothing is briefly held together with keys that are up
+        for value, bits in ((0, changed & ~held), (1, changed & held)):
+            while bits:
+                lowest = bits & -bits
+                bits ^= lowest
+                code = lowest.bit_length() - 1
+                if value == 0 and code in self._released_early:
+                    self._released_early.discard(code)
+                    self._held &= ~lowest
+                    continue
+
+                events = self._key(code, value)
+                if events is None:
+                    events = [(evdev.ecodes.EV_KEY, self._forwarded_code(code), value)]
+
+                for event in events:
+                    write(*event)
+
+        table = self._code_tables[evdev.ecodes.EV_ABS]
+        for code, value in axes:
+            write(evdev.ecodes.EV_ABS, code if table is None else table[code], value)
+
+        write(evdev.ecodes.EV_SYN, evdev.ecodes.SYN_REPORT, 0)
+
+        keys = bin(changed).count("1")
+        self._count(Overflows.RESYNCED_KEYS, keys)
+        logger.debug('Resynchronized %d keys of "%s"', keys, self._source.path)
+
+    def _trace(self, ev):
+        if ev.type == evdev.ecodes.EV_SYN and ev.code == evdev.ecodes.SYN_REPORT:
+            # the writer just wrote the frame
+            self._tracer.frame_written(ev.sec, ev.usec)
+            self._in_frame = False
+        elif not self._in_frame:
+            self._in_frame = True
+            if self._tracer.wakeup is not None:
+                self._tracer.frame_started(ev.sec, ev.usec)
 
     async def run(self):
         logger.debug(
@@ -22,21 +358,509 @@ class InputControl:
             self._source.fd,
         )
 
-        logger.debug("key_to_code map: %s", self._context.key_to_code)
+        logger.debug("code map: %s", self._context.code_map)
+        self._seed_held_keys()
+        if self._motion is not None:
+            logger.warning('Mouse motion is only coalesced with the "raw" reader')
+
+        write = self._writer.write
+        tracer = self._tracer
+        counted = None if self._counters is None else self._counters.values
+        remapped = None if self._counters is None else self._counters.remapped
+        # added to the shared counter once per frame, which is a lot cheaper
+        read = 0
+
+        try:
+            async for ev in self._source.async_read_loop():
+                read += 1
+                # not a local, recording may start or stop between two events
+                recorder = self._recorder
+                if recorder is not None:
+                    recorder.received(ev.sec, ev.usec, ev.type, ev.code, ev.value)
+
+                if self._dropping:
+                    if ev.type == evdev.ecodes.EV_SYN and ev.code == evdev.ecodes.SYN_REPORT:
+                        self._resync()
+                    else:
+                        self._count(Overflows.DISCARDED, 1)
+
+                    continue
+
+                if ev.type == evdev.ecodes.EV_KEY:
+                    if ev.value == 2:
+                        # button-hold event. Environments (gnome, etc.) create them on
+                        # their own for the injection-fake-device if the release event
+                        # won't appear, no need to forward or map them.
+                        continue
+
+                    if self._released_early and self._release_early(ev.code, ev.value):
+                        continue
+
+                    events = self._key(ev.code, ev.value)
+                    if events is not None:
+                        for event in events:
+                            write(*event)
+
+                        continue
+                elif ev.type == evdev.ecodes.EV_SYN:
+                    if ev.code == evdev.ecodes.SYN_DROPPED:
+                        self._dropped()
+                        continue
+
+                    if counted is not None:
+                        counted[InjectionCounters.EVENTS_READ] += read
+                        read = 0
+
+                    if self._next_context is not None and ev.code == evdev.ecodes.SYN_REPORT:
+                        write(ev.type, ev.code, ev.value)
+                        if tracer is not None:
+                            self._trace(ev)
+
+                        # the frame is written, switch before the next one
+                        self._switch(self._next_context)
+                        continue
+
+                # not a local, reload may replace it between two events
+                table = self._code_tables[ev.type]
+                if table is None:
+                    write(ev.type, ev.code, ev.value)
+                else:
+                    code = table[ev.code]
+                    write(ev.type, code, ev.value)
+                    if remapped is not None and code != ev.code:
+                        remapped[REMAPPED_OFFSETS[ev.type] + ev.code] += 1
+
+                if tracer is not None:
+                    self._trace(ev)
+        finally:
+            # don't hold back the events of an incomplete frame
+            self._writer.flush()
+            if counted is not None:
+                counted[InjectionCounters.EVENTS_READ] += read
+
+        logger.error('The async_read_loop for "%s" stopped early', self._source.path)
+
+
+class RawInputControl(InputControl):
+    """
+    Forwards events without creating InputEvent objects for them
 
-        async for ev in self._source.async_read_loop():
-            if ev.type == evdev.ecodes.EV_KEY and ev.value == 2:
-                # button-hold event. Environments (gnome, etc.) create them on
-                # their own for the injection-fake-device if the release event
-                # won't appear, no need to forward or map them.
+    struct input_event records are read in bulk into a preallocated buffer,
+    remapped in place through memoryview casts of that buffer and written to
+    the uinput with one write per read. Reads that only contain events of
+    types without mappings, like the motion of a mouse, are written out
+    without looking at the individual events at all.
+
+    With motion coalescing, a read whose oldest event already waited longer
+    than the latency budget has its consecutive motion-only frames merged,
+    see _coalesce. Nothing waits for events that were not read yet, so this
+    never adds latency.
+    """
+
+    def __init__(self,
+                 source: evdev.InputDevice,
+                 forward_to: evdev.UInput,
+                 context: RuntimeContext,
+                 tracer: LatencyTracer = None,
+                 motion: MotionCoalescing = None,
+                 overflows: Overflows = None,
+                 counters: InjectionCounters = None):
+        super().__init__(source, forward_to, context, tracer, motion, overflows, counters)
+        self._buffer = bytearray(READ_EVENTS * EVENT_SIZE)
+        self._view = memoryview(self._buffer)
+        self._halves = self._view.cast("H")
+        self._values = self._view.cast("i")
+        # the timestamp of the first event in the buffer is at 0 and 1
+        self._longs = self._view.cast("l")
+        # type and code of each event together
+        self._words = self._view.cast("I")
+
+        self._inspected_types = frozenset()
+        self._context_changed()
+
+        # if the last read ended in the middle of a frame, see reload
+        self._mid_frame = False
+
+        self._stopped: asyncio.Future = None
+
+    def _context_changed(self):
+        # types that need a look at each event: mapped ones, and EV_KEY
+        # because of the button-hold events that are not forwarded
+        self._inspected_types = frozenset(
+            [evdev.ecodes.EV_KEY]
+            + [ev_type for ev_type, table in enumerate(self._code_tables) if table is not None]
+        )
+
+    def _remap(self, size: int) -> int:
+        """
+        Remap the events in the buffer in place, return the size to write
+
+        Chords are written right away, if that fails the forwarding is
+        stopped and nothing is left to write.
+        """
+        halves = self._halves
+        values = self._values
+        code_tables = self._code_tables
+        chord_table = self._chord_table
+        held = self._held
+        remapped = None if self._counters is None else self._counters.remapped
+        half_stride = EVENT_SIZE // 2
+        int_stride = EVENT_SIZE // 4
+
+        out = 0
+        for i in range(size // EVENT_SIZE):
+            ev_type = halves[i * half_stride + TYPE_INDEX]
+            code_index = i * half_stride + CODE_INDEX
+
+            if ev_type == evdev.ecodes.EV_KEY:
+                value = values[i * int_stride + VALUE_INDEX]
+                if value == 2:
+                    # button-hold event, see InputControl.run
+                    continue
+
+                # the same as _key, without a call for every key
+                code = halves[code_index]
+                if self._released_early and not value and code in self._released_early:
+                    self._held = held
+                    self._release_early(code, value)
+                    held = self._held
+                    continue
+
+                if value:
+                    held |= 1 << code
+                else:
+                    held &= ~(1 << code)
+
+                if chord_table is not None:
+                    self._held = held
+                    events = self._chord(code, value)
+                    if events is not None:
+                        # write what came before, then the events of the
+                        # chord instead of this one. It is all in the same frame
+                        chord = b"".join(EVENT_STRUCT.pack(0, 0, *event) for event in events)
+                        try:
+                            write_all(self._forward_to.fd, self._view[:out])
+                            write_all(self._forward_to.fd, memoryview(chord))
+                        except OSError as error:
+                            if self._counters is not None:
+                                self._counters.values[InjectionCounters.WRITE_ERRORS] += 1
+
+                            self._stopped.set_exception(error)
+                            return 0
+
+                        if self._counters is not None:
+                            self._counters.values[InjectionCounters.EVENTS_FORWARDED] += (
+                                out // EVENT_SIZE + len(events)
+                            )
+
+                        if self._recorder is not None:
+                            self._recorder.emitted_events(self._view[:out])
+                            self._recorder.emitted_events(memoryview(chord))
+
+                        out = 0
+                        continue
+
+            table = code_tables[ev_type]
+            if table is not None:
+                code = halves[code_index]
+                target = table[code]
+                halves[code_index] = target
+                if remapped is not None and target != code:
+                    remapped[REMAPPED_OFFSETS[ev_type] + code] += 1
+
+            offset = i * EVENT_SIZE
+            if out != offset:
+                # close the gap left by dropped events
+                self._view[out:out + EVENT_SIZE] = self._view[offset:offset + EVENT_SIZE]
+
+            out += EVENT_SIZE
+
+        self._held = held
+        return out
+
+    def _coalesce(self, size: int) -> int:
+        """
+        Merge consecutive frames that only move, in place, return the size to write
+
+        The deltas of the merged frames are summed up and written with the
+        timestamp of the newest one. A motion frame is only merged with the
+        next one while it is older than the budget. Frames with anything
+        else, like buttons, end a merge and are kept as they are, so nothing
+        is reordered. An incomplete frame at the end is kept as well.
+        """
+        halves = self._halves
+        values = self._values
+        longs = self._longs
+        half_stride = EVENT_SIZE // 2
+        int_stride = EVENT_SIZE // 4
+        long_stride = EVENT_SIZE // 8
+        now = time.monotonic_ns() // 1000
+        budget = self._motion.budget_us
+
+        out = 0
+        # (type, code) -> value of the motion frames that are merged so far
+        merged: Dict[Tuple[int, int], int] = {}
+        merged_time = (0, 0)
+        coalesced = 0
+
+        def flush_merged(out: int) -> int:
+            sec, usec = merged_time
+            for (ev_type, code), value in merged.items():
+                EVENT_STRUCT.pack_into(self._buffer, out, sec, usec, ev_type, code, value)
+                out += EVENT_SIZE
+
+            EVENT_STRUCT.pack_into(
+                self._buffer, out, sec, usec, evdev.ecodes.EV_SYN, evdev.ecodes.SYN_REPORT, 0
+            )
+            merged.clear()
+            return out + EVENT_SIZE
+
+        start = 0
+        for i in range(size // EVENT_SIZE):
+            if (
+                halves[i * half_stride + TYPE_INDEX] != evdev.ecodes.EV_SYN
+                or halves[i * half_stride + CODE_INDEX] != evdev.ecodes.SYN_REPORT
+            ):
                 continue
 
-            if ev.code in self._context.key_to_code:
-                remapped_code = self._context.key_to_code[ev.code]
-                self.forward((ev.type, remapped_code, ev.value))
+            # events start to i are one frame
+            motion_only = True
+            for j in range(start, i):
+                ev_type = halves[j * half_stride + TYPE_INDEX]
+                if ev_type == evdev.ecodes.EV_REL:
+                    continue
+
+                code = halves[j * half_stride + CODE_INDEX]
+                if ev_type == evdev.ecodes.EV_MSC and code == evdev.ecodes.MSC_TIMESTAMP:
+                    continue
+
+                motion_only = False
+                break
+
+            if motion_only:
+                if merged:
+                    coalesced += 1
+
+                for j in range(start, i):
+                    ev_type = halves[j * half_stride + TYPE_INDEX]
+                    key = (ev_type, halves[j * half_stride + CODE_INDEX])
+                    value = values[j * int_stride + VALUE_INDEX]
+                    if ev_type == evdev.ecodes.EV_REL:
+                        merged[key] = merged.get(key, 0) + value
+                    else:
+                        # the newest timestamp of the device
+                        merged[key] = value
+
+                sec = longs[i * long_stride]
+                usec = longs[i * long_stride + 1]
+                merged_time = (sec, usec)
+                if now - sec * 1000000 - usec <= budget:
+                    # fresh enough, forward it without waiting for more
+                    out = flush_merged(out)
             else:
-                self.forward((ev.type, ev.code, ev.value))
-            # if ev.code == evdev.ecodes.KEY_CAPSLOCK:
-            #     self.forward((ev.type, evdev.ecodes.KEY_LEFTCTRL, ev.value))
+                if merged:
+                    out = flush_merged(out)
 
-        logger.error('The async_read_loop for "%s" stopped early', self._source.path)
+                for j in range(start, i + 1):
+                    offset = j * EVENT_SIZE
+                    if out != offset:
+                        self._view[out:out + EVENT_SIZE] = self._view[offset:offset + EVENT_SIZE]
+
+                    out += EVENT_SIZE
+
+            start = i + 1
+
+        if merged:
+            out = flush_merged(out)
+
+        # the incomplete frame at the end
+        for j in range(start, size // EVENT_SIZE):
+            offset = j * EVENT_SIZE
+            if out != offset:
+                self._view[out:out + EVENT_SIZE] = self._view[offset:offset + EVENT_SIZE]
+
+            out += EVENT_SIZE
+
+        self._motion.counters.values[MotionCoalescing.COALESCED] += coalesced
+        return out
+
+    def _skip_dropped(self, size: int) -> int:
+        """
+        Discard the events in the buffer that belong to a frame with dropped events
+
+        Moves what comes after that frame to the start of the buffer and
+        returns its size. Unless a frame is being dropped already, the
+        buffer has to start with the SYN_DROPPED, see _find_dropped.
+        """
+        halves = self._halves
+        half_stride = EVENT_SIZE // 2
+        start = 0
+        if not self._dropping:
+            self._dropped()
+            start = 1
+
+        for i in range(start, size // EVENT_SIZE):
+            if (
+                halves[i * half_stride + TYPE_INDEX] == evdev.ecodes.EV_SYN
+                and halves[i * half_stride + CODE_INDEX] == evdev.ecodes.SYN_REPORT
+            ):
+                self._count(Overflows.DISCARDED, i - start)
+                self._resync()
+                self._frame_done()
+                rest = (i + 1) * EVENT_SIZE
+                self._buffer[:size - rest] = self._buffer[rest:size]
+                return size - rest
+
+        # the frame continues in the next read
+        self._count(Overflows.DISCARDED, size // EVENT_SIZE - start)
+        return 0
+
+    def _read(self):
+        if self._stopped.done():
+            return
+
+        try:
+            size = os.readv(self._source.fd, (self._view,))
+        except BlockingIOError:
+            return
+        except OSError as error:
+            self._stopped.set_exception(error)
+            return
+
+        if size == 0:
+            self._stopped.set_result(None)
+            return
+
+        counted = None if self._counters is None else self._counters.values
+        if counted is not None:
+            counted[InjectionCounters.EVENTS_READ] += size // EVENT_SIZE
+
+        recorder = self._recorder
+        if recorder is not None:
+            # before anything is discarded, coalesced or remapped
+            recorder.received_events(self._view[:size])
+
+        if self._dropping:
+            size = self._skip_dropped(size)
+
+        while size:
+            dropped = self._find_dropped(size)
+            if dropped < 0:
+                self._forward(size)
+                return
+
+            if dropped > 0:
+                # the frames before it are complete, forward them first
+                if not self._forward(dropped):
+                    return
+
+                self._buffer[:size - dropped] = self._buffer[dropped:size]
+                size -= dropped
+
+            size = self._skip_dropped(size)
+
+    def _find_dropped(self, size: int) -> int:
+        """
+        Where the first SYN_DROPPED in the buffer starts, -1 if there is none
+
+        After an overflow the kernel puts it at the start of its queue, but
+        it also queues one behind the events that are there already when
+        the clock of the device is switched or its state is read.
+        """
+        words = self._words[TYPE_INDEX // 2:size // 4:EVENT_SIZE // 4]
+        if _SYN_DROPPED not in words:
+            return -1
+
+        return words.tolist().index(_SYN_DROPPED) * EVENT_SIZE
+
+    def _forward(self, size: int) -> bool:
+        """Write the events at the start of the buffer, False if forwarding stopped"""
+        # before coalescing or remapping changes them
+        last = (size // EVENT_SIZE - 1) * (EVENT_SIZE // 2)
+        ends_frame = (
+            self._halves[last + TYPE_INDEX] == evdev.ecodes.EV_SYN
+            and self._halves[last + CODE_INDEX] == evdev.ecodes.SYN_REPORT
+        )
+
+        counted = None if self._counters is None else self._counters.values
+        recorder = self._recorder
+        tracer = self._tracer
+        if tracer is not None:
+            # the oldest event of what was read decides the latency
+            sec = self._longs[0]
+            usec = self._longs[1]
+            if tracer.wakeup is not None:
+                tracer.frame_started(sec, usec)
+
+        motion = self._motion
+        if motion is not None:
+            delay = motion.read(size // EVENT_SIZE, self._longs[0], self._longs[1])
+            if delay > motion.budget_us:
+                # falling behind
+                size = self._coalesce(size)
+
+        types = self._halves[TYPE_INDEX:size // 2:EVENT_SIZE // 2]
+        if not self._inspected_types.isdisjoint(types):
+            size = self._remap(size)
+            if self._stopped.done():
+                return False
+
+        if size > 0:
+            try:
+                write_all(self._forward_to.fd, self._view[:size])
+            except OSError as error:
+                if counted is not None:
+                    counted[InjectionCounters.WRITE_ERRORS] += 1
+
+                self._stopped.set_exception(error)
+                return False
+
+            if counted is not None:
+                counted[InjectionCounters.EVENTS_FORWARDED] += size // EVENT_SIZE
+
+            if recorder is not None:
+                recorder.emitted_events(self._view[:size])
+
+        if ends_frame:
+            self._frame_done()
+        else:
+            # the frame continues with the next read
+            self._mid_frame = True
+
+        if motion is not None:
+            motion.counters.values[MotionCoalescing.FORWARDED] += size // EVENT_SIZE
+
+        if tracer is not None:
+            tracer.frame_written(sec, usec)
+
+        return True
+
+    def _frame_open(self) -> bool:
+        return self._mid_frame or super()._frame_open()
+
+    def _frame_done(self):
+        """The uinput got a complete frame, switch the mappings if reload waits for that"""
+        self._mid_frame = False
+        if self._next_context is not None:
+            self._switch(self._next_context)
+
+    async def run(self):
+        logger.debug(
+            "Starting to read raw events from %s, fd %s",
+            self._source.path,
+            self._source.fd,
+        )
+
+        logger.debug("code map: %s", self._context.code_map)
+        self._seed_held_keys()
+
+        loop = asyncio.get_running_loop()
+        self._stopped = loop.create_future()
+
+        loop.add_reader(self._source.fd, self._read)
+        try:
+            await self._stopped
+        finally:
+            loop.remove_reader(self._source.fd)
+
+        logger.error('Reading raw events from "%s" stopped early', self._source.path)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+import fcntl
+import select
+import struct
+import time
+
+from typing import Dict
+
+from evremapper.logger import logger
+from evremapper.shm import SharedArray
+
+# _IOW('E', 0xa0, int), selects the clock of the event timestamps
+EVIOCSCLOCKID = 0x400445A0
+
+# Every power of two is split into this many linear sub buckets, which keeps
+# the error of a recorded value below 1 / _SUB_BUCKETS
+_SUB_BUCKET_BITS = 5
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+# values are in microseconds, anything above ~67 s ends up in the last bucket
+_MAX_VALUE = (1 << 26) - 1
+_BUCKETS = _MAX_VALUE.bit_length() * _SUB_BUCKETS
+
+# layout of the shared array
+_COUNT = 0
+_MAX = 1
+_FIRST_BUCKET = 2
+
+PERCENTILES = {"p50": 0.5, "p99": 0.99, "p999": 0.999}
+
+
+def _bucket(value: int) -> int:
+    shift = value.bit_length() - _SUB_BUCKET_BITS - 1
+    if shift <= 0:
+        return value
+
+    return shift * _SUB_BUCKETS + (value >> shift)
+
+
+def _highest_value(bucket: int) -> int:
+    """The largest value that ends up in this bucket"""
+    shift = bucket // _SUB_BUCKETS - 1
+    if shift <= 0:
+        return bucket
+
+    return ((bucket - shift * _SUB_BUCKETS + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    A fixed size HDR style histogram of latencies in microseconds
+
+    Values are counted in buckets that are linear within each power of two,
+    so the memory is fixed and recording is a few integer operations no
+    matter how many values are recorded. Lives in shared memory so the
+    daemon can read it while the injection writes it.
+    """
+
+    def __init__(self):
+        self._array = SharedArray(_FIRST_BUCKET + _BUCKETS)
+
+    def record(self, value: int):
+        if value < 0:
+            # clock went backwards, or an event with an odd timestamp
+            value = 0
+        elif value > _MAX_VALUE:
+            value = _MAX_VALUE
+
+        values = self._array.values
+        values[_FIRST_BUCKET + _bucket(value)] += 1
+        values[_COUNT] += 1
+        if value > values[_MAX]:
+            values[_MAX] = value
+
+    def summary(self) -> Dict[str, float]:
+        """Get the count, max and PERCENTILES of the recorded values"""
+        values = self._array.values
+        count = values[_COUNT]
+        result = {"count": float(count), "max": float(values[_MAX])}
+
+        targets = sorted(PERCENTILES.items(), key=lambda item: item[1])
+        seen = 0
+        for bucket in range(_BUCKETS):
+            if not targets:
+                break
+
+            seen += values[_FIRST_BUCKET + bucket]
+            while targets and seen >= targets[0][1] * count and count > 0:
+                name, _ = targets.pop(0)
+                result[name] = float(min(_highest_value(bucket), values[_MAX]))
+
+        for name, _ in targets:
+            result[name] = 0.0
+
+        return result
+
+    def close(self):
+        self._array.close()
+
+    def release(self):
+        self._array.release()
+
+
+class LatencyTracer:
+    """
+    Records how much time the injection adds to events
+
+    latency is the time from the kernel timestamp of a frame until its last
+    event was written to the uinput. wakeup, if enabled, is the time until
+    the first event of a frame reached the InputControl.
+    """
+
+    def __init__(self, wakeup: bool = False):
+        self.latency = LatencyHistogram()
+        self.wakeup = LatencyHistogram() if wakeup else None
+
+    @classmethod
+    def from_options(cls, options) -> "LatencyTracer":
+        """Create one if "latency_tracing" is enabled in the injector options"""
+        if not options or not options.get("latency_tracing"):
+            return None
+
+        return cls(wakeup=bool(options.get("wakeup_tracing")))
+
+    @staticmethod
+    def use_monotonic_clock(fd: int) -> bool:
+        """
+        Make the kernel stamp the events of a device with CLOCK_MONOTONIC
+
+        The kernel drops the events that are queued already and puts a
+        SYN_DROPPED in their place. Returns True if there were any.
+        """
+        queued = bool(select.select([fd], [], [], 0)[0])
+        try:
+            fcntl.ioctl(fd, EVIOCSCLOCKID, struct.pack("i", time.CLOCK_MONOTONIC))
+        except OSError as error:
+            logger.error("Failed to switch fd %s to the monotonic clock: %s", fd, error)
+            return False
+
+        return queued
+
+    def frame_written(self, sec: int, usec: int):
+        self.latency.record(time.monotonic_ns() // 1000 - sec * 1000000 - usec)
+
+    def frame_started(self, sec: int, usec: int):
+        self.wakeup.record(time.monotonic_ns() // 1000 - sec * 1000000 - usec)
+
+    def summary(self) -> Dict[str, float]:
+        result = self.latency.summary()
+        if self.wakeup is not None:
+            for name, value in self.wakeup.summary().items():
+                result[f"wakeup_{name}"] = value
+
+        return result
+
+    def close(self):
+        """Stop using the histograms in this process"""
+        self.latency.close()
+        if self.wakeup is not None:
+            self.wakeup.close()
+
+    def release(self):
+        """Free the histograms, they can't be used anywhere after this"""
+        self.latency.release()
+        if self.wakeup is not None:
+            self.wakeup.release()
@@ -1,8 +1,22 @@
 #!/usr/bin/env python3
 
+"""
+Logging that never makes the caller wait for the disk
+
+Records are put into a queue and written to the log file by a thread of
+the process that called add_loghandler. Processes that are started from
+there, like injectors, put their records into a multiprocessing queue that
+the same thread empties, see get_log_setup, so only one process writes to
+and rotates the file.
+"""
+
+import atexit
 import os
 import logging
-import shutil
+import logging.handlers
+import queue
+
+from typing import List
 
 from evremapper.user import HOME
 
@@ -12,8 +26,20 @@ LOG_FILE = (
     else f"{HOME}/.log/ev_remapper.log"
 )
 
+# the log file is rotated once it gets bigger than this, keeping BACKUPS
+# old ones next to it
+MAX_BYTES = 1 << 20
+BACKUPS = 2
+
 logger = logging.getLogger("ev-remapper")
 
+# write the records that were queued, each one in a thread of its own
+_listeners: List[logging.handlers.QueueListener] = []
+# handlers that write to the log file, used by all listeners
+_file_handlers: List[logging.Handler] = []
+# where processes that were started from this one log into, once needed
+_child_queue = None
+
 
 def logger_verbosity(debug):
     if debug:
@@ -22,25 +48,81 @@ def logger_verbosity(debug):
         logger.setLevel(logging.INFO)
 
 
+def _listen(records, handlers: List[logging.Handler]):
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    if not _listeners:
+        # write what is still queued before exiting
+        atexit.register(_stop_listeners)
+
+    _listeners.append(listener)
+
+
+def _stop_listeners():
+    while _listeners:
+        _listeners.pop().stop()
+
+
 def add_loghandler(log_path=LOG_FILE):
     try:
         log_path = os.path.expanduser(log_path)
         os.makedirs(os.path.dirname(log_path), exist_ok=True)
 
         if os.path.isdir(log_path):
+            import shutil
             shutil.rmtree(log_path)  # recursively remove if directory
 
-        if os.path.exists(log_path):
-            with open(log_path, "r") as file:
-                data = file.readlines()[-1000:]
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_path, maxBytes=MAX_BYTES, backupCount=BACKUPS
+        )
+    except PermissionError:
+        logger.debug('permission denied logging to "%s"', log_path)
+        return
+
+    _file_handlers.append(file_handler)
+    records = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    _listen(records, [file_handler])
 
-            with open(log_path, "w") as file:
-                file.truncate(0)
-                file.writelines(data)
+    logger.debug('Started logging to "%s"', log_path)
 
-        file_handler = logging.FileHandler(log_path)
-        logger.addHandler(file_handler)
 
-        logger.debug('Started logging to "%s"', log_path)
-    except PermissionError:
-        logger.debug('permission denied logging to "%s"', log_path)
+def get_log_setup():
+    """What a process that is started from this one needs to log the same way"""
+    global _child_queue
+
+    if _child_queue is None and _file_handlers:
+        # not at the top, ev-remapper-control doesn't need it and should
+        # start quickly
+        import multiprocessing
+
+        # sent to injectors from the zygote, which can't get the locks of a
+        # queue from the default fork context. Forked ones inherit it anyway
+        _child_queue = multiprocessing.get_context("forkserver").Queue()
+        _listen(_child_queue, _file_handlers)
+
+    return logger.level, _child_queue
+
+
+def restore_log_setup(setup):
+    """
+    Apply what get_log_setup returned in another process
+
+    Also needed for forked processes, the thread that writes the records of
+    the parent doesn't exist in them.
+    """
+    global _child_queue
+
+    level, records = setup
+    # processes started from this one log into the same queue
+    _child_queue = records
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    # inherited from the parent when forked
+    _listeners.clear()
+    _file_handlers.clear()
+
+    logger.setLevel(level)
+    if records is not None:
+        logger.addHandler(logging.handlers.QueueHandler(records))
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+import os
+import time
+
+from typing import Dict, List
+
+import evdev
+
+from evremapper.configs.context import RuntimeContext, _CODE_COUNTS
+from evremapper.latency import LatencyHistogram, LatencyTracer
+from evremapper.shm import SharedArray
+
+# default of the "motion_latency_budget_us" injector option
+MOTION_LATENCY_BUDGET_US = 1000
+
+
+class Counters:
+    """
+    Named counters in shared memory
+
+    Like LatencyHistogram, the injection increments them with plain memory
+    writes while the daemon reads them. Increment values[index] with the
+    index of a name in names.
+    """
+
+    def __init__(self, names: List[str]):
+        self.names = list(names)
+        self._array = SharedArray(len(self.names))
+        self.values = self._array.values
+
+    def __getstate__(self):
+        # the memoryview can't be pickled, it is recreated from the array
+        return {"names": self.names, "_array": self._array}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.values = self._array.values
+
+    def summary(self) -> Dict[str, float]:
+        return {name: float(self.values[index]) for index, name in enumerate(self.names)}
+
+    def close(self):
+        self.values = None
+        self._array.close()
+
+    def release(self):
+        self.values = None
+        self._array.release()
+
+
+# event type -> where the counters of its codes start in
+# InjectionCounters.remapped, for the types that can be mapped
+REMAPPED_OFFSETS = [0] * evdev.ecodes.EV_CNT
+REMAPPED_SLOTS = 0
+for _ev_type, _count in sorted(_CODE_COUNTS.items()):
+    REMAPPED_OFFSETS[_ev_type] = REMAPPED_SLOTS
+    REMAPPED_SLOTS += _count
+
+
+class InjectionCounters(Counters):
+    """
+    What the injection of a group did, for all of its devices
+
+    events_read and events_forwarded count events, write_errors failed
+    writes to a uinput, grabs the devices that were grabbed and regrabs the
+    attempts to grab a busy device again. remapped has a counter for each
+    event code of the types that can be mapped, at REMAPPED_OFFSETS[type] +
+    code, for the events that the mappings gave another code.
+    """
+
+    EVENTS_READ = 0
+    EVENTS_FORWARDED = 1
+    WRITE_ERRORS = 2
+    GRABS = 3
+    REGRABS = 4
+
+    def __init__(self):
+        super().__init__(["events_read", "events_forwarded", "write_errors", "grabs", "regrabs"])
+        self._remapped_array = SharedArray(REMAPPED_SLOTS)
+        self.remapped = self._remapped_array.values
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["_remapped_array"] = self._remapped_array
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.remapped = self._remapped_array.values
+
+    def summary(self, context: RuntimeContext = None) -> Dict[str, float]:
+        """The counters, and remapped_<code name> for each mapping of the context"""
+        result = super().summary()
+        if context is None:
+            return result
+
+        for ev_type, code in context.code_map:
+            name = evdev.ecodes.bytype[ev_type].get(code, code)
+            if isinstance(name, (list, tuple)):
+                name = name[0]
+
+            result[f"remapped_{name}"] = float(self.remapped[REMAPPED_OFFSETS[ev_type] + code])
+
+        return result
+
+    def close(self):
+        super().close()
+        self.remapped = None
+        self._remapped_array.close()
+
+    def release(self):
+        super().release()
+        self.remapped = None
+        self._remapped_array.release()
+
+
+def cpu_seconds(pid: int) -> float:
+    """CPU time that a process used so far, user and system, 0 if it is gone"""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as file:
+            stat = file.read()
+    except OSError:
+        return 0.0
+
+    # the name in parentheses may contain spaces, utime and stime are the
+    # 14th and 15th field
+    fields = stat[stat.rindex(")") + 2:].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class Overflows(Counters):
+    """
+    How often the kernel dropped events of a group because the injection fell behind
+
+    overflows counts SYN_DROPPED events, discarded the events that were
+    thrown away after them until the frame was over, and resynced_keys the
+    keys that were pressed or released on the uinput to catch up with the
+    source afterwards. The SYN_DROPPED that switching a device to the
+    monotonic clock may cause is not counted as an overflow.
+    """
+
+    OVERFLOWS = 0
+    DISCARDED = 1
+    RESYNCED_KEYS = 2
+
+    def __init__(self):
+        super().__init__(["overflows", "discarded", "resynced_keys"])
+
+
+class MotionCoalescing:
+    """
+    Settings and statistics of merging mouse motion, see RawInputControl
+
+    Frames that only move the mouse and are already older than the budget
+    when they are read are merged with the motion frames that came after
+    them. received and forwarded count events, coalesced counts frames that
+    were merged into the next one. queue_delay is how long the oldest event
+    of each read waited in the kernel, in microseconds.
+    """
+
+    RECEIVED = 0
+    FORWARDED = 1
+    COALESCED = 2
+
+    def __init__(self, budget_us: int = MOTION_LATENCY_BUDGET_US):
+        self.budget_us = budget_us
+        self.counters = Counters(["received", "forwarded", "coalesced"])
+        self.queue_delay = LatencyHistogram()
+
+    @classmethod
+    def from_options(cls, options) -> "MotionCoalescing":
+        """Create one if "coalesce_motion" is enabled in the injector options"""
+        if not options or not options.get("coalesce_motion"):
+            return None
+
+        return cls(int(options.get("motion_latency_budget_us", MOTION_LATENCY_BUDGET_US)))
+
+    def read(self, events: int, sec: int, usec: int) -> int:
+        """Count events that were read, returns how long the oldest one waited"""
+        self.counters.values[self.RECEIVED] += events
+        delay = time.monotonic_ns() // 1000 - sec * 1000000 - usec
+        self.queue_delay.record(delay)
+        return delay
+
+    def summary(self) -> Dict[str, float]:
+        result = self.counters.summary()
+        for name, value in self.queue_delay.summary().items():
+            result[f"queue_delay_{name}"] = value
+
+        return result
+
+    def close(self):
+        """Stop using the shared memory in this process"""
+        self.counters.close()
+        self.queue_delay.close()
+
+    def release(self):
+        """Free the shared memory, it can't be used anywhere after this"""
+        self.counters.release()
+        self.queue_delay.release()
+
+
+class InjectionStats:
+    """
+    All the shared memory of one injection, written by it and read by the daemon
+
+    tracer and motion are None unless the injector options enable them, see
+    from_options. Everything is freed at once with release.
+    """
+
+    def __init__(self,
+                 tracer: LatencyTracer = None,
+                 motion: MotionCoalescing = None,
+                 overflows: Overflows = None,
+                 counters: InjectionCounters = None):
+        self.tracer = tracer
+        self.motion = motion
+        self.overflows = overflows
+        self.counters = counters
+
+    @classmethod
+    def from_options(cls, options) -> "InjectionStats":
+        return cls(
+            LatencyTracer.from_options(options),
+            MotionCoalescing.from_options(options),
+            Overflows(),
+            InjectionCounters(),
+        )
+
+    def _parts(self):
+        return [
+            part
+            for part in (self.tracer, self.motion, self.overflows, self.counters)
+            if part is not None
+        ]
+
+    def close(self):
+        """Stop using the shared memory in this process"""
+        for part in self._parts():
+            part.close()
+
+    def release(self):
+        """Free the shared memory, it can't be used anywhere after this"""
+        for part in self._parts():
+            part.release()
+
+        self.tracer = None
+        self.motion = None
+        self.overflows = None
+        self.counters = None
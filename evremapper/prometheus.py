@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+"""
+Serves the metrics of all injections in the Prometheus text format
+
+Listens on a unix socket and answers every connection with a minimal HTTP
+response, so it can be read with
+`curl --unix-socket /run/ev-remapper/metrics.sock http://localhost/metrics`
+or scraped through a proxy. Like the control socket, it runs in the GLib
+main loop of the daemon and only imports GLib once it starts.
+"""
+
+import os
+import socket
+
+from typing import Callable, Dict, Optional, Tuple
+
+from evremapper.logger import logger
+
+# device key -> metric -> value, see Daemon.get_metrics
+Samples = Dict[str, Dict[str, float]]
+# process -> seconds of CPU time it used, "engine" or the key of the device
+# that it injects
+CpuSeconds = Dict[str, float]
+
+# seconds that a client has to send its request and read the metrics
+TIMEOUT = 2
+
+PREFIX = "evremapper_"
+REMAPPED = "remapped_"
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_metrics(samples: Samples, cpu: Optional[CpuSeconds] = None) -> str:
+    """
+    Write samples in the Prometheus text format
+
+    Each metric becomes evremapper_<metric>_total with a device label. The
+    remapped_<code> metrics of all codes are one evremapper_remapped_total
+    with an additional code label. The CPU time of the processes that
+    inject is evremapper_cpu_seconds_total with a process label, once for
+    each process.
+    """
+    # metric -> lines
+    metrics: Dict[str, list] = {}
+    for device_key, values in sorted(samples.items()):
+        device = _label(device_key)
+        for name, value in values.items():
+            labels = f'device="{device}"'
+            if name.startswith(REMAPPED):
+                labels += f',code="{_label(name[len(REMAPPED):])}"'
+                name = "remapped"
+
+            metric = f"{PREFIX}{name}_total"
+            metrics.setdefault(metric, []).append(f"{metric}{{{labels}}} {value}")
+
+    for process, value in sorted((cpu or {}).items()):
+        metric = f"{PREFIX}cpu_seconds_total"
+        metrics.setdefault(metric, []).append(f'{metric}{{process="{_label(process)}"}} {value}')
+
+    lines = []
+    for metric, metric_lines in metrics.items():
+        lines.append(f"# TYPE {metric} counter")
+        lines.extend(metric_lines)
+
+    return "\n".join(lines) + "\n"
+
+
+class _Client:
+    """A connection that is still being answered"""
+
+    def __init__(self, connection: socket.socket):
+        self.connection = connection
+        # what is left to send, once the request arrived
+        self.response = b""
+        self.watch = None
+        self.timeout = None
+
+
+class MetricsServer:
+    """
+    Answers each connection with the metrics that collect returns
+
+    collect returns the samples of the devices and the CPU time of the
+    processes, see format_metrics. The request is read but not looked at,
+    whatever is asked for gets the metrics.
+    Collecting only reads shared memory and /proc, it is done right in the
+    main loop. Reading the request and sending the metrics happen whenever
+    the client is ready, so a slow one doesn't hold up the main loop.
+    """
+
+    def __init__(self, collect: Callable[[], Tuple[Samples, CpuSeconds]], path: str):
+        self._collect = collect
+        self.path = path
+        self._socket: socket.socket = None
+        self._watch = None
+
+    def start(self) -> bool:
+        from gi.repository import GLib
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if os.path.exists(self.path):
+                # left over from a previous run
+                os.unlink(self.path)
+
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM | socket.SOCK_CLOEXEC)
+            self._socket.bind(self.path)
+            os.chmod(self.path, 0o666)
+            self._socket.listen(16)
+            self._socket.setblocking(False)
+        except OSError as error:
+            logger.error('Failed to serve metrics at "%s": %s', self.path, error)
+            self._socket = None
+            return False
+
+        self._watch = GLib.io_add_watch(
+            self._socket.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, self._accept
+        )
+        logger.info('Serving metrics at "%s"', self.path)
+        return True
+
+    def stop(self):
+        from gi.repository import GLib
+
+        if self._watch is not None:
+            GLib.source_remove(self._watch)
+            self._watch = None
+
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            os.unlink(self.path)
+
+    def _accept(self, *_):
+        from gi.repository import GLib
+
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except BlockingIOError:
+                return True
+
+            connection.setblocking(False)
+            client = _Client(connection)
+            client.watch = GLib.io_add_watch(
+                connection.fileno(),
+                GLib.PRIORITY_DEFAULT,
+                GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR,
+                self._read,
+                client,
+            )
+            client.timeout = GLib.timeout_add_seconds(TIMEOUT, self._timed_out, client)
+
+    def _read(self, _fd, _condition, client: _Client):
+        from gi.repository import GLib
+
+        try:
+            # closing with an unread request would reset the connection
+            client.connection.recv(4096)
+        except BlockingIOError:
+            return True
+        except OSError as error:
+            logger.error("Failed to read a metrics request: %s", error)
+            self._close(client)
+            return False
+
+        body = format_metrics(*self._collect()).encode()
+        header = (
+            "HTTP/1.0 200 OK\r\n"
+            "Content-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "\r\n"
+        ).encode()
+        client.response = header + body
+        client.watch = GLib.io_add_watch(
+            client.connection.fileno(),
+            GLib.PRIORITY_DEFAULT,
+            GLib.IO_OUT | GLib.IO_HUP | GLib.IO_ERR,
+            self._write,
+            client,
+        )
+        return False
+
+    def _write(self, _fd, _condition, client: _Client):
+        try:
+            sent = client.connection.send(client.response)
+        except BlockingIOError:
+            return True
+        except OSError as error:
+            logger.error("Failed to send metrics: %s", error)
+            self._close(client)
+            return False
+
+        client.response = client.response[sent:]
+        if client.response:
+            return True
+
+        self._close(client)
+        return False
+
+    def _timed_out(self, client: _Client):
+        from gi.repository import GLib
+
+        logger.error("Metrics client didn't finish in time")
+        client.timeout = None
+        GLib.source_remove(client.watch)
+        self._close(client)
+        return False
+
+    @staticmethod
+    def _close(client: _Client):
+        """Close a client while its watch is being removed"""
+        from gi.repository import GLib
+
+        client.watch = None
+        if client.timeout is not None:
+            GLib.source_remove(client.timeout)
+            client.timeout = None
+
+        client.connection.close()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+"""
+Keeps injections responsive while the rest of the system is busy
+
+The "realtime" injector option is a profile for the process that injects,
+for example {"policy": "fifo", "priority": 10, "cpus": [3], "mlock": true,
+"gc": "freeze"}. It is applied once the injection is set up. Settings that
+need privileges the process doesn't have are skipped with an error in the
+log, the injection runs anyway.
+"""
+
+import ctypes
+import ctypes.util
+import gc
+import os
+
+from typing import Dict, Optional
+
+from evremapper.logger import logger
+
+POLICIES = {"fifo": os.SCHED_FIFO, "rr": os.SCHED_RR, "other": os.SCHED_OTHER}
+
+# from sys/mman.h
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+# "gc" settings. Both collect and move everything that setting up created
+# into the permanent generation, which collections don't look at anymore.
+# "disable" also turns off collections for the hot loop, forwarding
+# doesn't create reference cycles
+GC_MODES = ["default", "freeze", "disable"]
+
+Profile = dict
+
+
+def _mlockall():
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def _apply(applied: Dict[str, bool], name: str, setting, apply):
+    try:
+        apply()
+    except (OSError, ValueError, TypeError) as error:
+        logger.error('Failed to apply the realtime setting %s=%s: %s', name, setting, error)
+        applied[name] = False
+        return
+
+    applied[name] = True
+
+
+def _set_scheduler(policy: str, priority: Optional[int]):
+    if policy not in POLICIES:
+        raise ValueError(f'expected one of {", ".join(POLICIES)}')
+
+    if policy == "other":
+        priority = 0
+    elif priority is None:
+        priority = 1
+
+    os.sched_setscheduler(0, POLICIES[policy], os.sched_param(int(priority)))
+
+
+def _set_gc(mode: str, threshold: Optional[int]):
+    if mode not in GC_MODES:
+        raise ValueError(f'expected one of {", ".join(GC_MODES)}')
+
+    if threshold is not None:
+        gc.set_threshold(int(threshold), *gc.get_threshold()[1:])
+
+    if mode == "default":
+        return
+
+    gc.collect()
+    gc.freeze()
+    if mode == "disable":
+        gc.disable()
+
+
+def apply_profile(profile: Optional[Profile]) -> Dict[str, bool]:
+    """
+    Apply a realtime profile to the current process
+
+    Returns which of the settings of the profile were applied. "priority"
+    and "gc_threshold" count as part of "policy" and "gc".
+    """
+    applied: Dict[str, bool] = {}
+    if not profile:
+        return applied
+
+    if "policy" in profile:
+        _apply(
+            applied,
+            "policy",
+            profile["policy"],
+            lambda: _set_scheduler(profile["policy"], profile.get("priority")),
+        )
+
+    if "nice" in profile:
+        # absolute, not relative to what it was
+        _apply(
+            applied,
+            "nice",
+            profile["nice"],
+            lambda: os.setpriority(os.PRIO_PROCESS, 0, int(profile["nice"])),
+        )
+
+    if "cpus" in profile:
+        _apply(applied, "cpus", profile["cpus"], lambda: os.sched_setaffinity(0, profile["cpus"]))
+
+    if profile.get("mlock"):
+        _apply(applied, "mlock", True, _mlockall)
+
+    if "gc" in profile or "gc_threshold" in profile:
+        _apply(
+            applied,
+            "gc",
+            profile.get("gc", "default"),
+            lambda: _set_gc(profile.get("gc", "default"), profile.get("gc_threshold")),
+        )
+
+    logger.info(
+        "Applied the realtime settings: %s, failed: %s",
+        ", ".join(name for name, ok in applied.items() if ok) or "none",
+        ", ".join(name for name, ok in applied.items() if not ok) or "none",
+    )
+    return applied
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+"""
+Records the events of an injection into a trace file, to replay them later
+
+A trace is a memory-mapped file with two rings of struct input_event
+records, the events as they were read from the devices and as they were
+written to the uinputs. Recording only copies them into the mapping, its
+size and cost stay the same no matter how long it runs. Once a ring is full
+the oldest events of it are overwritten.
+
+Received events keep the timestamp of the kernel, emitted ones are stamped
+with the time they were written, on the same clock. Records are in the
+byte order and word size of the machine that recorded them.
+"""
+
+import mmap
+import multiprocessing.reduction
+import os
+import stat
+import struct
+import time
+
+from collections import namedtuple
+
+from evremapper.frame_writer import EVENT_STRUCT, EVENT_SIZE
+from evremapper.logger import logger
+
+# default of the "recording_events" injector option, the size of each ring
+RECORDING_EVENTS = 1 << 16
+
+# magic, format version, flags, events per ring and padding, followed by
+# how many events were received and emitted so far
+_HEADER = struct.Struct("=4sHHII")
+_COUNTS = struct.Struct("=QQ")
+_MAGIC = b"EVRT"
+_VERSION = 1
+# flag for timestamps from CLOCK_MONOTONIC instead of CLOCK_REALTIME
+MONOTONIC = 1
+
+# where the rings start
+_DATA = _HEADER.size + _COUNTS.size
+_LONG_SIZE = struct.calcsize("l")
+
+RECEIVED = 0
+EMITTED = 1
+
+# received and emitted are lists of (sec, usec, type, code, value), oldest
+# first. The totals also count the events that were overwritten
+Trace = namedtuple(
+    "Trace", ["monotonic", "received", "emitted", "received_total", "emitted_total"]
+)
+
+
+def _file_size(capacity: int) -> int:
+    return _DATA + 2 * capacity * EVENT_SIZE
+
+
+def init_trace(fd: int, capacity: int = RECORDING_EVENTS):
+    """
+    Make an empty file a trace with room for capacity events in each ring
+
+    The service runs as root, so it doesn't open files for others. Whoever
+    wants a recording opens the file and hands over the fd.
+    """
+    if capacity <= 0:
+        raise ValueError(f"expected at least one event per ring, got {capacity}")
+
+    status = os.fstat(fd)
+    if not stat.S_ISREG(status.st_mode) or status.st_size != 0:
+        raise ValueError("expected an empty file to record into")
+
+    os.ftruncate(fd, _file_size(capacity))
+    os.pwrite(fd, _HEADER.pack(_MAGIC, _VERSION, 0, capacity, 0) + _COUNTS.pack(0, 0), 0)
+
+
+def _rebuild(dup) -> "TraceFile":
+    return TraceFile(dup.detach())
+
+
+class TraceFile:
+    """
+    The fd of a trace, sending it to another process duplicates the fd
+
+    The receiving process owns its duplicate, Recorder closes it.
+    """
+
+    def __init__(self, fd: int):
+        self.fd = fd
+
+    def __reduce__(self):
+        return _rebuild, (multiprocessing.reduction.DupFd(self.fd),)
+
+
+class Recorder:
+    """
+    Copies the events of an injection into a trace that init_trace made
+
+    Takes over the fd of the trace. monotonic tells if the devices were
+    switched to CLOCK_MONOTONIC, see LatencyTracer.use_monotonic_clock.
+    Raises ValueError if the file is not an empty trace.
+    """
+
+    def __init__(self, fd: int, monotonic: bool = False):
+        try:
+            self._mmap = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+
+        magic, version, _, capacity, _ = _HEADER.unpack_from(self._mmap)
+        if magic != _MAGIC or version != _VERSION or len(self._mmap) != _file_size(capacity):
+            self._mmap.close()
+            raise ValueError("the file is not a trace")
+
+        _HEADER.pack_into(
+            self._mmap, 0, _MAGIC, _VERSION, MONOTONIC if monotonic else 0, capacity, 0
+        )
+
+        self.capacity = capacity
+        self._clock = time.monotonic_ns if monotonic else time.time_ns
+        self._rings = (_DATA, _DATA + capacity * EVENT_SIZE)
+        # read by read_trace to know where the rings end
+        self._counts = memoryview(self._mmap)[_HEADER.size:_DATA].cast("Q")
+        # to stamp emitted events in place
+        self._longs = memoryview(self._mmap).cast("l")
+
+    def received(self, sec: int, usec: int, type: int, code: int, value: int):
+        """Record one event that was read"""
+        index = self._counts[RECEIVED]
+        EVENT_STRUCT.pack_into(
+            self._mmap,
+            _DATA + index % self.capacity * EVENT_SIZE,
+            sec,
+            usec,
+            type,
+            code,
+            value,
+        )
+        self._counts[RECEIVED] = index + 1
+
+    def received_events(self, view: memoryview):
+        """Record a buffer of events that were read"""
+        self._copy(RECEIVED, view)
+
+    def emitted_events(self, view: memoryview):
+        """Record a buffer of events that were written, stamped with the current time"""
+        first = self._copy(EMITTED, view)
+        sec, usec = divmod(self._clock() // 1000, 1000000)
+
+        longs = self._longs
+        capacity = self.capacity
+        ring = self._rings[EMITTED]
+        for index in range(first, self._counts[EMITTED]):
+            at = (ring + index % capacity * EVENT_SIZE) // _LONG_SIZE
+            longs[at] = sec
+            longs[at + 1] = usec
+
+    def _copy(self, which: int, view: memoryview) -> int:
+        """Copy events into a ring, returns the index of the first one that was kept"""
+        count = len(view) // EVENT_SIZE
+        index = self._counts[which]
+        capacity = self.capacity
+        if count > capacity:
+            # only the newest ones fit
+            view = view[(count - capacity) * EVENT_SIZE:]
+            index += count - capacity
+            count = capacity
+
+        first = index
+        ring = self._rings[which]
+        while count:
+            slot = index % capacity
+            chunk = min(count, capacity - slot)
+            start = ring + slot * EVENT_SIZE
+            self._mmap[start:start + chunk * EVENT_SIZE] = view[:chunk * EVENT_SIZE]
+            view = view[chunk * EVENT_SIZE:]
+            index += chunk
+            count -= chunk
+
+        self._counts[which] = index
+        return first
+
+    def close(self):
+        """Stop recording, what was recorded stays in the file"""
+        if self._mmap is None:
+            return
+
+        logger.info(
+            "Recorded %d received and %d emitted events",
+            self._counts[RECEIVED],
+            self._counts[EMITTED],
+        )
+        self._counts.release()
+        self._longs.release()
+        self._mmap.flush()
+        self._mmap.close()
+        self._mmap = None
+
+
+def read_trace(path: str) -> Trace:
+    """Read what a Recorder recorded, raises ValueError if it is not a trace"""
+    with open(path, "rb") as file:
+        data = file.read()
+
+    try:
+        magic, version, flags, capacity, _ = _HEADER.unpack_from(data)
+        totals = _COUNTS.unpack_from(data, _HEADER.size)
+    except struct.error:
+        raise ValueError(f'"{path}" is not a trace')
+
+    if magic != _MAGIC or version != _VERSION or len(data) != _file_size(capacity):
+        raise ValueError(f'"{path}" is not a trace')
+
+    rings = []
+    for which, total in enumerate(totals):
+        start = _DATA + which * capacity * EVENT_SIZE
+        events = list(EVENT_STRUCT.iter_unpack(data[start:start + capacity * EVENT_SIZE]))
+        if total <= capacity:
+            rings.append(events[:total])
+        else:
+            # the oldest event is the one that would be overwritten next
+            slot = total % capacity
+            rings.append(events[slot:] + events[:slot])
+
+    return Trace(bool(flags & MONOTONIC), rings[RECEIVED], rings[EMITTED], *totals)
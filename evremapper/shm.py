@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+from multiprocessing import shared_memory
+
+
+class SharedArray:
+    """
+    A fixed size array of unsigned 64 bit integers in shared memory
+
+    Created by the daemon and written to by the process that injects. A
+    forked Injector inherits the mapping, for the InjectionEngine or any
+    other process it is handed to, it pickles into a reference to the same
+    memory. Writing a value is a plain memory access without any syscall.
+    """
+
+    def __init__(self, length: int, name: str = None):
+        self.length = length
+
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=length * 8)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+
+        self.values = self._shm.buf.cast("Q")
+
+    def __reduce__(self):
+        return SharedArray, (self.length, self._shm.name)
+
+    def close(self):
+        """Unmap the memory in this process"""
+        self.values.release()
+        self._shm.close()
+
+    def release(self):
+        """Unmap the memory and remove it once everyone else unmapped it too"""
+        self.close()
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
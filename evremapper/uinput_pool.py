@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+"""
+Keeps the uinputs of injections alive between injector processes
+
+Creating a uinput makes udev, libinput and the desktop tear down and set up
+a device, which takes a while and makes the cursor or keyboard hiccup. The
+daemon creates the uinputs itself and hands a duplicate of their fd to the
+injector, so restarting the injector with other mappings or settings
+writes to the same device again.
+"""
+
+import os
+import time
+import multiprocessing.reduction
+
+from typing import Dict, List, Optional, Tuple
+
+import evdev
+
+from evremapper.devices import _DeviceGroup, DeviceDescriptor
+from evremapper.logger import logger
+from evremapper.configs.context import RuntimeContext
+from evremapper.frame_writer import FrameWriter
+from evremapper.injector import copy_capabilities, grab_reason, udev_name
+
+PoolKey = Tuple[str, tuple]
+
+
+def _rebuild(dup, name: str, device_path: str, reused: bool) -> "PooledUInput":
+    return PooledUInput(dup.detach(), name, device_path, reused)
+
+
+class PooledUInput:
+    """
+    What an injection gets instead of an evdev.UInput from the pool
+
+    Offers the fd and name that forwarding needs. Sending it to another
+    process duplicates the fd, closing it there only closes the duplicate,
+    the device stays until the pool closes it.
+    """
+
+    def __init__(self, fd: int, name: str, device_path: str, reused: bool):
+        self.fd = fd
+        self.name = name
+        # the /dev/input node that the uinput created
+        self.device_path = device_path
+        # if an earlier injection already wrote to it
+        self.reused = reused
+
+    def __reduce__(self):
+        dup = multiprocessing.reduction.DupFd(self.fd)
+        return _rebuild, (dup, self.name, self.device_path, self.reused)
+
+    def release_keys(self):
+        """Release keys that a previous injection left pressed"""
+        try:
+            device = evdev.InputDevice(self.device_path)
+        except OSError as error:
+            logger.debug('Could not look for pressed keys on "%s": %s', self.device_path, error)
+            return
+
+        try:
+            active_keys = device.active_keys()
+        finally:
+            device.close()
+
+        if not active_keys:
+            return
+
+        logger.debug('Releasing %d keys that were left pressed on "%s"', len(active_keys), self.name)
+        writer = FrameWriter(self.fd)
+        for code in active_keys:
+            writer.write(evdev.ecodes.EV_KEY, code, 0)
+
+        writer.write(evdev.ecodes.EV_SYN, evdev.ecodes.SYN_REPORT, 0)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class _PoolEntry:
+    def __init__(self, key: PoolKey, uinput: evdev.UInput, group_key: str):
+        self.key = key
+        self.uinput = uinput
+        # the group that uses it, None if nobody does
+        self.group_key: Optional[str] = group_key
+
+
+def pool_key(descriptor: DeviceDescriptor) -> PoolKey:
+    capabilities = copy_capabilities(descriptor.capabilities)
+    return (
+        descriptor.identifier,
+        tuple(sorted((ev_type, tuple(codes)) for ev_type, codes in capabilities.items())),
+    )
+
+
+class UInputPool:
+    """
+    The uinputs of all injections, lives in the daemon
+
+    A uinput belongs to a group from the moment it is handed out until the
+    device that it copies is gone, see evict, or until the group stops
+    using the pool with release. It is kept while the group is not
+    injected. The same group with other mappings or injector settings, or
+    after it was stopped, gets it back, which is counted as a hit.
+    """
+
+    def __init__(self):
+        self._entries: List[_PoolEntry] = []
+
+        self.hits = 0
+        self.misses = 0
+        # seconds that creating all the uinputs took
+        self.created_in = 0.0
+
+    def acquire(self, group: _DeviceGroup, context: RuntimeContext) -> Dict[str, PooledUInput]:
+        """
+        Get uinputs for the devices of the group that the mappings need
+
+        Maps device paths to their uinputs, devices that are missing are
+        left for the injection to copy itself. uinputs of the group that
+        the new mappings don't need anymore are closed.
+        """
+        taken: List[_PoolEntry] = []
+        uinputs: Dict[str, PooledUInput] = {}
+
+        for path in group.paths:
+            descriptor = group.get_descriptor(path)
+            if descriptor is None or grab_reason(context, descriptor.codes) is None:
+                continue
+
+            key = pool_key(descriptor)
+            entry = self._find(key, group.key, taken)
+            reused = entry is not None
+            if reused:
+                self.hits += 1
+            else:
+                entry = self._create(key, descriptor, group.key)
+                if entry is None:
+                    continue
+
+            entry.group_key = group.key
+            taken.append(entry)
+            uinputs[path] = PooledUInput(
+                entry.uinput.fd, entry.uinput.name, entry.uinput.device.path, reused
+            )
+
+        for entry in list(self._entries):
+            if entry.group_key == group.key and entry not in taken:
+                self._close(entry)
+
+        return uinputs
+
+    def release(self, group_key: str):
+        """Close the uinputs of a group that isn't injected anymore"""
+        for entry in list(self._entries):
+            if entry.group_key == group_key:
+                self._close(entry)
+
+    def evict(self, identifiers):
+        """Close the uinputs of devices that are not among the identifiers anymore"""
+        for entry in list(self._entries):
+            if entry.key[0] not in identifiers:
+                logger.debug('Evicting "%s", its device is gone', entry.uinput.name)
+                self._close(entry)
+
+    def close(self):
+        for entry in list(self._entries):
+            self._close(entry)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        How well the pool works
+
+        size, hits, misses, hit_rate and saved_ms, which assumes that each
+        hit saved as long as creating a uinput took on average.
+        """
+        requests = self.hits + self.misses
+        created_ms = self.created_in * 1000 / self.misses if self.misses else 0.0
+        return {
+            "size": float(len(self._entries)),
+            "hits": float(self.hits),
+            "misses": float(self.misses),
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "saved_ms": self.hits * created_ms,
+        }
+
+    def _find(self, key: PoolKey, group_key: str, taken: List[_PoolEntry]) -> Optional[_PoolEntry]:
+        for entry in self._entries:
+            if entry.key != key or entry in taken:
+                continue
+
+            if entry.group_key is None or entry.group_key == group_key:
+                return entry
+
+        return None
+
+    def _create(self, key: PoolKey, descriptor: DeviceDescriptor, group_key: str) -> Optional[_PoolEntry]:
+        start = time.perf_counter()
+        try:
+            uinput = evdev.UInput(
+                name=udev_name(descriptor.name),
+                events=copy_capabilities(descriptor.capabilities),
+                vendor=descriptor.info.vendor,
+                product=descriptor.info.product,
+                version=descriptor.info.version,
+                bustype=descriptor.info.bustype,
+                input_props=descriptor.input_props,
+            )
+        except (OSError, evdev.UInputError) as error:
+            # the injection tries again itself and reports the error
+            logger.error('Failed to create a uinput for "%s": %s', descriptor.path, error)
+            return None
+
+        elapsed = time.perf_counter() - start
+        self.misses += 1
+        self.created_in += elapsed
+        logger.debug('Created uinput "%s" in %d ms', uinput.name, elapsed * 1000)
+
+        entry = _PoolEntry(key, uinput, group_key)
+        self._entries.append(entry)
+        return entry
+
+    def _close(self, entry: _PoolEntry):
+        self._entries.remove(entry)
+        try:
+            entry.uinput.close()
+        except OSError as error:
+            logger.debug('Failed to close uinput "%s": %s', entry.uinput.name, error)